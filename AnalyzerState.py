@@ -0,0 +1,150 @@
+import contextlib
+import os
+import numpy as np
+import pandas as pd
+import AtomicFile as af
+import DedupeIndex as di
+import LazyModule as lm
+import ParquetStore as ps
+
+
+gensim = lm.LazyModule('gensim')
+sparse = lm.LazyModule('scipy.sparse')
+
+
+class AnalyzerState:
+    """Class that keeps what HateSpeechAnalyzer.analyze_incremental has done in
+    earlier runs, saved in a directory: the ids of the comments that have been
+    processed, hashes of the texts that have been kept, the gensim Dictionary
+    with the cumulative document frequencies and term counts, the word count
+    matrix of all kept comments and the scored comments themselves. A run only
+    has to process the comments that are new since the last run.
+
+    With near_duplicates=True texts that are near duplicates of kept texts are
+    removed as well, see DedupeIndex. The results then can depend on how the
+    comments were split over the runs. The setting is saved with the state.
+
+    Example:
+        import AnalyzerState as ast
+        state = ast.AnalyzerState('data/TheRedPill_state/')
+        a.analyze_incremental('body', state, regex=regex_input,
+                              disallowed=comment_list)
+        state.save()
+    """
+
+
+
+    def __init__(self, directory_path, near_duplicates=False):
+
+        self.directory_path = directory_path
+        self.ids = set()
+        self.texts = di.DedupeIndex(near_duplicates=near_duplicates)
+        self.dictionary = gensim.corpora.Dictionary()
+        self.counts = sparse.csr_matrix((0, 0))
+        self.runs = 0
+
+        if os.path.exists(self.__path('dictionary.gensim')):
+            self.__load()
+
+
+
+    def new_rows(self, ids):
+        """Returns a boolean mask of the ids that have not been processed.
+
+        Example: a.data = a.data[state.new_rows(a.data['id'])]
+        """
+
+        return np.array([id not in self.ids for id in ids], dtype=bool)
+
+
+
+    def new_texts(self, texts):
+        """Returns a boolean mask that is True for the first occurrence of each
+        text that has not been kept before. Doesn't add them to the state."""
+
+        return self.texts.is_new(texts)
+
+
+
+    def add(self, ids, data, column, counts):
+        """Adds a processed run to the state: the ids of all comments in it,
+        the scored comments that were kept, the column with their texts and
+        their word count matrix, built with self.dictionary."""
+
+        self.ids.update(ids)
+        self.texts.add(data[column])
+
+        n_words = len(self.dictionary)
+        old = self.counts
+        old.resize((old.shape[0], n_words))
+        counts.resize((counts.shape[0], n_words))
+        self.counts = sparse.vstack([old, counts], format='csr')
+
+        # A run that crashed before save() left files with the same name.
+        store = ps.ParquetStore(self.__path('data.parquet'))
+        store.remove('data_' + str(self.runs))
+        store.write(data, 'data_' + str(self.runs))
+        self.runs += 1
+
+
+
+    def data(self, columns=None):
+        """Returns all scored comments kept so far.
+
+        Example: df = state.data(columns=['body', 'top_class'])
+        """
+
+        return ps.ParquetStore(self.__path('data.parquet')).read(columns=columns)
+
+
+
+    def word_count(self):
+        """Returns a DataFrame with the count of every word in all kept
+        comments, in the same form and order as the count_df of tf_idf.
+
+        Example: count_df = state.word_count()
+        """
+
+        words = [self.dictionary[id] for id in range(len(self.dictionary))]
+        counts = [self.dictionary.cfs.get(id, 0) for id in range(len(words))]
+        count_df = pd.DataFrame({'Word': words, 'Count': counts})
+        return count_df.sort_values('Word', ignore_index=True)
+
+
+
+    def save(self):
+        """Saves the state to its directory. All files are written under
+        temporary names first and then moved in place together.
+
+        Example: state.save()
+        """
+
+        os.makedirs(self.directory_path, exist_ok=True)
+        files = {'ids.npy': lambda f: np.save(f, np.array(sorted(self.ids),
+                                                          dtype=str)),
+                 'texts.npz': lambda f: self.texts.write(f),
+                 'counts.npz': lambda f: sparse.save_npz(f, self.counts),
+                 'runs.txt': lambda f: f.write(str(self.runs).encode()),
+                 'dictionary.gensim': lambda f: self.dictionary.save(f)}
+
+        # All files are written before any is moved in place.
+        with contextlib.ExitStack() as stack:
+            for file_name, write in files.items():
+                write(stack.enter_context(
+                    af.atomic_open(self.__path(file_name))))
+
+
+
+    def __load(self):
+        self.ids = set(np.load(self.__path('ids.npy')).tolist())
+        self.texts.read(self.__path('texts.npz'))
+        self.counts = sparse.load_npz(self.__path('counts.npz')).tocsr()
+        with open(self.__path('runs.txt'), 'r') as runs_file:
+            self.runs = int(runs_file.read())
+        self.dictionary = gensim.corpora.Dictionary.load(
+            self.__path('dictionary.gensim'))
+
+
+
+    def __path(self, file_name):
+        return os.path.join(self.directory_path, file_name)
@@ -0,0 +1,60 @@
+"""Writes files atomically: the content goes to a temporary file next to the
+target, path + '.tmp', which is moved in place with os.replace once it is
+complete. A crash never leaves a half written file, at worst a .tmp file,
+and readers see either the old or the new file. The temporary file is
+removed when the writing fails.
+
+Example:
+    import AtomicFile as af
+    with af.atomic_open('data/manifest.jsonl', 'w') as manifest_file:
+        manifest_file.write(lines)
+    af.save('data/index/index.npz', index.write)
+"""
+
+import contextlib
+import os
+
+
+suffix = '.tmp'
+
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Context manager that yields the temporary path to write to and moves
+    it to path when the block ends without an error, for writers that take a
+    path instead of a file."""
+
+    temporary_path = path + suffix
+    try:
+        yield temporary_path
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporary_path)
+        raise
+    os.replace(temporary_path, path)
+
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode='wb', opener=open, **options):
+    """Context manager that opens the temporary file with opener, open by
+    default or for example gzip.open, and moves it to path when the block
+    ends without an error."""
+
+    with atomic_path(path) as temporary_path:
+        with opener(temporary_path, mode, **options) as file:
+            yield file
+
+
+
+def save(path, write):
+    """Makes the directory of path and writes the file with write, which
+    takes an open binary file, for example the write method of an index.
+
+    Example: af.save(os.path.join(directory_path, 'index.npz'), self.write)
+    """
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with atomic_open(path) as file:
+        write(file)
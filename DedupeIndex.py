@@ -0,0 +1,312 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import AtomicFile as af
+
+
+_PRIME = np.uint64(4294967291) # Largest prime below 2**32.
+
+
+
+class DedupeIndex:
+    """Class that remembers hashes of the texts it has seen, so duplicates can
+    be removed chunk by chunk and run by run without holding the texts. The
+    hashes are kept in sorted NumPy arrays, 8 bytes per text, and can be saved
+    to and loaded from a directory.
+
+    With near_duplicates=True texts that are almost the same as a text seen
+    before, like copy-pasta and bot spam, are also found. Every text gets a
+    MinHash signature of num_perm values over its shingles of shingle_size
+    words, and the signature is split into bands for locality sensitive
+    hashing. Texts that share a band with an earlier text count as
+    duplicates, which with the default 120 values in 20 bands happens for
+    most texts that share more than about 60% of their shingles. This is an
+    approximation, a few texts below that similarity are removed as well.
+
+    normalize takes a boolean. If True texts are compared in lower case with
+    runs of white space counted as one space.
+
+    Example:
+        import DedupeIndex as di
+        index = di.DedupeIndex('data/dedupe_index/', near_duplicates=True)
+        keep = index.filter(a.data['body'])
+        a.data = a.data[keep]
+        index.save()
+    """
+
+
+
+    def __init__(self, directory_path=None, near_duplicates=False, num_perm=120,
+                 bands=20, shingle_size=3, normalize=False, seed=1):
+
+        self.directory_path = directory_path
+        self.settings = {'near_duplicates': near_duplicates,
+                         'num_perm': num_perm,
+                         'bands': bands,
+                         'shingle_size': shingle_size,
+                         'normalize': normalize,
+                         'seed': seed}
+
+        self.__setup()
+
+        if directory_path is not None and os.path.exists(self.__path()):
+            self.read(self.__path())
+
+
+
+    def filter(self, texts):
+        """Returns a boolean mask that is True for the texts to keep: the first
+        occurrence of every text that is not a duplicate of a text seen
+        before. The kept texts are added to the index.
+
+        Example: a.data = a.data[index.filter(a.data['body'])]
+        """
+
+        hashes, band_keys = self.__prepare(texts)
+        keep = self.__is_new(hashes, band_keys)
+        self.__add(hashes[keep], [keys[keep] for keys in band_keys])
+        return keep
+
+
+
+    def is_new(self, texts):
+        """Like filter, but doesn't add anything to the index."""
+
+        return self.__is_new(*self.__prepare(texts))
+
+
+
+    def add(self, texts):
+        """Adds all given texts to the index."""
+
+        self.__add(*self.__prepare(texts))
+
+
+
+    def __len__(self):
+        return len(self.exact)
+
+
+
+    def save(self, directory_path=None):
+        """Saves the index to index.npz in its directory, or in the given one.
+
+        Example: index.save()
+        """
+
+        if directory_path is not None:
+            self.directory_path = directory_path
+        af.save(self.__path(), self.write)
+
+
+
+    def write(self, file):
+        """Writes the settings and hashes of the index to an open file or a
+        path."""
+
+        arrays = {'settings': np.array(json.dumps(self.settings)),
+                  'exact': self.exact.to_array()}
+        for i, band in enumerate(self.band_sets):
+            arrays['band_' + str(i)] = band.to_array()
+        np.savez(file, **arrays)
+
+
+
+    def read(self, file):
+        """Replaces the index with one written by write. The settings are
+        taken from the file."""
+
+        with np.load(file) as arrays:
+            self.settings = json.loads(str(arrays['settings']))
+            self.__setup()
+            self.exact = SortedHashSet(arrays['exact'])
+            self.band_sets = [SortedHashSet(arrays['band_' + str(i)])
+                              for i in range(len(self.band_sets))]
+
+
+
+    def __setup(self):
+        near = self.settings['near_duplicates']
+        bands = self.settings['bands'] if near else 0
+        self.exact = SortedHashSet()
+        self.band_sets = [SortedHashSet() for _ in range(bands)]
+
+        if near and self.settings['num_perm'] % self.settings['bands'] != 0:
+            raise Exception('num_perm has to be a multiple of bands.')
+
+        rng = np.random.RandomState(self.settings['seed'])
+        num_perm = self.settings['num_perm']
+        self.a = rng.randint(1, int(_PRIME), num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, int(_PRIME), num_perm, dtype=np.uint64)
+        rows = num_perm // max(self.settings['bands'], 1)
+        self.combine = rng.randint(1, 2**62, rows, dtype=np.uint64) | np.uint64(1)
+
+
+
+    def __prepare(self, texts):
+        """Returns the exact hash of every text and, for near duplicates, the
+        LSH key of every text in every band."""
+
+        texts = [self.__normalize(t) for t in texts]
+        if not texts:
+            return np.zeros(0, dtype=np.uint64), [np.zeros(0, dtype=np.uint64)
+                                                  for _ in self.band_sets]
+
+        hashes = pd.util.hash_array(np.array(texts, dtype=object))
+        if not self.settings['near_duplicates']:
+            return hashes, []
+
+        signatures = self.__minhash(texts)
+        rows = len(self.combine)
+        band_keys = list()
+        for band in range(len(self.band_sets)):
+            band_rows = signatures[:, band * rows:(band + 1) * rows]
+            band_keys.append((band_rows * self.combine).sum(axis=1,
+                                                            dtype=np.uint64))
+        return hashes, band_keys
+
+
+
+    def __minhash(self, texts, batch_size=10000):
+        """Returns the MinHash signatures of the texts, shape
+        (len(texts), num_perm)."""
+
+        k = self.settings['shingle_size']
+        signatures = np.empty((len(texts), len(self.a)), dtype=np.uint64)
+
+        for start in range(0, len(texts), batch_size):
+            shingles = list()
+            lengths = list()
+            for text in texts[start:start + batch_size]:
+                words = text.split()
+                doc = [' '.join(words[i:i + k])
+                       for i in range(max(1, len(words) - k + 1))]
+                shingles.extend(doc)
+                lengths.append(len(doc))
+
+            x = pd.util.hash_array(np.array(shingles, dtype=object))
+            x &= np.uint64(0xffffffff)
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+            for i in range(len(self.a)):
+                values = (self.a[i] * x + self.b[i]) % _PRIME
+                signatures[start:start + len(lengths), i] = np.minimum.reduceat(
+                    values, starts)
+        return signatures
+
+
+
+    def __is_new(self, hashes, band_keys):
+        keep = np.zeros(len(hashes), dtype=bool)
+        _, first = np.unique(hashes, return_index=True)
+        keep[first] = True
+        keep &= ~self.exact.contains(hashes)
+
+        for band, keys in zip(self.band_sets, band_keys):
+            candidates = np.flatnonzero(keep)
+            if len(candidates) == 0:
+                break
+            near = band.contains(keys[candidates])
+            order = np.argsort(keys[candidates], kind='stable')
+            sorted_keys = keys[candidates][order]
+            near[order[1:][sorted_keys[1:] == sorted_keys[:-1]]] = True
+            keep[candidates[near]] = False
+
+        return keep
+
+
+
+    def __add(self, hashes, band_keys):
+        self.exact.add(hashes)
+        for band, keys in zip(self.band_sets, band_keys):
+            band.add(keys)
+
+
+
+    def __normalize(self, text):
+        if self.settings['normalize']:
+            return ' '.join(text.lower().split())
+        return text
+
+
+
+    def __path(self):
+        return os.path.join(self.directory_path, 'index.npz')
+
+
+
+class SortedHashSet:
+    """Set of uint64 hashes kept as a few sorted arrays of decreasing size.
+    New hashes become a new array, and an array is merged into the one before
+    it when that one is less than twice as large, so there are never more
+    than about log2(n) arrays to search."""
+
+
+
+    def __init__(self, hashes=None):
+
+        self.runs = list()
+        if hashes is not None and len(hashes) > 0:
+            self.runs.append(np.unique(np.asarray(hashes, dtype=np.uint64)))
+
+
+
+    def contains(self, hashes):
+        """Returns a boolean mask of the hashes that are in the set."""
+
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            i = np.searchsorted(run, hashes)
+            i[i == len(run)] = 0
+            found |= run[i] == hashes
+        return found
+
+
+
+    def add(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        hashes = np.unique(hashes[~self.contains(hashes)])
+        if len(hashes) == 0:
+            return
+
+        self.runs.append(hashes)
+        while len(self.runs) > 1 and len(self.runs[-2]) < 2 * len(self.runs[-1]):
+            last = self.runs.pop()
+            self.runs[-1] = np.union1d(self.runs[-1], last)
+
+
+
+    def filter_values(self, values):
+        """Returns a boolean mask that is True for the first occurrence of
+        every value whose hash is not in the set yet, and adds those hashes.
+        Missing values are always True and never added. Used to count every
+        comment id once, run after run.
+
+        Example: new = seen_ids.filter_values(data['id'])
+        """
+
+        values = pd.Series(values)
+        present = values.notna().to_numpy()
+        hashes = pd.util.hash_array(values.to_numpy(dtype=object))
+        new = ~present
+        candidates = np.flatnonzero(present)
+        _, first = np.unique(hashes[candidates], return_index=True)
+        candidates = candidates[first]
+        candidates = candidates[~self.contains(hashes[candidates])]
+        new[candidates] = True
+        self.add(hashes[candidates])
+        return new
+
+
+
+    def to_array(self):
+        if not self.runs:
+            return np.zeros(0, dtype=np.uint64)
+        return np.unique(np.concatenate(self.runs))
+
+
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
@@ -0,0 +1,377 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import AtomicFile as af
+import DedupeIndex as di
+import SonarScorer as ss
+
+
+KEYS = ('author', 'link_id', 'parent_id')
+
+
+
+class EntityIndex:
+    """Class that gives every author, thread (link_id) and parent (parent_id)
+    an integer code and keeps running totals per code, so the authors and
+    threads with the most hate speech can be found without grouping the
+    comments. Per code it keeps the number of comments loaded, the first and
+    last created_utc, and from the scored comments the number per top_class
+    and the sums of the confidences.
+
+    HateSpeechAnalyzer adds comments to it when they are loaded and scores
+    when hate_sonar has run. encode optionally turns the key columns of a
+    DataFrame into categoricals whose codes are the codes of the index, so
+    the columns are held as integers and the scores of that DataFrame are
+    added without looking up any string. HateSpeechAnalyzer leaves its data
+    as it is. top returns the k entities with the highest value of a column
+    of frame. The index can be saved to and loaded from a directory.
+
+    Every comment id is counted once as loaded and once as scored: the hashes
+    of the ids added are kept with the index, 8 bytes per comment, and
+    comments whose id was added before, for example when the same comments
+    are loaded or scored again in a later run, are skipped.
+
+    Example:
+        import EntityIndex as ei
+        entities = ei.EntityIndex('data/entities/')
+        entities.add_comments(comments_df)
+        comments_df = entities.encode(comments_df)
+        entities.add_scores(comments_df)
+        top_df = entities.top('link_id', k=10, by='hate_speech_count')
+        entities.save()
+    """
+
+
+
+    def __init__(self, directory_path=None, keys=KEYS):
+
+        self.directory_path = directory_path
+        self.keys = tuple(keys)
+        self.lock = threading.Lock()
+        self.tables = {key: EntityTable() for key in self.keys}
+        self.loaded_ids = di.SortedHashSet()
+        self.scored_ids = di.SortedHashSet()
+
+        if directory_path is not None and os.path.exists(self.__path()):
+            self.read(self.__path())
+
+
+
+    def add_comments(self, data):
+        """Adds loaded comments: every new key gets a code and the number of
+        comments and the first and last created_utc of every key are updated.
+        Comments whose id was added before are left out.
+
+        Example: entities.add_comments(a.data)
+        """
+
+        with self.lock:
+            if 'id' in data.columns:
+                data = data[self.loaded_ids.filter_values(data['id'])]
+
+            created = None
+            if 'created_utc' in data.columns:
+                created = pd.to_numeric(data['created_utc'], errors='coerce')
+                created = created.to_numpy(dtype=np.float64, na_value=np.nan)
+
+            for key in self.keys:
+                if key in data.columns:
+                    self.tables[key].add_comments(data[key], created)
+
+
+
+    def add_scores(self, data):
+        """Adds the HateSonar results of scored comments, the columns
+        top_class, hate_speech, offensive_language and neither made by
+        hate_sonar, to the totals of their keys. Comments whose id was added
+        before are left out.
+
+        Example: entities.add_scores(a.data)
+        """
+
+        classes = pd.Categorical(data['top_class'],
+                                 categories=ss.CLASSES).codes.astype(np.int64)
+
+        with self.lock:
+            if 'id' in data.columns:
+                scored = classes >= 0
+                scored[scored] = self.scored_ids.filter_values(
+                    data['id'][scored])
+                data = data[scored]
+                classes = classes[scored]
+            confidences = data[list(ss.CLASSES)].to_numpy(dtype=np.float64)
+
+            for key in self.keys:
+                if key in data.columns:
+                    self.tables[key].add_scores(data[key], classes,
+                                                confidences)
+
+
+
+    def encode(self, data):
+        """Returns data with the key columns as categoricals whose codes are
+        the codes of the index. Keys that are not in the index become NaN, so
+        add the comments first.
+
+        Example: a.data = entities.encode(a.data)
+        """
+
+        encoded = dict()
+        with self.lock:
+            for key in self.keys:
+                if key in data.columns:
+                    table = self.tables[key]
+                    encoded[key] = pd.Categorical.from_codes(
+                        table.codes(data[key]), dtype=table.dtype())
+        return data.assign(**encoded) if encoded else data
+
+
+
+    def frame(self, key):
+        """Returns a DataFrame with one row per key of the given column, in
+        the order of their codes: the number of comments loaded, the first
+        and last created_utc, the number of scored comments and for every
+        class the number with that top_class and the mean confidence.
+
+        Example: author_df = entities.frame('author')
+        """
+
+        with self.lock:
+            return self.tables[key].frame(np.arange(len(self.tables[key])))
+
+
+
+    def top(self, key, k=10, by='hate_speech_count', min_scored=1):
+        """Returns the frame rows of the k keys with the highest value in the
+        column by, highest first, among the keys with at least min_scored
+        scored comments.
+
+        Example: top_df = entities.top('author', 20, by='hate_speech_mean',
+                                       min_scored=10)
+        """
+
+        with self.lock:
+            table = self.tables[key]
+            values = table.column(by)
+            candidates = np.flatnonzero(
+                (table.scored() >= min_scored) & ~np.isnan(values))
+            k = min(k, len(candidates))
+            if k == 0:
+                return table.frame(candidates)
+
+            top = candidates[np.argpartition(-values[candidates], k - 1)[:k]]
+            top = top[np.argsort(-values[top], kind='stable')]
+            return table.frame(top)
+
+
+
+    def save(self, directory_path=None):
+        """Saves the index to entities.npz in its directory, or in the given
+        one.
+
+        Example: entities.save(data_dir[:-5])
+        """
+
+        if directory_path is not None:
+            self.directory_path = directory_path
+        af.save(self.__path(), self.write)
+
+
+
+    def write(self, file):
+        """Writes the index to an open file or a path."""
+
+        arrays = {'settings': np.array(json.dumps({'keys': self.keys}))}
+        with self.lock:
+            arrays['loaded_ids'] = self.loaded_ids.to_array()
+            arrays['scored_ids'] = self.scored_ids.to_array()
+            for key, table in self.tables.items():
+                for name, values in table.arrays().items():
+                    arrays[key + '.' + name] = values
+        np.savez(file, **arrays)
+
+
+
+    def read(self, file):
+        """Replaces the index with one written by write."""
+
+        with np.load(file) as arrays, self.lock:
+            self.keys = tuple(json.loads(str(arrays['settings']))['keys'])
+            self.loaded_ids = di.SortedHashSet(arrays['loaded_ids'])
+            self.scored_ids = di.SortedHashSet(arrays['scored_ids'])
+            self.tables = dict()
+            for key in self.keys:
+                self.tables[key] = EntityTable()
+                self.tables[key].read({name: arrays[key + '.' + name]
+                                       for name in EntityTable.columns})
+
+
+
+    def __path(self):
+        return os.path.join(self.directory_path, 'entities.npz')
+
+
+
+class EntityTable:
+    """The codes and totals of one key column of an EntityIndex. The arrays
+    grow by half their size at a time and only the first len(self) rows are
+    in use."""
+
+    columns = ('names', 'comments', 'first_utc', 'last_utc', 'class_counts',
+               'sums')
+
+
+
+    def __init__(self):
+
+        self.code_of = dict()
+        self.names = list()
+        self.categories = None # pandas Index of names, made when needed.
+        self.comments = np.zeros(0, dtype=np.int64)
+        self.first_utc = np.zeros(0, dtype=np.float64)
+        self.last_utc = np.zeros(0, dtype=np.float64)
+        self.class_counts = np.zeros((0, len(ss.CLASSES)), dtype=np.int64)
+        self.sums = np.zeros((0, len(ss.CLASSES)), dtype=np.float64)
+
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+
+    def codes(self, values, add=False):
+        """Returns the code of every value, -1 for missing values and, unless
+        add is True, for values that have no code."""
+
+        if (isinstance(values.dtype, pd.CategoricalDtype)
+                and values.cat.categories is self.categories):
+            return values.cat.codes.to_numpy().astype(np.int64)
+
+        row_uniques, uniques = pd.factorize(values)
+        unique_codes = np.empty(len(uniques), dtype=np.int64)
+        n = len(self.names)
+        for i, name in enumerate(uniques):
+            code = self.code_of.get(name)
+            if code is None and add:
+                code = self.code_of[name] = len(self.names)
+                self.names.append(name)
+            unique_codes[i] = -1 if code is None else code
+
+        if len(self.names) > n:
+            self.categories = None
+            if len(self.names) > len(self.comments):
+                self.__grow(len(self.names))
+        codes = unique_codes[row_uniques]
+        codes[row_uniques < 0] = -1
+        return codes
+
+
+
+    def dtype(self):
+        if self.categories is None:
+            self.categories = pd.Index(self.names)
+        return pd.CategoricalDtype(self.categories)
+
+
+
+    def add_comments(self, values, created):
+        codes = self.codes(values, add=True)
+        known = codes >= 0
+        self.comments[:len(self)] += np.bincount(codes[known],
+                                                 minlength=len(self))
+        if created is not None:
+            dated = known & ~np.isnan(created)
+            np.fmin.at(self.first_utc, codes[dated], created[dated])
+            np.fmax.at(self.last_utc, codes[dated], created[dated])
+
+
+
+    def add_scores(self, values, classes, confidences):
+        codes = self.codes(values, add=True)
+        scored = (codes >= 0) & (classes >= 0)
+        codes = codes[scored]
+        n = len(self)
+        self.class_counts[:n] += np.bincount(
+            codes * len(ss.CLASSES) + classes[scored],
+            minlength=n * len(ss.CLASSES)).reshape(n, len(ss.CLASSES))
+        for k in range(len(ss.CLASSES)):
+            self.sums[:n, k] += np.bincount(codes, minlength=n,
+                                            weights=confidences[scored, k])
+
+
+
+    def scored(self):
+        return self.class_counts[:len(self)].sum(axis=1)
+
+
+
+    def column(self, name):
+        """Returns one column of frame for all codes as an array."""
+
+        n = len(self)
+        if name in ('comments', 'first_utc', 'last_utc'):
+            return getattr(self, name)[:n].astype(np.float64)
+        if name == 'scored':
+            return self.scored().astype(np.float64)
+        for k, class_name in enumerate(ss.CLASSES):
+            if name == class_name + '_count':
+                return self.class_counts[:n, k].astype(np.float64)
+            if name == class_name + '_mean':
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    return self.sums[:n, k] / self.scored()
+        raise Exception('Unknown column: ' + str(name) + '.')
+
+
+
+    def frame(self, codes):
+        """Returns the frame rows of the given codes."""
+
+        scored = self.scored()[codes]
+        columns = {'comments': self.comments[codes],
+                   'first_utc': self.first_utc[codes],
+                   'last_utc': self.last_utc[codes],
+                   'scored': scored}
+        for k, name in enumerate(ss.CLASSES):
+            columns[name + '_count'] = self.class_counts[codes, k]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                columns[name + '_mean'] = self.sums[codes, k] / scored
+
+        index = pd.Index([self.names[code] for code in codes], name='key')
+        entity_df = pd.DataFrame(columns, index=index)
+        entity_df.insert(0, 'code', codes)
+        return entity_df
+
+
+
+    def arrays(self):
+        n = len(self)
+        return {'names': np.array(self.names, dtype=str),
+                'comments': self.comments[:n],
+                'first_utc': self.first_utc[:n],
+                'last_utc': self.last_utc[:n],
+                'class_counts': self.class_counts[:n],
+                'sums': self.sums[:n]}
+
+
+
+    def read(self, arrays):
+        self.names = arrays['names'].tolist()
+        self.code_of = {name: code for code, name in enumerate(self.names)}
+        self.categories = None
+        for name in self.columns[1:]:
+            setattr(self, name, arrays[name].copy())
+
+
+
+    def __grow(self, n):
+        size = max(n, len(self.comments) * 3 // 2)
+        for name, fill in (('comments', 0), ('first_utc', np.nan),
+                           ('last_utc', np.nan), ('class_counts', 0),
+                           ('sums', 0)):
+            old = getattr(self, name)
+            values = np.full((size,) + old.shape[1:], fill, dtype=old.dtype)
+            values[:len(old)] = old
+            setattr(self, name, values)
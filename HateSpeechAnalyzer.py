@@ -1,10 +1,32 @@
-import hatesonar
 import pandas as pd
-import json
+import logging
 import os
 import re
-import gensim
+import weakref
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import DedupeIndex as di
+import EntityIndex as ei
+import InvertedIndex as ii
+import JsonLines as jl
+import LazyModule as lm
+import ParquetStore as ps
+import PrevalenceEstimator as pe
+import RegexPipeline as rp
+import ScoreRollups as sr
+import SonarScorer as ss
+import StageMetrics as sm
+import TokenCache as tc
+import WordCounter as wc
+
+
+logger = logging.getLogger(__name__)
+
+# Imported the first time tf_idf or the TF-IDF matrix methods need them.
+gensim = lm.LazyModule('gensim')
+sparse = lm.LazyModule('scipy.sparse')
+
 
 class HateSpeechAnalyzer:
     """Class that loads text data and metadata into a pandas DataFrame. Currently
@@ -16,6 +38,18 @@ class HateSpeechAnalyzer:
      specified data. The intention is to include more language processing
      methods such as TF-IDF.
 
+     Wall time, CPU time, rows, bytes and peak RSS of every step are recorded
+     in metrics, a StageMetrics that can be shared with a RedditDataDL.
+     Every comment scored by hate_sonar is added to rollups, a ScoreRollups
+     that aggregate answers from without going through data again. Loaded
+     comments and their scores are also added to entities, an EntityIndex of
+     the authors, threads and parents that top_entities and
+     aggregate_authors answer from. Pass saved ones to keep the rollups and
+     entities over several runs, both count every comment id once. tokenize
+     keeps the tokens of a column in tokens, a TokenCache that hate_sonar,
+     the TF-IDF methods and the index then use instead of lowercasing and
+     tokenizing the texts again.
+
      Example:
 
      import HateSpeechAnalyzer as hsa
@@ -24,88 +58,287 @@ class HateSpeechAnalyzer:
 
 
 
-    def __init__(self, data_directory_path=None, metadata_directory_path=None):
+    def __init__(self, data_directory_path=None, metadata_directory_path=None,
+                 metrics=None, rollups=None, entities=None):
 
         self.data = pd.DataFrame()
         self.metadata = pd.DataFrame()
         self.compiled_regex = None
+        self.tfidf_matrix = None
+        self.dictionary = None
+        self.index = None
+        self.index_column = None
+        self.tokens = None
+        self.tokens_column = None
+        self.tokens_data = None # Weak reference to the data tokens is from.
         self.data_directory_path = data_directory_path
         self.metadata_directory_path = metadata_directory_path
+        self.metrics = metrics if metrics is not None else sm.StageMetrics()
+        self.rollups = rollups if rollups is not None else sr.ScoreRollups()
+        self.entities = entities if entities is not None else ei.EntityIndex()
 
 
 
     def load_json(self, data_directory_path=None,
-                  metadata_directory_path=None):
+                  metadata_directory_path=None, n_workers=1,
+                  use_processes=True, compact=False, columns=None):
         """Loads data and metadata files from their respective directory paths.
         Don't give path to file but to directory where the file(s) are kept.
-        Will try to load all files in given directories.
+        Will try to load all files in given directories. See load_data_json
+        for n_workers, use_processes, compact and columns.
 
         Example: a.load_json(data_dir) # If not given when initialized.
 
         """
 
-        self.load_data_json(data_directory_path)
-        self.load_metadata_json(metadata_directory_path)
+        self.load_data_json(data_directory_path, n_workers, use_processes,
+                            compact, columns)
+        self.load_metadata_json(metadata_directory_path, n_workers,
+                                use_processes)
 
 
         
-    def load_data_json(self, data_directory_path=None):
+    def load_data_json(self, data_directory_path=None, n_workers=1,
+                       use_processes=True, compact=False, columns=None):
         """Loads data files from given directory path. Don't give path to file
         but to directory where the file(s) are kept. Will try to load all files
-        in given directory.
+        in given directory. The files are put together in the order of the
+        request counter in their names (data_0.json, data_1.json, ...). Files
+        in the compact format of RedditDataDL (data_0.jsonl.gz, ...) are read
+        as well, with orjson if it is installed.
+
+        n_workers takes the number of files to parse at the same time.
+
+        use_processes takes a boolean. Parses the files in a pool of processes
+        if True, otherwise in a pool of threads.
+
+        columns takes a list of the columns to keep, for example
+        ['id', 'author', 'body', 'created_utc']. Other columns are dropped
+        from every file as soon as it is parsed. All are kept if None.
+
+        compact takes a boolean. If True compact_data is run on the loaded
+        data.
 
         Example: a.load_data_json(data_dir) # If not given when initialized.
 
         """
 
-        print('Loading data into HateSpeechAnalyzer... \n')
+        logger.info('Loading data into HateSpeechAnalyzer...')
         if self.data_directory_path is None:
             self.data_directory_path = data_directory_path
         else:
             data_directory_path = self.data_directory_path
 
-        file_names = [f for f in os.listdir(data_directory_path) 
-                      if os.path.isfile(os.path.join(data_directory_path, f))]
-        dfs = list()
-        for fn in file_names:
-            path = data_directory_path + fn
-            dfs.append( self.__load_data_json_file( path ) )
-
-        self.data = pd.concat(dfs, ignore_index=True, copy=False)
-        print('Data successfully loaded into HateSpeechAnalyzer. \n')
+        with self.metrics.stage('load') as stage:
+            paths = self.__json_file_paths(data_directory_path)
+            dfs = self.__load_json_files(paths, n_workers, use_processes,
+                                         columns)
+            self.data = pd.concat(dfs, ignore_index=True, copy=False)
+            del dfs
+            stage.bytes_read = sm.file_size(*paths)
+            stage.rows_out = len(self.data)
+
+        logger.info('Loaded %d rows of data into HateSpeechAnalyzer.',
+                    len(self.data))
+        self.__index_entities()
+        if compact:
+            self.compact_data()
             
 
 
-    def load_metadata_json(self, metadata_directory_path=None):
+    def iter_data_json(self, data_directory_path=None, chunksize=100000,
+                       columns=None):
+        """Loads the data files from given directory path in chunks. Yields
+        DataFrames of at most chunksize rows, so only one chunk and one file
+        are held in memory at a time. Each chunk is also set as data, so
+        apply_regex, clean_data and hate_sonar can be run on it in the loop.
+
+        columns takes a list of the fields to keep, for example
+        ['body', 'created_utc', 'author', 'id']. All fields are kept if None.
+
+        Example:
+            for chunk in a.iter_data_json(data_dir, columns=['body', 'id']):
+                a.apply_regex('body', regex_input)
+                a.clean_data('body', disallowed=comment_list)
+                a.hate_sonar('body')
+                a.data.to_csv(...)
+        """
+
+        logger.info('Loading data into HateSpeechAnalyzer in chunks...')
+        if self.data_directory_path is None:
+            self.data_directory_path = data_directory_path
+        else:
+            data_directory_path = self.data_directory_path
+
+        records = list()
+        for path in self.__json_file_paths(data_directory_path):
+            with self.metrics.stage('load') as stage:
+                file_records = self.__project(jl.load(path), columns)
+                records.extend(file_records)
+                stage.bytes_read = sm.file_size(path)
+                stage.rows_out = len(file_records)
+
+            while len(records) >= chunksize:
+                self.data = self.__records_to_frame(records[:chunksize], columns)
+                del records[:chunksize]
+                self.__index_entities()
+                yield self.data
+
+        if records:
+            self.data = self.__records_to_frame(records, columns)
+            self.__index_entities()
+            yield self.data
+
+        logger.info('All data chunks loaded into HateSpeechAnalyzer.')
+
+
+
+    def load_metadata_json(self, metadata_directory_path=None, n_workers=1,
+                           use_processes=True):
         """Loads metadata files from given directory path. Don't give path to
         file but to directory where the file(s) are kept. Will try to load all
-        files in given directory.
+        files in given directory. See load_data_json for n_workers and
+        use_processes.
 
         Example: a.load_metadata_json(metadata_dir) # If not given when initialized.
 
         """
 
-        print('Loading metadata into HateSpeechAnalyzer... \n')
+        logger.info('Loading metadata into HateSpeechAnalyzer...')
         if self.metadata_directory_path is None:
             self.metadata_directory_path = metadata_directory_path
         else:
             metadata_directory_path = self.metadata_directory_path
 
-        file_names = [f for f in os.listdir(metadata_directory_path) 
-                      if os.path.isfile(os.path.join(metadata_directory_path, f))]
-
-        dfs = list()
-        for fn in file_names:
-            path = metadata_directory_path + fn
-            dfs.append( self.__load_metadata_json_file( path ) )
+        with self.metrics.stage('load') as stage:
+            paths = self.__json_file_paths(metadata_directory_path)
+            dfs = self.__load_json_files(paths, n_workers, use_processes)
+            self.metadata = pd.concat(dfs, ignore_index=True, copy=False)
+            stage.bytes_read = sm.file_size(*paths)
+            stage.rows_out = len(self.metadata)
 
-        self.metadata = pd.concat(dfs, ignore_index=True, copy=False)
-        print('Metadata successfully loaded into HateSpeechAnalyzer. \n')
+        logger.info('Loaded %d rows of metadata into HateSpeechAnalyzer.',
+                    len(self.metadata))
         
             
 
+    def load_parquet(self, data_directory_path=None,
+                     metadata_directory_path=None, columns=None, n_workers=1):
+        """Loads data and metadata stored as Parquet, either downloaded with
+        storage_format='parquet' or written with write_parquet. See
+        load_data_parquet for columns and n_workers.
+
+        Example: a.load_parquet(data_dir, metadata_dir, columns=['body'])
+        """
+
+        self.load_data_parquet(data_directory_path, columns, n_workers)
+        self.load_metadata_parquet(metadata_directory_path, n_workers)
+
+
+
+    def load_data_parquet(self, data_directory_path=None, columns=None,
+                          n_workers=1):
+        """Loads all Parquet files in the given directory and its time window
+        partitions into data. The files are memory mapped.
+
+        columns takes a list of the columns to read, all are read if None.
+
+        n_workers takes the number of files to read at the same time.
+
+        Example: a.load_data_parquet(data_dir, columns=['body', 'created_utc'])
+        """
+
+        logger.info('Loading data into HateSpeechAnalyzer...')
+        if self.data_directory_path is None:
+            self.data_directory_path = data_directory_path
+        else:
+            data_directory_path = self.data_directory_path
+
+        with self.metrics.stage('load') as stage:
+            store = ps.ParquetStore(data_directory_path)
+            self.data = store.read(columns=columns, n_workers=n_workers)
+            stage.bytes_read = sm.file_size(*store.files())
+            stage.rows_out = len(self.data)
+
+        logger.info('Loaded %d rows of data into HateSpeechAnalyzer.',
+                    len(self.data))
+        self.__index_entities()
+
+
+
+    def load_metadata_parquet(self, metadata_directory_path=None, n_workers=1):
+        """Loads all Parquet files in the given directory into metadata.
+
+        Example: a.load_metadata_parquet(metadata_dir)
+        """
+
+        logger.info('Loading metadata into HateSpeechAnalyzer...')
+        if self.metadata_directory_path is None:
+            self.metadata_directory_path = metadata_directory_path
+        else:
+            metadata_directory_path = self.metadata_directory_path
+
+        with self.metrics.stage('load') as stage:
+            store = ps.ParquetStore(metadata_directory_path, partition_by=None)
+            self.metadata = store.read(n_workers=n_workers)
+            stage.bytes_read = sm.file_size(*store.files())
+            stage.rows_out = len(self.metadata)
+
+        logger.info('Loaded %d rows of metadata into HateSpeechAnalyzer.',
+                    len(self.metadata))
+
+
+
+    def compact_data(self, columns=None, categorical_ratio=0.5,
+                     text_columns=('body',), arrow_strings=False):
+        """Makes the data DataFrame use less memory. Keeps only the given
+        columns, stores string columns with few distinct values, like author,
+        subreddit and the flair fields, as categoricals, downcasts numeric
+        columns as far as no value changes and stores created_utc as int64.
+        Returns a DataFrame with the memory of every column before and after
+        in bytes, with the totals in the last row.
+
+        columns takes a list of the columns to keep, all are kept if None.
+
+        categorical_ratio takes the largest share of distinct values a string
+        column can have to become categorical.
+
+        text_columns takes the columns that hold free text. They are never
+        made categorical.
+
+        arrow_strings takes a boolean. If True the text columns are stored as
+        Arrow backed strings (string[pyarrow]), which needs pyarrow.
+
+        Example: memory_df = a.compact_data(['id', 'author', 'body',
+                                             'created_utc', 'subreddit'])
+        """
+
+        logger.info('Compacting data...')
+        if columns is not None:
+            self.data = self.data[[column for column in columns
+                                   if column in self.data.columns]]
+
+        before = self.data.memory_usage(index=False, deep=True)
+        compacted = dict()
+        for column in self.data.columns:
+            compacted[column] = self.__compact_column(
+                self.data[column], column, categorical_ratio,
+                column in text_columns, arrow_strings)
+        self.data = pd.DataFrame(compacted, index=self.data.index)
+        after = self.data.memory_usage(index=False, deep=True)
+
+        memory_df = pd.DataFrame({'Dtype': self.data.dtypes.astype(str),
+                                  'Before': before, 'After': after})
+        memory_df.loc['Total'] = ['', before.sum(), after.sum()]
+
+        logger.info('Compacted data from %.1f MB to %.1f MB.',
+                    before.sum() / 2**20, after.sum() / 2**20)
+        return memory_df
+
+
+
     def clean_data(self, column, disallowed=None, remove_NaN=True,
-                   remove_duplicates=True):
+                   remove_duplicates=True, keep_order=False, dedupe_index=None):
 
         """Removes data rows in given column in the data
         DataFrame. All parameters are optional and independent. Returns a
@@ -120,53 +353,84 @@ class HateSpeechAnalyzer:
 
         remove_duplicates takes a boolean.
 
-        Example: removed_items = a.clean_data('body', disallowed=comment_list,
-                                              regex=regex_input)
-        """
+        keep_order takes a boolean. If True the rows keep their original order
+        instead of being sorted on the column, and the first occurrence of a
+        duplicated string is the one that is kept.
 
-        print('Cleaning: ', column, ', in data... \n')
+        dedupe_index takes a DedupeIndex. If given, duplicates are found with
+        it instead, so texts kept in earlier calls or runs are removed too and
+        near duplicates as well if the index finds them. Disallowed strings
+        are then removed first and never added to the index. Use it with
+        keep_order=True to avoid the sort.
 
-        removed_items = {'Data_orig_shape' : self.data.shape,
-                         'Data_new_shape' : 0,
-                         'Removed_NaN' : 0,
-                         'Removed_dups' : 0,
-                         'Removed_disallowed' : 0}
-
-        droplist = set() # Keeps the indices of rows to drop.
-
-        self.data.sort_values(by=[column], inplace=True, ignore_index=True)
-                                        
-        for index, row in self.data.iterrows():
-
-            if index in droplist: continue
-
-            if remove_NaN: 
-                i_to_drop = self.__remove_NaN(index, row, column)
-                if i_to_drop:
-                    removed_items['Removed_NaN'] += 1
-                    droplist.add(i_to_drop)
-                    continue
-
-            if remove_duplicates:
-                i_to_drop = self.__remove_duplicates(index, row, column)
-                if i_to_drop:
-                    removed_items['Removed_dups'] += len(i_to_drop)
-                    droplist.update(i_to_drop)
-                    continue
-                                                            
-            if disallowed is not None:
-                i_to_drop = self.__remove_disallowed(index, row, column, disallowed)
-                if i_to_drop:
-                    removed_items['Removed_disallowed'] += 1
-                    droplist.add(i_to_drop)
-                    continue
+        The rows are removed with whole column masks, no row is visited one by
+        one. As before, a string that occurs more than once keeps one row even
+        if it is in disallowed, only strings that occur once are checked
+        against disallowed.
 
-        self.data.drop(droplist, inplace=True)
-        self.data.reset_index(inplace=True, drop=True)
-        removed_items['Data_new_shape'] = self.data.shape
-        removed_items_df = pd.DataFrame(removed_items)
+        Example: removed_items = a.clean_data('body', disallowed=comment_list,
+                                              regex=regex_input)
+        """
 
-        print('Cleaning of: ', column, ', done. \n')
+        logger.info('Cleaning %s in data...', column)
+        with self.metrics.stage('clean_data', len(self.data)) as stage:
+            removed_items = {'Data_orig_shape' : self.data.shape,
+                             'Data_new_shape' : 0,
+                             'Removed_NaN' : 0,
+                             'Removed_dups' : 0,
+                             'Removed_disallowed' : 0}
+
+            if not keep_order:
+                self.data.sort_values(by=[column], inplace=True,
+                                      ignore_index=True)
+
+            values = self.data[column]
+            droplist = np.zeros(len(values), dtype=bool) # Rows to drop.
+
+            if remove_NaN:
+                to_drop = self.__NaN_mask(values)
+                removed_items['Removed_NaN'] = int(to_drop.sum())
+                droplist |= to_drop
+
+            # Rows left to check for duplicates and disallowed strings. NaN
+            # never equals anything, so it is neither a duplicate nor
+            # disallowed.
+            remaining = ~droplist & values.notna().to_numpy()
+
+            if dedupe_index is not None:
+                if disallowed is not None:
+                    to_drop = self.__disallowed_mask(values, remaining,
+                                                     disallowed)
+                    removed_items['Removed_disallowed'] = int(to_drop.sum())
+                    droplist |= to_drop
+                    remaining &= ~to_drop
+                if remove_duplicates:
+                    to_drop = np.zeros(len(values), dtype=bool)
+                    to_drop[remaining] = ~dedupe_index.filter(
+                        values[remaining])
+                    removed_items['Removed_dups'] = int(to_drop.sum())
+                    droplist |= to_drop
+            else:
+                if remove_duplicates:
+                    to_drop, has_dups = self.__duplicates_mask(values,
+                                                               remaining)
+                    removed_items['Removed_dups'] = int(to_drop.sum())
+                    droplist |= to_drop
+                    remaining &= ~has_dups
+
+                if disallowed is not None:
+                    to_drop = self.__disallowed_mask(values, remaining,
+                                                     disallowed)
+                    removed_items['Removed_disallowed'] = int(to_drop.sum())
+                    droplist |= to_drop
+
+            self.data = self.data.loc[~droplist]
+            self.data.reset_index(inplace=True, drop=True)
+            removed_items['Data_new_shape'] = self.data.shape
+            removed_items_df = pd.DataFrame(removed_items)
+            stage.rows_out = len(self.data)
+
+        logger.info('Cleaning of %s done.', column)
         return removed_items_df
 
 
@@ -177,90 +441,556 @@ class HateSpeechAnalyzer:
         regex takes a dictionary with form:
             {regex pattern: string to replace with}
 
+        The patterns are compiled once into a RegexPipeline that is kept in
+        compiled_regex and reused as long as the same regex is given.
+
         Example: regex_input = {r'http\S+': '_URL_ '}  # Replace a url with _URL_
         """
 
-        print('Applying regex to: ', column, ' in data...')
-        for index, row in self.data.iterrows():
-            self.__apply_regex(index, row, column, regex)
-        print('Regex applied to rows on: ', column, 'column.')
+        logger.info('Applying regex to %s in data...', column)
+        with self.metrics.stage('apply_regex', len(self.data)) as stage:
+            if (self.compiled_regex is None
+                    or list(self.compiled_regex.regex.items())
+                    != list(regex.items())):
+                self.compiled_regex = rp.RegexPipeline(regex)
+
+            dtype = self.data[column].dtype
+            self.data[column] = self.compiled_regex.apply(self.data[column])
+            if isinstance(dtype, pd.StringDtype): # Keep compact_data's dtype.
+                self.data[column] = self.data[column].astype(dtype)
+            if self.tokens_column == column:
+                self.tokens = None
+            stage.rows_out = len(self.data)
+        logger.info('Regex applied to rows on %s column.', column)
+
+
+
+    def tokenize(self, column, keep_lowered=True):
+        """Lowercases and tokenizes the texts in the given column once and
+        keeps them in tokens, a TokenCache. Until data or the column changes,
+        hate_sonar and hate_sonar_sample score the lowercased texts of the
+        cache and tf_idf, tf_idf_matrix, build_index, search and
+        analyze_incremental count and look up the tokens of the cache, so no
+        text is lowercased or tokenized twice. Run it after apply_regex and
+        clean_data. keep_lowered takes a boolean, False doesn't keep the
+        lowercased texts, which saves a copy of the column when hate_sonar
+        isn't run.
+
+        Example: a.tokenize('body')
+        """
+
+        logger.info('Tokenizing %s in data...', column)
+        with self.metrics.stage('tokenize', len(self.data)) as stage:
+            self.tokens = tc.TokenCache(keep_lowered)
+            self.tokens.add(self.data[column])
+            self.tokens_column = column
+            self.tokens_data = weakref.ref(self.data)
+            stage.rows_out = len(self.tokens)
+        logger.info('Tokenized %d texts into %d distinct words.',
+                    len(self.tokens), len(self.tokens.terms))
+        return self.tokens
 
 
 
-    def hate_sonar(self, column, already_lower=False):
+    def hate_sonar(self, column, already_lower=False, batch_size=1000,
+                   n_jobs=1, cache=None, scorer=None):
         """Runs the HateSonar module (https://github.com/Hironsan/HateSonar) on
         the given column in the data DataFrame. Set already_lower to True if
-        the text is in lower case already. Makes new columns in the data
-        DataFrame where the results are added to.
+        the text is in lower case already. The lowercased texts of tokenize
+        are used if it has been run on the column. Makes new columns in the
+        data DataFrame where the results are added to.
 
         column takes the name of the column as a string.
 
         already_lower takes a boolean.
 
+        batch_size takes the number of texts that are scored in one go.
+
+        n_jobs takes the number of processes to score with. The model is
+        loaded once in every process.
+
+        cache takes a SonarCache. Only texts that are not in the cache are
+        scored, the rest get their scores from the cache.
+
+        scorer takes a SonarScorer to score with instead of a new one, for
+        example one whose process pool is kept open over many calls. Its own
+        batch_size, n_jobs and cache are used then.
+
+        The scored comments are added to rollups and entities, except those
+        whose id they have counted before.
+
         Example: a.hate_sonar('body')
         """
 
-        print('Running HateSonar on: ', column, ', in data... \n')
-        sonar = hatesonar.Sonar()
-        top_cls = list()
-        hate_speech = list()
-        offensive_lang = list()
-        neither = list()
+        logger.info('Running HateSonar on %s in data...', column)
+        with self.metrics.stage('hate_sonar', len(self.data)) as stage:
+            texts = self.__lowered(column, already_lower)
+            if texts is None:
+                texts = [text.lower() for text in self.data[column]]
+
+            if scorer is None:
+                scorer = ss.SonarScorer(batch_size=batch_size, n_jobs=n_jobs,
+                                        cache=cache)
+            top_cls, confidences = scorer.score(texts)
+
+            self.data["top_class"] = top_cls
+            self.data["hate_speech"] = confidences[:, 0]
+            self.data["offensive_language"] = confidences[:, 1]
+            self.data["neither"] = confidences[:, 2]
+            self.rollups.add(self.data)
+            self.entities.add_scores(self.data)
+            stage.rows_out = len(self.data)
+        logger.info('HateSonar on %s finished.', column)
+
+
+
+    def hate_sonar_sample(self, column, fraction=0.1, ci_width=None,
+                          confidence=0.95, freq='week', already_lower=False,
+                          batch_size=1000, n_jobs=1, cache=None, seed=0,
+                          min_per_stratum=10):
+        """Estimates the share of every top_class in the given column from a
+        random sample of its comments, stratified by the day, week or month of
+        created_utc, instead of scoring every comment. The sample is scored
+        in rounds of batch_size * n_jobs comments and the estimate is logged
+        after every round with its confidence interval, which gets tighter
+        with every round. Returns a DataFrame with the final estimate, see
+        PrevalenceEstimator.estimate, and a DataFrame with the estimate after
+        every round.
+
+        fraction takes the largest fraction of the comments to score.
+
+        ci_width takes a width of the confidence interval. Scoring stops as
+        soon as the interval of every class is at most that wide and every
+        stratum has min_per_stratum scored comments, or all of its comments
+        if it has fewer. None scores the whole fraction.
+
+        confidence takes the confidence level of the intervals.
+
+        freq takes 'day', 'week' or 'month', the time buckets to stratify by.
+        Without a created_utc column the sample is not stratified.
+
+        The other arguments are the ones of hate_sonar. The sampled comments
+        get their scores in the columns hate_sonar makes, the others NaN. They
+        are not added to rollups or entities, which hold totals of all
+        scored comments and would be skewed by a sample.
+
+        Example: estimate_df, progress_df = a.hate_sonar_sample(
+                     'body', fraction=0.05, ci_width=0.01)
+        """
+
+        logger.info('Sampling HateSonar on %s in data...', column)
+        with self.metrics.stage('hate_sonar_sample', len(self.data)) as stage:
+            texts = self.data[column]
+            rows = np.flatnonzero(texts.notna().to_numpy())
+            if 'created_utc' in self.data.columns:
+                strata = pe.time_strata(self.data['created_utc'].iloc[rows],
+                                        freq)
+            else:
+                strata = np.zeros(len(rows), dtype=np.int64)
+
+            lowered = self.__lowered(column, already_lower)
+            estimator = pe.PrevalenceEstimator(strata, confidence, seed)
+            order = estimator.order()[:int(np.ceil(fraction * len(rows)))]
+
+            top_cls = np.full(len(self.data), None, dtype=object)
+            confidences = np.full((len(self.data), len(ss.CLASSES)), np.nan)
+            round_size = batch_size * max(n_jobs, 1)
+            progress = list()
+
+            with ss.SonarScorer(batch_size=batch_size, n_jobs=n_jobs,
+                                cache=cache) as scorer:
+                for start in range(0, len(order), round_size):
+                    positions = order[start:start + round_size]
+                    sample = rows[positions]
+                    if lowered is not None:
+                        round_texts = [lowered[i] for i in sample.tolist()]
+                    else:
+                        round_texts = [text.lower()
+                                       for text in texts.iloc[sample]]
+
+                    top_cls[sample], confidences[sample] = \
+                        scorer.score(round_texts)
+                    estimator.add(positions, top_cls[sample])
+
+                    estimate_df = estimator.estimate()
+                    progress.append(self.__sample_progress(estimate_df,
+                                                           len(rows)))
+                    logger.info('Scored %d of %d comments: %s.',
+                                start + len(positions), len(rows), ', '.join(
+                                    '%s %.4f [%.4f, %.4f]' % (
+                                        name, row.estimate, row.lower,
+                                        row.upper)
+                                    for name, row in estimate_df.iterrows()))
+                    if (ci_width is not None
+                            and estimate_df['width'].max() <= ci_width
+                            and estimator.scored_strata(min_per_stratum)):
+                        break
+
+            self.data["top_class"] = top_cls
+            self.data["hate_speech"] = confidences[:, 0]
+            self.data["offensive_language"] = confidences[:, 1]
+            self.data["neither"] = confidences[:, 2]
+            stage.rows_out = int(estimator.counts.sum())
+        logger.info('HateSonar sample on %s finished.', column)
+
+        return estimator.estimate(), pd.DataFrame(progress)
+
+
+
+    def aggregate(self, start=None, end=None, freq='day', percentiles=(50, 90)):
+        """Returns a DataFrame with the HateSonar scores of all comments
+        scored so far rolled up per day, week or month from start up to and
+        including end: the number of comments, the number and share of every
+        top_class and the mean and percentiles of the confidence of every
+        class. Answered from rollups, see ScoreRollups.query.
+
+        start and end take dates or UTC timestamps in seconds.
+
+        freq takes 'day', 'week' or 'month'.
+
+        Example: monthly_df = a.aggregate('2015-01-01', '2015-12-31', 'month')
+        """
 
-        for index, row in self.data.iterrows():
+        return self.rollups.query(start, end, freq, percentiles)
 
-            if already_lower:
-                sonar_result = sonar.ping(text = row[column])
-            elif not already_lower:
-                sonar_result = sonar.ping(text = row[column].lower())
 
-            top_cls.append(sonar_result["top_class"])
-            hate_speech.append(sonar_result["classes"][0]["confidence"])
-            offensive_lang.append(sonar_result["classes"][1]["confidence"])
-            neither.append(sonar_result["classes"][2]["confidence"])
 
-        self.data["top_class"] = top_cls
-        self.data["hate_speech"] = hate_speech
-        self.data["offensive_language"] = offensive_lang
-        self.data["neither"] = neither
-        print('HateSonar on: ', column, ', finished. \n')
+    def aggregate_authors(self, n=None, sort_by='hate_speech_mean',
+                          min_count=1):
+        """Returns a DataFrame with the number of loaded and scored comments,
+        the number of every top_class and the mean confidence of every class
+        per author with at least min_count scored comments, sorted by sort_by.
+        All such authors if n is None. Answered from entities.
 
+        Example: top_df = a.aggregate_authors(n=20, min_count=10)
+        """
 
-    def tf_idf(self, column):
+        if n is None:
+            n = len(self.entities.tables['author'])
+        return self.top_entities('author', n, sort_by, min_count)
+
+
+
+    def top_entities(self, key, k=10, by='hate_speech_count', min_scored=1):
+        """Returns the k authors, threads or parents, for key 'author',
+        'link_id' or 'parent_id', with the highest value of by among the ones
+        with at least min_scored scored comments. by takes 'comments',
+        'scored' or a class name followed by _count or _mean. Answered from
+        entities, see EntityIndex.top.
+
+        Example: threads_df = a.top_entities('link_id', 20)
+        """
+
+        return self.entities.top(key, k, by, min_scored)
+
+
+
+    def tf_idf(self, column, chunksize=100000, n_features=None,
+               max_words=None, counter=None):
         """Calculates Term frequency - Inverse document frequency and word count
-        for all comments in the given column. Using the Gensim module. Returns
+        for all comments in the given column, with all comments as one
+        document. Tokenized with gensim.utils.simple_preprocess. Returns
         two Pandas DataFrames, one holding the TF-IDF results and one word count.
 
+        The comments are counted chunksize at a time with a WordCounter, see
+        there for n_features (hashed words) and max_words (a capped
+        vocabulary), which bound the memory. counter takes a WordCounter to
+        add the comments to, the DataFrames then hold all comments it has
+        counted. See tf_idf_json for a corpus that doesn't fit in memory.
+        The tokens of tokenize are counted if it has been run on the column.
+
         Example: freq_df, count_df = a.tf_idf('body')
         """
 
-        print('Calculating TF-IDF for column: ', column)
+        logger.info('Calculating TF-IDF for column %s', column)
+        with self.metrics.stage('tf_idf', len(self.data)) as stage:
+            if counter is None:
+                counter = wc.WordCounter(n_features, max_words)
+
+            tokens = self.__tokens(column)
+            if tokens is not None:
+                counter.add_counts(tokens.term_counts(), len(tokens))
+            else:
+                comments = self.data[column]
+                for start in range(0, len(comments), chunksize):
+                    counter.add(comments.iloc[start:start + chunksize])
+
+            freq_df, count_df = counter.frames()
+            stage.rows_out = len(count_df)
+
+        logger.info('TF-IDF done.')
+        return freq_df, count_df
 
-        # Built the TF-IDF matrix from a guide on tutorialspoint.
-        # https://www.tutorialspoint.com/gensim/gensim_creating_tf_idf_matrix.htm
-        document = [' '.join( self.data[column] )]
 
-        doc_tokenized = [gensim.utils.simple_preprocess(doc) for doc in document]
 
-        dictionary = gensim.corpora.Dictionary()
+    def tf_idf_json(self, column, data_directory_path=None, chunksize=100000,
+                    n_features=None, max_words=None, regex=None,
+                    disallowed=None, dedupe_index=None):
+        """Calculates the same TF-IDF and word count as tf_idf for the data
+        files in the given directory path, reading them chunksize comments at
+        a time, so only one chunk, one file and the WordCounter are held in
+        memory. With n_features or max_words the memory is bounded whatever
+        the size of the corpus. Every chunk is cleaned like clean_data and, if
+        regex is given, apply_regex. Duplicates are removed across chunks with
+        dedupe_index, a DedupeIndex, or a new one. data holds the last chunk
+        afterwards.
 
-        BoW_corpus = [dictionary.doc2bow(doc, allow_update=True) for
-                      doc in doc_tokenized]
+        Example: freq_df, count_df = a.tf_idf_json('body', data_dir,
+                                                   n_features=2**20,
+                                                   regex=regex_input,
+                                                   disallowed=comment_list)
+        """
 
-        tfidf = gensim.models.TfidfModel(BoW_corpus, smartirs='ntc')
+        logger.info('Calculating TF-IDF for column %s in chunks', column)
+        counter = wc.WordCounter(n_features, max_words)
+        if dedupe_index is None:
+            dedupe_index = di.DedupeIndex()
 
-        for doc in tfidf[BoW_corpus]:
-            word_freq = [[dictionary[id], np.around(freq, decimals=3)] for
-                         id, freq in doc]
+        for _ in self.iter_data_json(data_directory_path, chunksize, [column]):
+            if regex is not None:
+                self.apply_regex(column, regex)
+            self.clean_data(column, disallowed=disallowed, keep_order=True,
+                            dedupe_index=dedupe_index)
+            with self.metrics.stage('tf_idf', len(self.data)) as stage:
+                counter.add(self.data[column])
+                stage.rows_out = len(self.data)
 
-        for doc in BoW_corpus:
-            word_count = [[dictionary[id], count] for id, count in doc]
+        logger.info('TF-IDF of %s done.', data_directory_path)
+        return counter.frames()
 
-        freq_df = pd.DataFrame(word_freq, columns=['Word', 'Frequency'])
-        count_df = pd.DataFrame(word_count, columns=['Word', 'Count'])
 
-        print('TF-IDF done.')
-        return freq_df, count_df
+
+    def tf_idf_matrix(self, column, directory=None):
+        """Calculates Term frequency - Inverse document frequency for every
+        comment in the given column. The comments are tokenized one at a time
+        with gensim.utils.simple_preprocess. Returns a sparse scipy CSR matrix
+        with one row per comment and one column per word, weighted like the
+        'ntc' scheme of gensim, and the gensim Dictionary that maps the columns
+        to words and holds the corpus level statistics (dfs, cfs, num_docs).
+        Both are kept in tfidf_matrix and dictionary and, if a directory is
+        given, saved there as tf_idf.npz and dictionary.gensim.
+
+        Example: matrix, dictionary = a.tf_idf_matrix('body', data_dir[:-5])
+        """
+
+        logger.info('Calculating TF-IDF matrix for column %s', column)
+
+        with self.metrics.stage('tf_idf', len(self.data)) as stage:
+            dictionary = gensim.corpora.Dictionary()
+            count_matrix = self.__count_matrix(column, dictionary)
+
+            self.tfidf_matrix = self.__ntc_weights(count_matrix, dictionary)
+            self.dictionary = dictionary
+            stage.rows_out = self.tfidf_matrix.shape[0]
+
+        if directory is not None:
+            self.write_tf_idf_matrix(directory)
+
+        logger.info('TF-IDF matrix done.')
+        return self.tfidf_matrix, self.dictionary
+
+
+
+    def write_tf_idf_matrix(self, directory):
+        """Saves tfidf_matrix and dictionary to tf_idf.npz and
+        dictionary.gensim in the given directory.
+
+        Example: a.write_tf_idf_matrix(data_dir[:-5])
+        """
+
+        logger.info('Writing TF-IDF matrix to: %s', directory)
+        matrix_path = os.path.join(directory, 'tf_idf.npz')
+        dictionary_path = os.path.join(directory, 'dictionary.gensim')
+
+        with self.metrics.stage('write', self.tfidf_matrix.shape[0]) as stage:
+            sparse.save_npz(matrix_path, self.tfidf_matrix)
+            self.dictionary.save(dictionary_path)
+            stage.rows_out = self.tfidf_matrix.shape[0]
+            stage.bytes_written = sm.file_size(matrix_path, dictionary_path)
+
+
+
+    def load_tf_idf_matrix(self, directory):
+        """Loads tfidf_matrix and dictionary saved by tf_idf_matrix from the
+        given directory.
+
+        Example: a.load_tf_idf_matrix(data_dir[:-5])
+        """
+
+        self.tfidf_matrix = sparse.load_npz(
+            os.path.join(directory, 'tf_idf.npz')).tocsr()
+        self.dictionary = gensim.corpora.Dictionary.load(
+            os.path.join(directory, 'dictionary.gensim'))
+        return self.tfidf_matrix, self.dictionary
+
+
+
+    def build_index(self, column, directory=None):
+        """Builds an InvertedIndex of the words in the given column, tokenized
+        like tf_idf_matrix, and keeps it in index. search uses it to find
+        comments by word. Build it after the rows of data are final, the index
+        holds the positions of the rows. If a directory is given the index is
+        saved there as index.npz.
+
+        Example: a.build_index('body', data_dir[:-5])
+        """
+
+        logger.info('Building inverted index for column %s', column)
+
+        with self.metrics.stage('build_index', len(self.data)) as stage:
+            dictionary = gensim.corpora.Dictionary()
+            count_matrix = self.__count_matrix(column, dictionary)
+            terms = [dictionary[id] for id in range(len(dictionary))]
+
+            self.index = ii.InvertedIndex(directory)
+            self.index.build(count_matrix, terms)
+            self.index_column = column
+            stage.rows_out = len(self.index)
+
+        if directory is not None:
+            self.index.save()
+
+        logger.info('Inverted index done.')
+        return self.index
+
+
+
+    def load_index(self, column, directory):
+        """Loads an index saved by build_index for the given column from the
+        given directory. It has to be built from the rows data holds now.
+
+        Example: a.load_index('body', data_dir[:-5])
+        """
+
+        self.index = ii.InvertedIndex(directory)
+        self.index_column = column
+        return self.index
+
+
+
+    def search(self, query, columns=None, n=None):
+        """Returns the rows of data that match the query, looked up in the
+        index built by build_index, with all columns or the given ones, so
+        with their HateSonar scores if hate_sonar has been run. n takes the
+        maximum number of rows to return. See InvertedIndex.search for the
+        query syntax: words, OR, -word and "quoted phrases".
+
+        Example: a.search('idiot OR "you are stupid"', ['body', 'top_class'])
+        """
+
+        if self.index is None:
+            raise Exception('No index, run build_index first.')
+        if self.index.n_docs != len(self.data):
+            raise Exception('The index was built for ' +
+                            str(self.index.n_docs) + ' rows but data has ' +
+                            str(len(self.data)) + ', run build_index again.')
+
+        texts = self.__tokens(self.index_column)
+        if texts is None:
+            texts = self.data[self.index_column]
+        positions = self.index.search(query, texts)
+        if n is not None:
+            positions = positions[:n]
+        rows = self.data.iloc[positions]
+        return rows if columns is None else rows[columns]
+
+
+
+    def top_terms(self, rows=None, n=20):
+        """Returns a DataFrame with the n words that have the highest summed
+        TF-IDF weight over the given rows of tfidf_matrix. rows takes a boolean
+        mask or a list of row positions, all rows are used if it is None.
+
+        Example: a.top_terms(a.data['top_class'] == 'hate_speech')
+        """
+
+        matrix = self.tfidf_matrix
+        if rows is not None:
+            matrix = matrix[np.asarray(rows)]
+
+        weights = np.asarray(matrix.sum(axis=0)).ravel()
+        n = min(n, len(weights))
+        top = np.argpartition(-weights, n - 1)[:n] if n > 0 else []
+        top = sorted(top, key=lambda id: -weights[id])
+
+        return pd.DataFrame({'Word': [self.dictionary[id] for id in top],
+                             'TF-IDF': weights[top]})
+
+
+
+    def analyze_incremental(self, column, state, regex=None, disallowed=None,
+                            batch_size=1000, n_jobs=1, cache=None):
+        """Processes only the comments in data that are new since the earlier
+        runs kept in state (an AnalyzerState): drops the comments whose 'id'
+        has been processed before, applies regex, removes NaN and empty
+        texts, texts in disallowed and texts that have been kept before, then
+        runs HateSonar on the rest and folds them into the state. data is left
+        holding the new scored comments, tfidf_matrix and dictionary are set
+        for all comments kept so far.
+
+        Every kept comment gets the same scores, word counts and TF-IDF weights
+        as if all runs had been processed in one run, whatever way the
+        comments were split over the runs. Returns a DataFrame with the
+        record of removed items, like clean_data.
+
+        Example:
+            state = ast.AnalyzerState(state_dir)
+            a.load_json(new_data_dir, new_metadata_dir)
+            removed_items = a.analyze_incremental('body', state, regex_input,
+                                                  comment_list)
+            state.save()
+        """
+
+        logger.info('Running incremental analysis on %s in data...', column)
+
+        ids = self.data['id'].to_numpy()
+        self.data = self.data.loc[state.new_rows(ids)]
+        self.data.reset_index(inplace=True, drop=True)
+        new_ids = self.data['id'].tolist()
+
+        if regex is not None:
+            self.apply_regex(column, regex)
+
+        removed_items = {'Data_orig_shape' : self.data.shape,
+                         'Data_new_shape' : 0,
+                         'Removed_NaN' : 0,
+                         'Removed_dups' : 0,
+                         'Removed_disallowed' : 0}
+
+        with self.metrics.stage('clean_data', len(self.data)) as stage:
+            values = self.data[column]
+            droplist = self.__NaN_mask(values).copy()
+            removed_items['Removed_NaN'] = int(droplist.sum())
+
+            if disallowed is not None:
+                to_drop = self.__disallowed_mask(values, ~droplist, disallowed)
+                removed_items['Removed_disallowed'] = int(to_drop.sum())
+                droplist |= to_drop
+
+            to_drop = ~droplist
+            to_drop[~droplist] = ~state.new_texts(values[~droplist])
+            removed_items['Removed_dups'] = int(to_drop.sum())
+            droplist |= to_drop
+
+            self.data = self.data.loc[~droplist]
+            self.data.reset_index(inplace=True, drop=True)
+            removed_items['Data_new_shape'] = self.data.shape
+            stage.rows_out = len(self.data)
+
+        self.tokenize(column)
+        self.hate_sonar(column, batch_size=batch_size, n_jobs=n_jobs,
+                        cache=cache)
+
+        with self.metrics.stage('tf_idf', len(self.data)) as stage:
+            counts = self.__count_matrix(column, state.dictionary)
+            state.add(new_ids, self.data, column, counts)
+            self.dictionary = state.dictionary
+            self.tfidf_matrix = self.__ntc_weights(state.counts,
+                                                   state.dictionary)
+            stage.rows_out = self.tfidf_matrix.shape[0]
+
+        logger.info('Incremental analysis of %s done.', column)
+        return pd.DataFrame(removed_items)
 
 
 
@@ -283,9 +1013,12 @@ class HateSpeechAnalyzer:
         Example: a.write_data_csv()
         """
 
-        path = self.data_directory_path[:-5]
-        print('Writing data to: ', path + 'data.csv \n')
-        self.data.to_csv(path + 'data.csv')
+        path = self.data_directory_path[:-5] + 'data.csv'
+        logger.info('Writing data to: %s', path)
+        with self.metrics.stage('write', len(self.data)) as stage:
+            self.data.to_csv(path)
+            stage.rows_out = len(self.data)
+            stage.bytes_written = sm.file_size(path)
 
 
 
@@ -295,72 +1028,278 @@ class HateSpeechAnalyzer:
 
         Example: a.write_metadata_csv()"""
 
-        path = self.metadata_directory_path[:-9]
-        print('Writing metadata to: ', path + 'metadata.csv \n')
-        self.metadata.to_csv(path + 'metadata.csv')
+        path = self.metadata_directory_path[:-9] + 'metadata.csv'
+        logger.info('Writing metadata to: %s', path)
+        with self.metrics.stage('write', len(self.metadata)) as stage:
+            self.metadata.to_csv(path)
+            stage.rows_out = len(self.metadata)
+            stage.bytes_written = sm.file_size(path)
 
 
-        
-    def __remove_duplicates(self, index, row, column):                
-        droplist = []
-        end_of_df_index = self.data.shape[0] - 1
-        dup_index = index + 1
 
-        if dup_index > end_of_df_index: return False
+    def write_parquet(self, partition_by='month'):
+        """Writes both the data and the metadata as Parquet in the directory
+        over the data directory respectively the metadata directory.
 
-        str1 = row[column]
-        str2 = self.data.loc[dup_index].at[column]
+        Example: a.write_parquet()
+        """
 
-        while (str1 == str2):
-            droplist.append(dup_index)
+        self.write_data_parquet(partition_by)
+        self.write_metadata_parquet()
 
-            dup_index += 1
 
-            if dup_index > end_of_df_index: return droplist
 
-            str2 = self.data.loc[dup_index].at[column]
-                        
-        if droplist: return droplist
+    def write_data_parquet(self, partition_by='month'):
+        """Writes the data to a data.parquet directory in the directory over
+        the data directory. The rows are partitioned on the time window of
+        created_utc given by partition_by ('day', 'month', 'year' or None).
 
-        return False        
-        
+        Example: a.write_data_parquet()
+        """
 
+        path = self.data_directory_path[:-5] + 'data.parquet'
+        logger.info('Writing data to: %s', path)
+        with self.metrics.stage('write', len(self.data)) as stage:
+            store = ps.ParquetStore(path, partition_by)
+            store.clear()
+            paths = store.write(self.data, 'data')
+            stage.rows_out = len(self.data)
+            stage.bytes_written = sm.file_size(*paths)
 
-    def __remove_NaN(self, index, row, column):
-        if (pd.isna(row[column])) or (not row[column]):
-            return index
-        else:
-            return False
+
+
+    def write_metadata_parquet(self):
+        """Writes the metadata to a metadata.parquet directory in the directory
+        over the metadata directory.
+
+        Example: a.write_metadata_parquet()
+        """
+
+        path = self.metadata_directory_path[:-9] + 'metadata.parquet'
+        logger.info('Writing metadata to: %s', path)
+        with self.metrics.stage('write', len(self.metadata)) as stage:
+            store = ps.ParquetStore(path, partition_by=None)
+            store.clear()
+            paths = store.write(self.metadata, 'metadata')
+            stage.rows_out = len(self.metadata)
+            stage.bytes_written = sm.file_size(*paths)
 
 
         
-    def __remove_disallowed(self, index, row, column, disallowed):
-        if row[column] in disallowed:
-            return index
-        else:
-            return False
+    def __count_matrix(self, column, dictionary):
+        """Returns a CSR matrix with the word counts of every comment in the
+        given column and adds new words to the dictionary, from the tokens of
+        tokenize or, if it hasn't been run on the column, tokenizing the
+        comments now."""
 
+        tokens = self.__tokens(column)
+        if tokens is None:
+            tokens = tc.TokenCache(keep_lowered=False)
+            tokens.add(self.data[column])
+        return tokens.count_matrix(dictionary)
 
 
-    def __apply_regex(self, index, row, column, regex):
-        new_string = row[column]
-        for key, value in regex.items():
-            new_string = re.sub(key, value, new_string)
-        self.data.at[index, column] = new_string
+
+    def __tokens(self, column):
+        """Returns tokens if tokenize was run on the column of the current
+        data, None otherwise."""
+
+        if (self.tokens is not None and self.tokens_column == column
+                and self.tokens_data() is self.data
+                and len(self.tokens) == len(self.data)):
+            return self.tokens
+        return None
+
+
+
+    def __lowered(self, column, already_lower):
+        """Returns the texts of the column in lower case without lowercasing
+        them, from data if already_lower or else from tokens, None if
+        neither has them."""
+
+        if already_lower:
+            return self.data[column].tolist()
+        tokens = self.__tokens(column)
+        if tokens is not None and tokens.lowered is not None:
+            return tokens.lowered
         return None
 
 
+
+    def __ntc_weights(self, count_matrix, dictionary):
+        """Weights a count matrix like gensim's 'ntc': the raw term count, idf
+        as log2((num_docs + 1) / df) and cosine normalization of each row.
+        The idf is above 0 for every word, so words in every comment keep a
+        weight, like in gensim."""
+
+        dfs = np.zeros(count_matrix.shape[1])
+        dfs[list(dictionary.dfs.keys())] = list(dictionary.dfs.values())
+        idf = np.log2((dictionary.num_docs + 1) / np.maximum(dfs, 1))
+
+        matrix = count_matrix.multiply(idf).tocsr()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1))).ravel()
+        norms[norms == 0] = 1
+        matrix = sparse.diags(1 / norms) @ matrix
+        matrix = matrix.tocsr()
+        matrix.eliminate_zeros()
+        matrix.sort_indices()
+        return matrix
+
+
+
+    def __sample_progress(self, estimate_df, n_comments):
+        """Returns one row of the progress of hate_sonar_sample."""
+
+        scored = int(estimate_df['scored'].iloc[0])
+        row = {'scored': scored, 'fraction': scored / max(n_comments, 1)}
+        for name, estimate in estimate_df.iterrows():
+            row[name] = estimate['estimate']
+            row[name + '_lower'] = estimate['lower']
+            row[name + '_upper'] = estimate['upper']
+        row['max_width'] = estimate_df['width'].max()
+        return row
+
+
+
+    def __index_entities(self):
+        """Adds the loaded comments to entities."""
+
+        with self.metrics.stage('index_entities', len(self.data)) as stage:
+            self.entities.add_comments(self.data)
+            stage.rows_out = len(self.data)
+
+
+
+    def __compact_column(self, values, column, categorical_ratio, is_text,
+                         arrow_strings):
+        """Returns the column in its smallest dtype that keeps every value."""
+
+        if column == 'created_utc':
+            numbers = pd.to_numeric(values)
+            return numbers.astype('int64' if numbers.notna().all() else 'Int64')
+
+        if pd.api.types.is_bool_dtype(values):
+            return values
+
+        if pd.api.types.is_integer_dtype(values):
+            return pd.to_numeric(values, downcast='integer')
+
+        if pd.api.types.is_float_dtype(values):
+            downcast = pd.to_numeric(values, downcast='float')
+            if np.array_equal(downcast.to_numpy(np.float64),
+                              values.to_numpy(np.float64), equal_nan=True):
+                return downcast
+            return values
+
+        is_string_dtype = isinstance(values.dtype, pd.StringDtype)
+        if values.dtype != object and not is_string_dtype:
+            return values
+
+        if is_text:
+            return values.astype('string[pyarrow]') if arrow_strings else values
+
+        if (not is_string_dtype
+                and pd.api.types.infer_dtype(values, skipna=True) != 'string'):
+            return values # Lists, dictionaries or mixed types.
+
+        if values.nunique(dropna=True) <= categorical_ratio * len(values):
+            return values.astype('category')
+        return values
+
+
+
+    def __NaN_mask(self, values):
+        """Marks NaN and empty strings."""
+
+        return (values.isna() | (values == '')).to_numpy()
+
+
+
+    def __duplicates_mask(self, values, remaining):
+        """Marks every repeat of a string among the remaining rows, keeping the
+        first one. Also returns a mask of all remaining rows whose string occurs
+        more than once, the kept row included."""
+
+        candidates = values[remaining]
+        to_drop = np.zeros(len(values), dtype=bool)
+        has_dups = np.zeros(len(values), dtype=bool)
+        to_drop[remaining] = candidates.duplicated(keep='first').to_numpy()
+        has_dups[remaining] = candidates.duplicated(keep=False).to_numpy()
+        return to_drop, has_dups
+
+
+
+    def __disallowed_mask(self, values, remaining, disallowed):
+        """Marks the remaining rows whose string is in disallowed."""
+
+        return remaining & values.isin(list(disallowed)).to_numpy()
+
+
+
     
-    def __load_data_json_file(self, file_path):
-        with open(file_path, 'r') as json_data:
-            d = json.load(json_data)
-            d = pd.json_normalize(d)
-            return d
-            
+    def __json_file_paths(self, directory_path):
+        """Returns the paths to all files in the given directory, sorted on the
+        numbers in their names so data_10.json comes after data_9.json.
+        Temporary files left by an interrupted download are skipped."""
+
+        file_names = [f for f in os.listdir(directory_path)
+                      if os.path.isfile(os.path.join(directory_path, f))
+                      and not f.endswith('.tmp')]
+        file_names.sort(key=lambda fn: ([int(n) for n in re.findall(r'\d+', fn)],
+                                        fn))
+        return [os.path.join(directory_path, fn) for fn in file_names]
+
+
+
+    def __load_json_files(self, paths, n_workers, use_processes,
+                          columns=None):
+        """Loads and normalizes the given files, n_workers at a time, and
+        returns the DataFrames in the order of paths."""
+
+        load_file = partial(_load_json_file, columns=columns)
+        if n_workers == 1:
+            return [load_file(path) for path in paths]
+
+        if use_processes:
+            executor = ProcessPoolExecutor(n_workers)
+        else:
+            executor = ThreadPoolExecutor(n_workers)
+
+        with executor:
+            chunksize = max(1, len(paths) // (n_workers * 4))
+            return list(executor.map(load_file, paths, chunksize=chunksize))
+
+
+
+    def __project(self, records, columns):
+        """Keeps only the top level fields that the given columns need."""
+
+        if columns is None:
+            return records
+
+        fields = {column.split('.')[0] for column in columns}
+        return [{f: record[f] for f in fields if f in record}
+                for record in records]
+
+
+
+    def __records_to_frame(self, records, columns):
+        """Normalizes a list of records into a DataFrame with the given
+        columns."""
+
+        df = pd.json_normalize(records)
+        if columns is not None:
+            df = df.reindex(columns=columns)
+        return df
+
+
 
+def _load_json_file(file_path, columns=None):
+    """Loads one .json or .jsonl.gz file into a DataFrame, keeping only the
+    given columns that it has. Kept outside the class so it can be sent to a
+    process pool."""
 
-    def __load_metadata_json_file(self, file_path):
-        with open(file_path, 'r') as json_data:
-            md = json.load(json_data)
-            md = pd.json_normalize(md)
-            return md
\ No newline at end of file
+    d = pd.json_normalize(jl.load(file_path))
+    if columns is not None:
+        d = d[[c for c in columns if c in d.columns]]
+    return d
@@ -0,0 +1,239 @@
+import json
+import os
+import re
+import numpy as np
+import AtomicFile as af
+import LazyModule as lm
+import TokenCache as tc
+
+
+gensim = lm.LazyModule('gensim')
+
+
+
+class InvertedIndex:
+    """Class that maps every word to the sorted positions of the comments that
+    contain it, so comments can be found by word without going through the
+    texts. Words are the tokens of gensim.utils.simple_preprocess, the same as
+    in the TF-IDF methods of HateSpeechAnalyzer. The postings of all words are
+    kept in one array, CSR style, as the gaps between the positions, which are
+    small numbers that compress well when the index is saved.
+
+    search takes words, which all have to be in a comment, OR between groups
+    of words, -word for words that may not be in a comment and "quoted words"
+    for phrases. Phrases are looked up as words and then checked in the texts
+    of the comments that have all of them, so the index doesn't have to keep
+    the position of every word.
+
+    Example:
+        import InvertedIndex as ii
+        index = ii.InvertedIndex()
+        index.build(count_matrix, terms)
+        positions = index.search('idiot OR "you are stupid" -joke', texts)
+        index.save('data/index/')
+    """
+
+
+
+    def __init__(self, directory_path=None):
+
+        self.directory_path = directory_path
+        self.terms = np.zeros(0, dtype=str)
+        self.term_ids = dict()
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.gaps = np.zeros(0, dtype=np.uint32)
+        self.n_docs = 0
+
+        if directory_path is not None and os.path.exists(self.__path()):
+            self.read(self.__path())
+
+
+
+    def build(self, count_matrix, terms):
+        """Replaces the index with the postings of a word count matrix with one
+        row per comment and one column per word in terms, like the matrices
+        HateSpeechAnalyzer builds for TF-IDF.
+
+        Example: index.build(count_matrix, terms)
+        """
+
+        postings = count_matrix.tocsc()
+        postings.sort_indices()
+        positions = postings.indices.astype(np.int64)
+        indptr = postings.indptr.astype(np.int64)
+
+        # Every word starts its own run of gaps from position 0.
+        gaps = np.diff(positions, prepend=0)
+        firsts = indptr[:-1][np.diff(indptr) > 0]
+        gaps[firsts] = positions[firsts]
+
+        self.terms = np.asarray(terms, dtype=str)
+        self.term_ids = {term: id for id, term in enumerate(self.terms.tolist())}
+        self.indptr = indptr
+        self.gaps = gaps.astype(np.uint32)
+        self.n_docs = count_matrix.shape[0]
+
+
+
+    def postings(self, term):
+        """Returns the sorted positions of the comments that contain the
+        word. The word is not tokenized, see search.
+
+        Example: positions = index.postings('idiot')
+        """
+
+        id = self.term_ids.get(term)
+        if id is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.cumsum(self.gaps[self.indptr[id]:self.indptr[id + 1]],
+                         dtype=np.int64)
+
+
+
+    def document_frequency(self, term):
+        id = self.term_ids.get(term)
+        return 0 if id is None else int(self.indptr[id + 1] - self.indptr[id])
+
+
+
+    def search(self, query, texts=None):
+        """Returns the sorted positions of the comments that match the query.
+        Groups of words are separated by OR. Within a group every word has to
+        be in a comment, words with a - in front may not be. Quoted words are
+        a phrase, their tokens have to follow each other, which is checked in
+        texts, the texts the index was built from or a TokenCache of them.
+        Words are tokenized like the comments, words that give no token (like
+        'a') are left out.
+
+        Example: positions = index.search('hate speech OR slur -joke')
+        """
+
+        matches = np.zeros(0, dtype=np.int64)
+        for group in _split_groups(query):
+            matches = np.union1d(matches, self.__search_group(group, texts))
+        return matches
+
+
+
+    def save(self, directory_path=None):
+        """Saves the index to index.npz in its directory, or in the given one.
+
+        Example: index.save()
+        """
+
+        if directory_path is not None:
+            self.directory_path = directory_path
+        af.save(self.__path(), self.write)
+
+
+
+    def write(self, file):
+        """Writes the index, compressed, to an open file or a path."""
+
+        settings = {'n_docs': self.n_docs}
+        np.savez_compressed(file, settings=np.array(json.dumps(settings)),
+                            terms=self.terms, indptr=self.indptr,
+                            gaps=self.gaps)
+
+
+
+    def read(self, file):
+        """Replaces the index with one written by write."""
+
+        with np.load(file) as arrays:
+            self.n_docs = json.loads(str(arrays['settings']))['n_docs']
+            self.terms = arrays['terms']
+            self.indptr = arrays['indptr']
+            self.gaps = arrays['gaps']
+        self.term_ids = {term: id for id, term in enumerate(self.terms.tolist())}
+
+
+
+    def __len__(self):
+        return len(self.terms)
+
+
+
+    def __search_group(self, group, texts):
+        """Returns the positions of the comments that match one group of words
+        of a query."""
+
+        required = list()
+        excluded = list()
+        phrases = list()
+        excluded_phrases = list()
+        for word, negated in group:
+            tokens = gensim.utils.simple_preprocess(word)
+            if len(tokens) == 0:
+                continue
+            if negated and len(tokens) > 1:
+                excluded_phrases.append(tokens)
+            elif negated:
+                excluded.append(tokens[0])
+            else:
+                required.extend(tokens)
+                if len(tokens) > 1:
+                    phrases.append(tokens)
+
+        if len(required) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # The rarest words first, so the intersections stay small.
+        required = sorted(set(required), key=self.document_frequency)
+        matches = self.postings(required[0])
+        for term in required[1:]:
+            if len(matches) == 0:
+                break
+            matches = np.intersect1d(matches, self.postings(term),
+                                     assume_unique=True)
+        for term in excluded:
+            matches = np.setdiff1d(matches, self.postings(term),
+                                   assume_unique=True)
+
+        if (len(phrases) > 0 or len(excluded_phrases) > 0) and len(matches) > 0:
+            if texts is None:
+                raise Exception('Phrase queries need the texts of the index.')
+            if isinstance(texts, tc.TokenCache):
+                tokens_of = texts.tokens
+            else:
+                texts = texts.iloc if hasattr(texts, 'iloc') else texts
+                tokens_of = lambda position: gensim.utils.simple_preprocess(
+                    texts[position])
+
+            keep = np.empty(len(matches), dtype=bool)
+            for i, position in enumerate(matches.tolist()):
+                tokens = tokens_of(position)
+                keep[i] = (all(_contains(tokens, phrase) for phrase in phrases)
+                           and not any(_contains(tokens, phrase)
+                                       for phrase in excluded_phrases))
+            matches = matches[keep]
+        return matches
+
+
+
+    def __path(self):
+        return os.path.join(self.directory_path, 'index.npz')
+
+
+
+def _split_groups(query):
+    """Splits a query into the groups between OR, each a list of
+    (words, negated) tuples. Quoted words stay together."""
+
+    groups = [[]]
+    for word in re.findall(r'-?"[^"]*"?|\S+', query):
+        if word == 'OR':
+            groups.append([])
+            continue
+        negated = word.startswith('-')
+        groups[-1].append((word.lstrip('-').strip('"'), negated))
+    return groups
+
+
+
+def _contains(tokens, phrase):
+    """Returns True if the phrase is in the tokens as consecutive tokens."""
+
+    n = len(phrase)
+    return any(tokens[i:i + n] == phrase for i in range(len(tokens) - n + 1)
+               if tokens[i] == phrase[0])
@@ -0,0 +1,79 @@
+"""Reads and writes JSON with orjson (https://github.com/ijl/orjson) when it is
+installed and the json module otherwise, and reads and writes the compact
+page format of RedditDataDL: one JSON record per line, gzip compressed, in
+files named *.jsonl.gz. orjson parses bytes straight away and writes bytes,
+so nothing is decoded to or encoded from a str in between.
+
+Example:
+    import JsonLines as jl
+    jl.write_records('data_0.jsonl.gz', comments)
+    comments = jl.read_records('data_0.jsonl.gz')
+"""
+
+import gzip
+import json
+import AtomicFile as af
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+extension = '.jsonl.gz'
+
+
+
+def loads(content):
+    """Parses JSON from bytes or a str."""
+
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+
+def dumps(value):
+    """Returns value as compact JSON in UTF-8 bytes."""
+
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+
+def load(path):
+    """Parses a .json file, or a .jsonl or .jsonl.gz file into a list of its
+    records."""
+
+    if is_json_lines(path):
+        return read_records(path)
+    with open(path, 'rb') as json_file:
+        return loads(json_file.read())
+
+
+
+def read_records(path):
+    """Returns the records of a .jsonl or .jsonl.gz file as a list."""
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as lines_file:
+        lines = [line for line in lines_file.read().split(b'\n')
+                 if line.strip()]
+    # One parse of the whole file as an array is faster than one per line.
+    return loads(b'[' + b','.join(lines) + b']')
+
+
+
+def write_records(path, records, compresslevel=1):
+    """Writes the records one per line to a .jsonl.gz file, atomically, see
+    AtomicFile."""
+
+    with af.atomic_open(path, 'wb', gzip.open,
+                        compresslevel=compresslevel) as f:
+        f.write(b''.join(dumps(record) + b'\n' for record in records))
+
+
+
+def is_json_lines(path):
+    return path.endswith('.jsonl') or path.endswith('.jsonl.gz')
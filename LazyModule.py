@@ -0,0 +1,49 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """Class that stands in for a module and imports it the first time one of
+    its attributes is used, so heavy dependencies like hatesonar, gensim and
+    pyarrow only cost start up time and memory in the runs that need them.
+
+    Example:
+        import LazyModule as lm
+        gensim = lm.LazyModule('gensim')
+        gensim.utils.simple_preprocess(text) # gensim is imported here.
+    """
+
+
+
+    def __init__(self, name):
+
+        self.__name = name
+        self.__module = None
+        self.__lock = threading.Lock()
+
+
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+
+
+    def load(self):
+        """Imports the module if that has not been done and returns it."""
+
+        if self.__module is None:
+            with self.__lock:
+                if self.__module is None:
+                    self.__module = importlib.import_module(self.__name)
+        return self.__module
+
+
+
+    def is_loaded(self):
+        return self.__module is not None
+
+
+
+    def __repr__(self):
+        state = 'loaded' if self.is_loaded() else 'not loaded'
+        return '<LazyModule ' + self.__name + ' (' + state + ')>'
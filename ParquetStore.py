@@ -0,0 +1,192 @@
+import json
+import os
+import re
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import AtomicFile as af
+import LazyModule as lm
+
+
+# Imported the first time a Parquet file is read or written.
+pa = lm.LazyModule('pyarrow')
+pq = lm.LazyModule('pyarrow.parquet')
+
+
+class ParquetStore:
+    """Class that stores DataFrames as compressed Parquet files in a directory.
+    Rows with a 'created_utc' column are partitioned on their time window into
+    sub directories named like created_month=2021-01, so every time window is
+    kept in its own files. Files are read with memory mapping and only the
+    requested columns are read.
+
+    Example:
+        import ParquetStore as ps
+        store = ps.ParquetStore('data/TheRedPill_comment_1420066800_1612134000/data/')
+        store.write(df, 'data_0')
+        df = store.read(columns=['body', 'created_utc'])
+    """
+
+    windows = {'day': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+
+
+
+    def __init__(self, directory_path, partition_by='month', compression='zstd'):
+
+        if partition_by is not None and partition_by not in self.windows:
+            raise Exception('Invalid partition_by: ' + str(partition_by) +
+                            '. Use one of ' + ', '.join(self.windows) +
+                            ' or None.')
+
+        self.directory_path = directory_path
+        self.partition_by = partition_by
+        self.compression = compression
+
+
+
+    def write(self, df, file_name):
+        """Writes the DataFrame to file_name.parquet, split over the time window
+        partitions if partition_by is set and it has a 'created_utc' column.
+        Every file is written to a temporary file first and then moved in
+        place, so a crash never leaves a half written file. Returns the paths
+        of the written files.
+
+        Example: store.write(df, 'data_0')
+        """
+
+        if self.partition_by is None or 'created_utc' not in df.columns:
+            return [self.__write_file(df, self.directory_path, file_name)]
+
+        created = pd.to_datetime(pd.to_numeric(df['created_utc']), unit='s')
+        windows = created.dt.strftime(self.windows[self.partition_by])
+
+        paths = list()
+        for window, part in df.groupby(windows.to_numpy(), sort=True):
+            directory = os.path.join(self.directory_path,
+                                     'created_' + self.partition_by + '=' + window)
+            paths.append(self.__write_file(part, directory, file_name))
+        return paths
+
+
+
+    def read(self, columns=None, n_workers=1, use_processes=False):
+        """Reads all files in the store into one DataFrame, ordered on time
+        window and then on the numbers in the file names. Only the given
+        columns are read, all of them if None. With n_workers > 1 the files
+        are read in a pool of threads, or of processes if use_processes is
+        True.
+
+        Example: df = store.read(columns=['body', 'created_utc'])
+        """
+
+        paths = self.files()
+        read_file = partial(_read_parquet_file, columns=columns)
+
+        if n_workers == 1 or len(paths) < 2:
+            dfs = [read_file(path) for path in paths]
+        else:
+            if use_processes:
+                executor = ProcessPoolExecutor(n_workers)
+            else:
+                executor = ThreadPoolExecutor(n_workers)
+            with executor:
+                dfs = list(executor.map(read_file, paths))
+
+        if not dfs:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(dfs, ignore_index=True, copy=False)
+
+
+
+    def clear(self):
+        """Removes all .parquet files in the store, so it can be written anew.
+
+        Example: store.clear()
+        """
+
+        for path in self.files():
+            os.remove(path)
+
+
+
+    def remove(self, file_name):
+        """Removes file_name.parquet from every time window partition.
+
+        Example: store.remove('data_0')
+        """
+
+        for path in self.files():
+            if os.path.basename(path) == file_name + '.parquet':
+                os.remove(path)
+
+
+
+    def files(self):
+        """Returns the paths to all .parquet files in the store, ordered on
+        time window and then on the numbers in the file names."""
+
+        paths = list()
+        for directory, _, file_names in os.walk(self.directory_path):
+            paths.extend(os.path.join(directory, fn) for fn in file_names
+                         if fn.endswith('.parquet'))
+
+        def order(path):
+            window = os.path.basename(os.path.dirname(path))
+            file_name = os.path.basename(path)
+            return (window, [int(n) for n in re.findall(r'\d+', file_name)],
+                    file_name)
+
+        return sorted(paths, key=order)
+
+
+
+    def __write_file(self, df, directory, file_name):
+        """Writes one compressed Parquet file."""
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, file_name + '.parquet')
+        with af.atomic_path(path) as temporary_path:
+            pq.write_table(self.__to_table(df), temporary_path,
+                           compression=self.compression)
+        return path
+
+
+
+    def __to_table(self, df):
+        """Converts the DataFrame to an Arrow table. Columns that Arrow can't
+        type, such as Pushshift fields that are sometimes a bool and sometimes
+        a number, are stored as JSON strings."""
+
+        arrays = list()
+        for column in df.columns:
+            values = df[column]
+            # Only the categories in use, not all keys of an EntityIndex.
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.cat.remove_unused_categories()
+            try:
+                arrays.append(pa.array(values, from_pandas=True))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                arrays.append(pa.array(df[column].map(_to_json_string),
+                                       type=pa.string()))
+        return pa.Table.from_arrays(arrays, names=[str(c) for c in df.columns])
+
+
+
+def _read_parquet_file(path, columns=None):
+    """Reads the given columns of one Parquet file with memory mapping.
+    Columns that the file does not have are filled with NaN."""
+
+    if columns is not None:
+        names = set(pq.read_schema(path, memory_map=True).names)
+        table = pq.read_table(path, columns=[c for c in columns if c in names],
+                              memory_map=True)
+        return table.to_pandas().reindex(columns=columns)
+
+    return pq.read_table(path, memory_map=True).to_pandas()
+
+
+
+def _to_json_string(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return json.dumps(value, default=str)
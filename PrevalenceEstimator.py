@@ -0,0 +1,192 @@
+import statistics
+import numpy as np
+import pandas as pd
+import SonarScorer as ss
+
+
+_FREQUENCIES = {'day': 'D', 'week': 'W', 'month': 'M'}
+
+
+
+class PrevalenceEstimator:
+    """Class that estimates the share of every HateSonar top_class in a set
+    of comments from a sample of them, stratified by time bucket, with
+    confidence intervals that get tighter as more of the sample is scored.
+
+    strata takes one label per comment, for example the week it was made in.
+    order returns the comments in the order to score them: a random order in
+    which every prefix holds about the same fraction of every stratum, so the
+    estimate can be taken after any number of comments. add takes the
+    top_class of scored comments and estimate returns the stratified share of
+    every class with a Wilson score interval, which unlike the normal
+    approximation isn't 0 wide when every scored comment has the same class.
+
+    Example:
+        import PrevalenceEstimator as pe
+        estimator = pe.PrevalenceEstimator(weeks, confidence=0.95)
+        order = estimator.order()
+        estimator.add(order[:1000], top_class_of_the_first_1000)
+        estimate_df = estimator.estimate()
+    """
+
+
+
+    def __init__(self, strata, confidence=0.95, seed=0):
+
+        self.confidence = confidence
+        self.z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+        self.seed = seed
+
+        self.strata, labels = pd.factorize(pd.Series(strata),
+                                           use_na_sentinel=False)
+        self.labels = pd.Index(labels)
+        self.sizes = np.bincount(self.strata, minlength=len(self.labels))
+        self.counts = np.zeros((len(self.labels), len(ss.CLASSES)),
+                               dtype=np.int64)
+
+
+
+    def order(self):
+        """Returns the positions of all comments in the order to score them.
+        Every comment gets the priority (rank in its stratum + u) / size of
+        its stratum, with a random rank and u, and the comments are sorted on
+        it."""
+
+        rng = np.random.default_rng(self.seed)
+        n = len(self.strata)
+        shuffled = rng.permutation(n)
+        strata = self.strata[shuffled]
+
+        # Rank of every comment within its stratum, in the shuffled order.
+        by_stratum = np.argsort(strata, kind='stable')
+        starts = np.cumsum(self.sizes) - self.sizes
+        ranks = np.empty(n, dtype=np.int64)
+        ranks[by_stratum] = np.arange(n) - np.repeat(starts, self.sizes)
+
+        priority = (ranks + rng.random(n)) / self.sizes[strata]
+        return shuffled[np.argsort(priority, kind='stable')]
+
+
+
+    def add(self, positions, top_class):
+        """Adds the top_class of the comments at the given positions."""
+
+        classes = pd.Categorical(top_class, categories=ss.CLASSES).codes
+        scored = classes >= 0
+        np.add.at(self.counts, (self.strata[np.asarray(positions)][scored],
+                                classes[scored]), 1)
+
+
+
+    def estimate(self):
+        """Returns a DataFrame with one row per class: the estimated share,
+        the lower and upper bound of the confidence interval and its
+        width, and the number of comments scored. Strata without scored
+        comments are left out of the estimate.
+
+        The interval is the Wilson score interval for the effective sample
+        size of the stratified estimate, the number of comments that would
+        give its variance in a simple random sample. The variance of every
+        stratum is corrected for its finite size. When the variance is 0,
+        because all scored comments have the same class, the number of
+        scored comments is used.
+
+        Example: estimate_df = estimator.estimate()
+        """
+
+        n_h = self.counts.sum(axis=1)
+        sampled = n_h > 0
+        if not sampled.any():
+            return pd.DataFrame({'estimate': np.nan, 'lower': np.nan,
+                                 'upper': np.nan, 'width': np.nan,
+                                 'scored': 0},
+                                index=pd.Index(ss.CLASSES, name='top_class'))
+
+        n_h = n_h[sampled]
+        sizes = self.sizes[sampled]
+        weights = sizes / sizes.sum()
+
+        shares = self.counts[sampled] / np.maximum(n_h, 1)[:, None]
+        estimate = weights @ shares
+
+        # Sample variance of every stratum, the pooled share for strata with
+        # a single scored comment.
+        correction = n_h / np.maximum(n_h - 1, 1)
+        variance = shares * (1 - shares) * correction[:, None]
+        variance[n_h == 1] = estimate * (1 - estimate)
+        finite = 1 - n_h / sizes
+        terms = (weights ** 2 * finite / n_h)[:, None] * variance
+        standard_error = np.sqrt(terms.sum(axis=0))
+
+        lower, upper = self.__wilson(estimate, standard_error, n_h.sum(),
+                                     (n_h == sizes).all())
+        return pd.DataFrame({'estimate': estimate,
+                             'lower': lower,
+                             'upper': upper,
+                             'width': upper - lower,
+                             'scored': int(n_h.sum())},
+                            index=pd.Index(ss.CLASSES, name='top_class'))
+
+
+
+    def scored_strata(self, minimum):
+        """Returns True if every stratum has at least minimum scored
+        comments, or all its comments if it has fewer.
+
+        Example: estimator.scored_strata(10)
+        """
+
+        return bool((self.counts.sum(axis=1)
+                     >= np.minimum(self.sizes, minimum)).all())
+
+
+
+    def by_stratum(self):
+        """Returns a DataFrame with the size, the number of scored comments
+        and the share of every class in the sample of every stratum.
+
+        Example: weekly_df = estimator.by_stratum()
+        """
+
+        scored = self.counts.sum(axis=1)
+        columns = {'size': self.sizes, 'scored': scored}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k, name in enumerate(ss.CLASSES):
+                columns[name] = self.counts[:, k] / scored
+        return pd.DataFrame(columns, index=self.labels).sort_index()
+
+
+
+
+    def __wilson(self, estimate, standard_error, n, census):
+        """Returns the lower and upper bounds of the Wilson score interval of
+        every share."""
+
+        if census: # Every comment is scored, the shares are exact.
+            return estimate, estimate.copy()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n_effective = np.where(standard_error > 0, estimate
+                                   * (1 - estimate) / standard_error ** 2, n)
+        z2 = self.z ** 2
+        center = (estimate + z2 / (2 * n_effective)) / (1 + z2 / n_effective)
+        half_width = self.z / (1 + z2 / n_effective) * np.sqrt(
+            estimate * (1 - estimate) / n_effective
+            + z2 / (4 * n_effective ** 2))
+        return (np.clip(center - half_width, 0, 1),
+                np.clip(center + half_width, 0, 1))
+
+
+def time_strata(created_utc, freq='week'):
+    """Returns the day, week or month, as a pandas Period, that every
+    created_utc in seconds falls in, to use as strata. NaT for missing
+    values.
+
+    Example: weeks = pe.time_strata(a.data['created_utc'], 'week')
+    """
+
+    if freq not in _FREQUENCIES:
+        raise Exception('freq has to be one of ' + ', '.join(_FREQUENCIES)
+                        + '.')
+    created = pd.to_numeric(pd.Series(created_utc), errors='coerce')
+    return pd.to_datetime(created, unit='s').dt.to_period(_FREQUENCIES[freq])
@@ -1,6 +1,21 @@
 import requests
+import bisect
+import copy
+import hashlib
 import json
+import logging
 import os
+import threading
+import time
+import pandas as pd
+import AtomicFile as af
+import JsonLines as jl
+import ParquetStore as ps
+import StageMetrics as sm
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
 
 
 class RedditDataDL:
@@ -9,17 +24,34 @@ class RedditDataDL:
     that can be used on their site. This class requires a directory 'data' in the
     same place as the program.
 
+    Pages are saved as .json files by default. With storage_format='parquet'
+    every pages_per_file pages are saved together as compressed Parquet files,
+    partitioned on the time window given by partition_by ('day', 'month' or
+    'year'). Load them with HateSpeechAnalyzer.load_parquet. With
+    storage_format='jsonl' every page is saved compactly as gzip compressed
+    .jsonl.gz files with one comment per line, which
+    HateSpeechAnalyzer.load_json reads as well. Responses are parsed from the
+    raw bytes with orjson when it is installed.
+
+    The time spent on every page and the latency of every HTTP request are
+    recorded in metrics, a StageMetrics.
+
     Example:
         import RedditDataDL as rddl
         d = rddl.RedditDataDL(endpoint='comment', before="1577923200",
                                after="1577836800",subreddit='climbharder')
     """
 
+    retry_status_codes = (429, 500, 502, 503, 504)
+
 
 
     def __init__(self, endpoint, q=None, ids=None, size=500, fields=None, sort=None,
                  sort_type=None, aggs=None, author=None, subreddit=None, after=None,
-                 before=None, frequency=None, metadata='true'):
+                 before=None, frequency=None, metadata='true',
+                 storage_format='json', partition_by='month', pages_per_file=20,
+                 base_url='https://api.pushshift.io/reddit/', max_retries=5,
+                 backoff=1.0, metrics=None):
 
         # For the Pushshift URL
         self.endpoint = endpoint
@@ -37,17 +69,39 @@ class RedditDataDL:
         self.frequency = frequency
         self.metadata = metadata
 
+        self.base_url = base_url
+
+        # Retries on 429 and 5xx responses, waiting backoff * 2**attempt seconds.
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = None # Shared requests.Session when set.
+        self.rate_limiter = None # Shared RateLimiter when set.
+        self.metrics = metrics if metrics is not None else sm.StageMetrics()
+
+        # Storage parameters
+        if storage_format not in ('json', 'jsonl', 'parquet'):
+            raise Exception('Invalid storage format.')
+        self.storage_format = storage_format
+        self.partition_by = partition_by
+        self.pages_per_file = pages_per_file
+
         # Class parameters
         self.request_counter = 0
+        self.comment_counter = 0
         self.is_data_saved = False
         self.is_data_cleaned = False
 
 
 
-    def get_data(self):
+    def get_data(self, resume=False):
         """"Creates one sub directory in the 'data' directory. Then stores all
         downloaded data and metadata to it. Throws exception if the sub
-        directory already exists.
+        directory already exists, unless resume is True.
+
+        Every saved page is recorded in a manifest.jsonl file next to the data
+        and metadata directories, with the cursor, request counter and hash of
+        its files. With resume=True an interrupted download continues after
+        the last page that is still intact on disk.
 
         Example: d.get_data()
         """
@@ -55,7 +109,9 @@ class RedditDataDL:
         data_path = self.__make_path('data')
         metadata_path = self.__make_path('metadata')
 
-        if os.path.exists(data_path) or os.path.exists(metadata_path):
+        if resume:
+            return self.__download_reddit_data(data_path, metadata_path, resume)
+        elif os.path.exists(data_path) or os.path.exists(metadata_path):
             raise Exception('Directory to store either data or metadata ' +
                             '(or both) already exists. Remove or rename these' +
                             ' directories before downloading new data. ' +
@@ -65,6 +121,108 @@ class RedditDataDL:
             return self.__download_reddit_data(data_path, metadata_path)
 
 
+    def get_data_concurrent(self, n_slices=4, requests_per_second=1.0,
+                            resume=False):
+        """Like get_data, but splits the time between after and before into
+        n_slices slices that are downloaded at the same time over one pooled
+        HTTP session. All requests share one rate limit of
+        requests_per_second. Comments that end up in two slices where the
+        slices meet are only saved once. Files are named data_<slice>_<n>, so
+        loading them keeps the comments in time order. Every slice keeps its
+        own checkpoint, see get_data for resume. A download has to be resumed
+        with the same n_slices.
+
+        Example: data_dir, metadata_dir = d.get_data_concurrent(n_slices=8)
+        """
+
+        data_path = self.__make_path('data')
+        metadata_path = self.__make_path('metadata')
+
+        if not resume and (os.path.exists(data_path)
+                           or os.path.exists(metadata_path)):
+            raise Exception('Directory to store either data or metadata ' +
+                            '(or both) already exists. Remove or rename these' +
+                            ' directories before downloading new data. ' +
+                            'Directory paths:\n' + data_path + '\n' +
+                            metadata_path)
+
+        if self.after is None or self.before is None:
+            raise Exception('Both after and before are needed to split the ' +
+                            'download into time slices.')
+
+        logger.info('Started download from %s in %d slices.', self.subreddit,
+                    n_slices)
+        data_directory = self.__make_directory(data_path)
+        metadata_directory = self.__make_directory(metadata_path)
+        manifest = DownloadManifest(self.__manifest_path(), n_slices)
+
+        after, before = int(self.after), int(self.before)
+        step = max(1, -(-(before - after) // n_slices))
+        starts = list(range(after, before, step))
+        boundaries = starts[1:]
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(starts),
+                                                pool_maxsize=len(starts))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        rate_limiter = RateLimiter(requests_per_second)
+        seen = BoundaryIds(boundaries)
+
+        slices = list()
+        for i, start in enumerate(starts):
+            part = copy.copy(self)
+            part.after = start
+            # before is exclusive, so slices end one second past the next start
+            # so the comments made exactly on a boundary are not lost.
+            part.before = min(start + step + 1, before)
+            part.request_counter = 0
+            part.comment_counter = 0
+            part.session = session
+            part.rate_limiter = rate_limiter
+            slices.append((part, str(i) + '_'))
+
+        with ThreadPoolExecutor(len(slices)) as pool:
+            futures = [pool.submit(part.__download_pages, data_directory,
+                                   metadata_directory, prefix, seen, manifest)
+                       for part, prefix in slices]
+            for future in futures:
+                future.result()
+
+        session.close()
+        self.request_counter += sum(part.request_counter for part, _ in slices)
+        self.comment_counter += sum(part.comment_counter for part, _ in slices)
+        self.is_data_saved = True
+
+        logger.info('Download from %s finished.', self.subreddit)
+        return data_directory, metadata_directory
+
+
+
+    def iter_pages(self):
+        """Downloads the pages between after and before one at a time and
+        yields the list of comments of each page without saving it. Used to
+        stream pages straight into processing, see StreamingPipeline.
+
+        Example:
+            for comments in d.iter_pages():
+                print(len(comments))
+        """
+
+        after_holder = self.after # Holder to keep track of the original after-input.
+        try:
+            reddit_data = self.__retrieve_reddit_data()
+            while len(reddit_data['data']) > 0:
+                self.request_counter += 1
+                self.comment_counter += len(reddit_data['data'])
+                self.after = reddit_data['data'][-1]['created_utc']
+                yield reddit_data['data']
+                reddit_data = self.__retrieve_reddit_data()
+        finally:
+            self.after = after_holder
+
+
+
     def get_paths(self):
         """Returns the paths to the directories that the data and metadata are
         going to be saved into."""
@@ -80,7 +238,7 @@ class RedditDataDL:
         initialization."""
 
         if self.endpoint == 'comment':
-            url = 'https://api.pushshift.io/reddit/search/' + self.endpoint + '/?'
+            url = self.base_url + 'search/' + self.endpoint + '/?'
             if self.q is not None: url += 'q=' + self.q +'&'
             if self.size is not None: url += 'size=' + str(self.size) + '&'
             if self.fields is not None: url += 'fields=' + self.fields + '&'
@@ -93,12 +251,12 @@ class RedditDataDL:
             if self.before is not None: url += 'before=' + str(self.before) + '&'
             if self.frequency is not None: url += 'frequency=' + self.frequency + '&'
             if self.metadata is not None: url += 'metadata=' + self.metadata + '&'
-            if self.ids is not None: url = ('https://api.pushshift.io/reddit/' +
+            if self.ids is not None: url = (self.base_url +
                                             'comment/search?ids=' + self.ids)
             return url
 
         elif self.endpoint == 'submission':
-            url = 'https://api.pushshift.io/reddit/search/' + self.endpoint + '/?'
+            url = self.base_url + 'search/' + self.endpoint + '/?'
             if self.q is not None: url += 'q=' + self.q +'&'
             if self.size is not None: url += 'size=' + str(self.size) + '&'
             if self.sort is not None: url += 'sort=' + self.sort + '&'
@@ -110,7 +268,7 @@ class RedditDataDL:
             if self.before is not None: url += 'before=' + str(self.before) + '&'
             if self.frequency is not None: url += 'frequency=' + self.frequency + '&'
             if self.metadata is not None: url += 'metadata=' + self.metadata + '&'
-            if self.ids is not None: url = ('https://api.pushshift.io/reddit/' +
+            if self.ids is not None: url = (self.base_url +
                                             'submission/search?ids=' + self.ids)
             return url
 
@@ -120,7 +278,7 @@ class RedditDataDL:
             raise Exception('This endpoint is not supoprted in this version' +
                             ' the program.')
 
-            url = 'https://api.pushshift.io/reddit/' + self.endpoint
+            url = self.base_url + self.endpoint
             return url
 
         else:
@@ -129,51 +287,209 @@ class RedditDataDL:
 
 
     def __retrieve_reddit_data(self):
-        """ Using the requests library to get the requested reddit data. 
-        Then loads the reddit data with json library and decodes it to a string."""
+        """ Using the requests library to get the requested reddit data.
+        Then parses the raw bytes of the response with JsonLines.loads, with
+        orjson if it is installed, without decoding them to a string first."""
+
+        url = self.__url()
+        http = self.session if self.session is not None else requests
+
+        with self.metrics.stage('download') as stage:
+            for attempt in range(self.max_retries + 1):
+                if self.rate_limiter is not None:
+                    self.rate_limiter.wait()
 
-        request_data = requests.get(self.__url())
-        request_data.raise_for_status()
-        retrieved_reddit_data = json.loads(request_data.text)
-        return retrieved_reddit_data
+                started = time.perf_counter()
+                try:
+                    request_data = http.get(url)
+                except (requests.ConnectionError, requests.Timeout):
+                    self.metrics.add_latency(time.perf_counter() - started)
+                    if attempt == self.max_retries: raise
+                    time.sleep(self.backoff * 2 ** attempt)
+                    continue
+                self.metrics.add_latency(time.perf_counter() - started)
 
+                if (request_data.status_code in self.retry_status_codes
+                        and attempt < self.max_retries):
+                    time.sleep(self.__retry_delay(request_data, attempt))
+                    continue
 
+                request_data.raise_for_status()
+                retrieved_reddit_data = jl.loads(request_data.content)
+                stage.bytes_read = len(request_data.content)
+                stage.rows_out = len(retrieved_reddit_data.get('data', []))
+                return retrieved_reddit_data
 
 
-    def __download_reddit_data(self, data_path, metadata_path):
+
+    def __retry_delay(self, request_data, attempt):
+        """Seconds to wait before retrying. Uses the Retry-After header of the
+        response if it has one."""
+
+        retry_after = request_data.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return int(retry_after)
+        return self.backoff * 2 ** attempt
+
+
+
+
+    def __download_reddit_data(self, data_path, metadata_path, resume=False):
         """Uses the retrieve_reddit_data method and saves data to a json file. Then changes the start time (after) 
         and reruns until all the data is collected. The json file has a first attribute "reddit_data" and its associated
         value is a list containing all the retrieved reddit data."""
 
-        print('Started download from: ', self.subreddit, '. \n')
-        reddit_data = self.__retrieve_reddit_data() # Use the class method to request reddit data and load it with json
-        after_holder = self.after # Holder to keep track of the original after-input.
-
-        data_file_name = ('data_' + str(self.request_counter) + '.json')
-        metadata_file_name = ('metadata_' + str(self.request_counter) + '.json')
+        logger.info('Started download from %s.', self.subreddit)
         data_directory = self.__make_directory(data_path)
         metadata_directory = self.__make_directory(metadata_path)
+        manifest = DownloadManifest(self.__manifest_path())
+
+        self.__download_pages(data_directory, metadata_directory,
+                              manifest=manifest)
+        self.is_data_saved = True
+
+        logger.info('Download from %s finished.', self.subreddit)
+        return data_directory, metadata_directory
+
 
-        while len(reddit_data['data']) > 0:
-            with    open(data_directory + '\\' + data_file_name, 'w') as data_file, \
-                    open(metadata_directory + '\\' + metadata_file_name, 'w') as metadata_file:
 
-                    json.dump(reddit_data['data'], data_file, indent=4)
-                    json.dump(reddit_data['metadata'], metadata_file, indent=4)
-                    self.request_counter += 1
+    def __download_pages(self, data_directory, metadata_directory, prefix='',
+                         seen=None, manifest=None):
+        """Downloads all pages between after and before and saves them with the
+        given prefix in their file names. Comments whose id is already in seen
+        (a BoundaryIds) are left out. Saved pages are recorded in the manifest,
+        and pages the manifest has already recorded are not downloaded
+        again."""
 
-                    data_file_name = ('data_' + str(self.request_counter) + '.json')
-                    metadata_file_name = ('metadata_' + str(self.request_counter) + '.json')
+        after_holder = self.after # Holder to keep track of the original after-input.
+        if manifest is not None and self.__resume(manifest, prefix, seen):
+            self.after = after_holder
+            return
+
+        reddit_data = self.__retrieve_reddit_data() # Use the class method to request reddit data and load it with json
 
-                    self.after = reddit_data['data'][-1]['created_utc']
-                    reddit_data = self.__retrieve_reddit_data()
-                    print(str(self.request_counter) + ' request(s) to reddit server done. \n')
+        pages = list() # Pages waiting to be written to Parquet.
 
+        while len(reddit_data['data']) > 0:
+            self.after = reddit_data['data'][-1]['created_utc']
+            if seen is not None:
+                reddit_data['data'] = seen.filter(reddit_data['data'])
+            self.comment_counter += len(reddit_data['data'])
+
+            if self.storage_format == 'parquet':
+                pages.append(reddit_data)
+                self.request_counter += 1
+
+                if len(pages) == self.pages_per_file:
+                    self.__write_parquet_pages(pages, data_directory,
+                                               metadata_directory, prefix,
+                                               seen, manifest)
+                    pages = list()
+            else:
+                extension = ('.json' if self.storage_format == 'json'
+                             else jl.extension)
+                data_file_name = ('data_' + prefix + str(self.request_counter) + extension)
+                metadata_file_name = ('metadata_' + prefix + str(self.request_counter) + extension)
+                paths = [os.path.join(data_directory, data_file_name),
+                         os.path.join(metadata_directory, metadata_file_name)]
+
+                rows = len(reddit_data['data'])
+                with self.metrics.stage('write', rows) as stage:
+                    if self.storage_format == 'json':
+                        self.__write_json_file(paths[0], reddit_data['data'])
+                        self.__write_json_file(paths[1],
+                                               reddit_data['metadata'])
+                    else:
+                        jl.write_records(paths[0], reddit_data['data'])
+                        jl.write_records(paths[1], [reddit_data['metadata']])
+                    stage.rows_out = rows
+                    stage.bytes_written = sm.file_size(*paths)
+                self.request_counter += 1
+                self.__checkpoint(manifest, prefix, paths,
+                                  reddit_data['data'], seen)
+
+            reddit_data = self.__retrieve_reddit_data()
+            logger.info('%s%d request(s) to reddit server done.', prefix,
+                        self.request_counter)
+
+        if pages:
+            self.__write_parquet_pages(pages, data_directory, metadata_directory,
+                                       prefix, seen, manifest)
+
+        if manifest is not None:
+            manifest.finish(prefix)
         self.after = after_holder
-        self.is_data_saved = True
 
-        print('Download from: ', self.subreddit, ' finished. \n')
-        return data_directory, metadata_directory
+
+
+    def __write_parquet_pages(self, pages, data_directory, metadata_directory,
+                              prefix='', seen=None, manifest=None):
+        """Writes the buffered pages to one set of Parquet files named after the
+        request counter of the first page."""
+
+        first_counter = prefix + str(self.request_counter - len(pages))
+        comments = [row for page in pages for row in page['data']]
+        data = pd.json_normalize(comments)
+        metadata = pd.json_normalize([page['metadata'] for page in pages])
+
+        with self.metrics.stage('write', len(data)) as stage:
+            paths = ps.ParquetStore(data_directory, self.partition_by).write(
+                data, 'data_' + first_counter)
+            paths += ps.ParquetStore(metadata_directory, None).write(
+                metadata, 'metadata_' + first_counter)
+            stage.rows_out = len(data)
+            stage.bytes_written = sm.file_size(*paths)
+        self.__checkpoint(manifest, prefix, paths, comments, seen)
+
+
+
+    def __write_json_file(self, path, content):
+        """Writes content as .json to a temporary file and then moves it in
+        place, so a crash never leaves a half written page."""
+
+        with af.atomic_open(path, 'w') as json_file:
+            json.dump(content, json_file, indent=4)
+
+
+
+    def __checkpoint(self, manifest, prefix, paths, comments, seen):
+        """Records the saved files and the cursor to continue from."""
+
+        if manifest is None:
+            return
+
+        boundary_ids = seen.boundary_ids(comments) if seen is not None else []
+        manifest.add_page(prefix, paths, self.request_counter, self.after,
+                          boundary_ids)
+
+
+
+    def __resume(self, manifest, prefix, seen):
+        """Continues from the last intact page in the manifest. Returns True if
+        the manifest says this download was already finished."""
+
+        pages, finished = manifest.intact_pages(prefix)
+        if not pages:
+            return False
+
+        self.request_counter = pages[-1]['request_counter']
+        self.after = pages[-1]['after']
+        if seen is not None:
+            for page in pages:
+                seen.ids.update(page['boundary_ids'])
+
+        logger.info('Resuming %s%s after %d saved request(s).', self.subreddit,
+                    prefix, self.request_counter)
+        return finished
+
+
+
+    def __manifest_path(self):
+        """Path to the manifest next to the data and metadata directories."""
+
+        data_path = self.__make_path('data')
+        return os.path.join(os.path.dirname(os.path.dirname(data_path)),
+                            'manifest.jsonl')
 
 
 
@@ -181,10 +497,11 @@ class RedditDataDL:
         """Creates the path to the new sub directory that are to be created."""
 
         current_working_directory = os.getcwd()
-        new_directory = ('\\data\\' + self.subreddit + '_' + self.endpoint + '_' +
-                         self.after + '_' + self.before + '\\' + sub_dir_name + '\\')
+        new_directory = (self.subreddit + '_' + self.endpoint + '_' +
+                         str(self.after) + '_' + str(self.before))
 
-        path = current_working_directory + new_directory
+        path = os.path.join(current_working_directory, 'data', new_directory,
+                            sub_dir_name, '')
         return path
 
 
@@ -192,7 +509,7 @@ class RedditDataDL:
     def __make_directory(self, path):
         """Creates a directory from th  given path."""
 
-        os.makedirs(path)
+        os.makedirs(path, exist_ok=True)
         return path
 
 
@@ -203,4 +520,212 @@ class RedditDataDL:
         working."""
 
         #return cls(q, ids, size, fields, sort, sort_type, aggs, author, subreddit, after, before, frequency, metadata)
-        pass
\ No newline at end of file
+        pass
+
+
+
+class RateLimiter:
+    """Thread safe rate limiter that spaces out calls to wait() so that at most
+    requests_per_second calls return per second, shared by all threads.
+
+    Example:
+        limiter = rddl.RateLimiter(2.0)
+        limiter.wait() # Blocks until the next request may be sent.
+    """
+
+
+
+    def __init__(self, requests_per_second):
+
+        self.interval = 1.0 / requests_per_second
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+
+
+    def wait(self):
+        """Blocks until the caller may send its request."""
+
+        with self.lock:
+            now = time.monotonic()
+            send_time = max(now, self.next_time)
+            self.next_time = send_time + self.interval
+
+        if send_time > now:
+            time.sleep(send_time - now)
+
+
+
+class BoundaryIds:
+    """Thread safe record of the ids of the comments made within margin seconds
+    of a slice boundary. Used to drop the comments that two neighbouring time
+    slices both return."""
+
+
+
+    def __init__(self, boundaries, margin=1):
+
+        self.boundaries = sorted(int(b) for b in boundaries)
+        self.margin = margin
+        self.ids = set()
+        self.lock = threading.Lock()
+
+
+
+    def filter(self, comments):
+        """Returns the comments that have not been seen before."""
+
+        kept = list()
+        with self.lock:
+            for comment in comments:
+                if not self.__near_boundary(int(comment['created_utc'])):
+                    kept.append(comment)
+                elif comment['id'] not in self.ids:
+                    self.ids.add(comment['id'])
+                    kept.append(comment)
+        return kept
+
+
+
+    def boundary_ids(self, comments):
+        """Returns the ids of the given comments that are near a boundary."""
+
+        return [comment['id'] for comment in comments
+                if self.__near_boundary(int(comment['created_utc']))]
+
+
+
+    def __near_boundary(self, created_utc):
+        i = bisect.bisect_left(self.boundaries, created_utc - self.margin)
+        return (i < len(self.boundaries)
+                and self.boundaries[i] <= created_utc + self.margin)
+
+
+
+class DownloadManifest:
+    """Thread safe, append only record of the pages that a download has saved.
+    Every line of the manifest file is one JSON object: a page with its files,
+    their sha256 hashes, the request counter and the after cursor to continue
+    from, or a marker that a slice has finished. Lines are flushed to disk
+    right after the files of a page are in place, and a half written last
+    line is ignored, so the manifest can always be trusted after a crash."""
+
+
+
+    def __init__(self, path, n_slices=None):
+
+        self.path = path
+        self.root = os.path.dirname(path)
+        self.lock = threading.Lock()
+        self.entries = self.__read()
+
+        headers = [e for e in self.entries if 'n_slices' in e]
+        if headers and headers[0]['n_slices'] != n_slices:
+            raise Exception('The download in ' + self.root + ' was started ' +
+                            'with n_slices=' + str(headers[0]['n_slices']) +
+                            ', resume it with the same number of slices.')
+        if not headers:
+            self.__append({'n_slices': n_slices})
+
+
+
+    def add_page(self, prefix, paths, request_counter, after, boundary_ids):
+        """Records the saved files of a page and the cursor after it."""
+
+        self.__append({'slice': prefix,
+                       'files': [os.path.relpath(p, self.root) for p in paths],
+                       'sha256': [_file_hash(p) for p in paths],
+                       'request_counter': request_counter,
+                       'after': after,
+                       'boundary_ids': boundary_ids})
+
+
+
+    def finish(self, prefix):
+        """Records that the slice has been downloaded to the end."""
+
+        self.__append({'slice': prefix, 'finished': True})
+
+
+
+    def intact_pages(self, prefix):
+        """Returns the recorded pages of the slice up to the first one whose
+        files are missing or changed, and whether the slice was finished with
+        all its pages intact. The records after that page are removed from
+        the manifest, since those pages will be downloaded again."""
+
+        with self.lock:
+            pages = list()
+            finished = False
+            stale = False
+            for entry in self.entries:
+                if entry.get('slice') != prefix:
+                    continue
+                if stale:
+                    continue
+                if entry.get('finished'):
+                    finished = True
+                    continue
+
+                paths = [os.path.join(self.root, f) for f in entry['files']]
+                if all(os.path.exists(p) and _file_hash(p) == h
+                       for p, h in zip(paths, entry['sha256'])):
+                    pages.append(entry)
+                else:
+                    stale = True
+
+            if stale:
+                kept = [id(page) for page in pages]
+                self.entries = [e for e in self.entries
+                                if e.get('slice') != prefix or id(e) in kept]
+                self.__rewrite()
+                finished = False
+
+        return pages, finished
+
+
+
+    def __read(self):
+        if not os.path.exists(self.path):
+            return list()
+
+        with open(self.path, 'r') as manifest_file:
+            lines = manifest_file.readlines()
+
+        entries = list()
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError: # Line cut short by a crash.
+                self.entries = entries
+                self.__rewrite()
+                break
+        return entries
+
+
+
+    def __rewrite(self):
+        """Replaces the manifest file with the entries in memory."""
+
+        with af.atomic_open(self.path, 'w') as manifest_file:
+            for entry in self.entries:
+                manifest_file.write(json.dumps(entry) + '\n')
+
+
+
+    def __append(self, entry):
+        with self.lock:
+            with open(self.path, 'a') as manifest_file:
+                manifest_file.write(json.dumps(entry) + '\n')
+                manifest_file.flush()
+                os.fsync(manifest_file.fileno())
+            self.entries.append(entry)
+
+
+
+def _file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
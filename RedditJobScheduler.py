@@ -0,0 +1,201 @@
+import logging
+import threading
+import pandas as pd
+import requests
+import RedditDataDL as rddl
+import StageMetrics as sm
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+
+logger = logging.getLogger(__name__)
+
+
+
+class RedditJobScheduler:
+    """Class that runs many RedditDataDL downloads at the same time, for
+    example one per subreddit. Jobs are given as RedditDataDL instances or as
+    (subreddit, endpoint, after, before) tuples, which are made into
+    RedditDataDL instances with the keyword arguments in downloader_options.
+    Every job saves its data in the same directories as its get_data would,
+    see get_paths, with its own manifest, so a scheduler run can be resumed.
+
+    Up to max_workers jobs download at once over one pooled HTTP session and
+    share one rate limit of requests_per_second. Every job waits for its
+    response before it asks for the next page and the rate limiter hands out
+    send times in the order they are asked for, so every running job gets the
+    same share of the requests, however many pages it has left. progress()
+    can be called from another thread while run() is busy.
+
+    Example:
+        import RedditJobScheduler as rjs
+        jobs = [('climbharder', 'comment', '1577836800', '1577923200'),
+                ('bouldering', 'comment', '1577836800', '1577923200')]
+        scheduler = rjs.RedditJobScheduler(jobs, requests_per_second=2.0)
+        scheduler.run(progress_interval=60)
+        print(scheduler.progress())
+    """
+
+
+
+    def __init__(self, jobs, requests_per_second=1.0, max_workers=None,
+                 metrics=None, **downloader_options):
+
+        self.metrics = metrics if metrics is not None else sm.StageMetrics()
+        self.jobs = list()
+        for job in jobs:
+            if not isinstance(job, rddl.RedditDataDL):
+                subreddit, endpoint, after, before = job
+                job = rddl.RedditDataDL(endpoint, subreddit=subreddit,
+                                        after=after, before=before,
+                                        metrics=self.metrics,
+                                        **downloader_options)
+            self.jobs.append(job)
+
+        self.requests_per_second = requests_per_second
+        self.max_workers = max_workers or max(len(self.jobs), 1)
+        self.starts = [job.after for job in self.jobs]
+        self.status = ['pending'] * len(self.jobs)
+        self.errors = [None] * len(self.jobs)
+        self.paths = [None] * len(self.jobs)
+        self.lock = threading.Lock()
+
+
+
+    def run(self, resume=False, progress_interval=None, stop_on_error=False):
+        """Downloads all jobs and returns the progress DataFrame. A job that
+        fails is logged and recorded in progress() while the other jobs go on,
+        unless stop_on_error is True, then the first error is raised once the
+        running jobs are done. See RedditDataDL.get_data for resume.
+        progress_interval takes the number of seconds between progress
+        reports in the log.
+
+        Example: progress_df = scheduler.run(resume=True)
+        """
+
+        logger.info('Started %d download job(s).', len(self.jobs))
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        rate_limiter = rddl.RateLimiter(self.requests_per_second)
+
+        for job in self.jobs:
+            job.session = session
+            job.rate_limiter = rate_limiter
+
+        try:
+            with ThreadPoolExecutor(self.max_workers) as pool:
+                futures = [pool.submit(self.__run_job, i, resume, stop_on_error)
+                           for i in range(len(self.jobs))]
+                pending = futures
+                while pending:
+                    done, pending = wait(pending, timeout=progress_interval,
+                                         return_when=FIRST_EXCEPTION)
+                    if progress_interval is not None and pending:
+                        self.__log_progress()
+                    if any(f.exception() is not None for f in done):
+                        for future in pending:
+                            future.cancel()
+                for future in futures:
+                    if not future.cancelled():
+                        future.result()
+        finally:
+            for job in self.jobs:
+                job.session = None
+                job.rate_limiter = None
+            session.close()
+
+        logger.info('Download jobs finished: %s', self.__counts())
+        return self.progress()
+
+
+
+    def progress(self):
+        """Returns a DataFrame with one row per job: its subreddit, endpoint,
+        after and before, status ('pending', 'running', 'done' or 'failed'),
+        the pages and comments saved, the created_utc it has come to and the
+        fraction of its time span that is done, the paths it saves to and
+        its error.
+
+        Example: print(scheduler.progress())
+        """
+
+        rows = list()
+        with self.lock:
+            for i, job in enumerate(self.jobs):
+                status = self.status[i]
+                cursor = job.after if status == 'running' else None
+                rows.append({'subreddit': job.subreddit,
+                             'endpoint': job.endpoint,
+                             'after': self.starts[i],
+                             'before': job.before,
+                             'status': status,
+                             'pages': job.request_counter,
+                             'comments': job.comment_counter,
+                             'cursor': cursor,
+                             'fraction_done': self.__fraction(i, status,
+                                                              cursor),
+                             'data_path': self.paths[i],
+                             'error': (repr(self.errors[i])
+                                       if self.errors[i] else None)})
+        return pd.DataFrame(rows)
+
+
+
+    def __run_job(self, i, resume, stop_on_error):
+        job = self.jobs[i]
+        with self.lock:
+            self.status[i] = 'running'
+            self.paths[i] = job.get_paths()[0]
+
+        try:
+            job.get_data(resume=resume)
+        except Exception as e:
+            logger.error('Download job %s %s failed: %r', job.subreddit,
+                         job.endpoint, e)
+            with self.lock:
+                self.status[i] = 'failed'
+                self.errors[i] = e
+            if stop_on_error:
+                raise
+            return
+
+        with self.lock:
+            self.status[i] = 'done'
+
+
+
+    def __fraction(self, i, status, cursor):
+        if status == 'done':
+            return 1.0
+        if status == 'pending':
+            return 0.0
+        try:
+            start = int(self.starts[i])
+            end = int(self.jobs[i].before)
+            cursor = int(cursor)
+        except (TypeError, ValueError):
+            return float('nan')
+        if end <= start:
+            return float('nan')
+        return min(max((cursor - start) / (end - start), 0.0), 1.0)
+
+
+
+    def __counts(self):
+        with self.lock:
+            return {status: self.status.count(status) for status
+                    in ('pending', 'running', 'done', 'failed')}
+
+
+
+    def __log_progress(self):
+        progress_df = self.progress()
+        running = progress_df[progress_df['status'] == 'running']
+        logger.info('Download jobs: %s, %d comments saved.', self.__counts(),
+                    int(progress_df['comments'].sum()))
+        for _, row in running.iterrows():
+            logger.info('  %s %s: %d pages, %.0f%% done.', row['subreddit'],
+                        row['endpoint'], row['pages'],
+                        100 * row['fraction_done'])
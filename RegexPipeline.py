@@ -0,0 +1,139 @@
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError: # Python < 3.11
+    import sre_parse
+
+
+class RegexPipeline:
+    """Class that compiles an ordered dictionary of regex patterns once and
+    applies them in order to a whole column of strings. The result is the same
+    as running re.sub for every pattern, in order, on every string.
+
+    Consecutive patterns that always match exactly one character and share the
+    same replacement are fused into one pattern, since replacing them in one
+    pass gives the same result as replacing them one after the other. This is
+    only done when the replacement can not be matched by the fused patterns.
+
+    Example:
+        import RegexPipeline as rp
+        pipeline = rp.RegexPipeline({r'&gt;': '', r'@USER': '@USER '})
+        new_strings = pipeline.apply(strings)
+    """
+
+
+
+    def __init__(self, regex, fuse=True, chunksize=100000):
+
+        self.regex = dict(regex)
+        self.fuse = fuse
+        self.chunksize = chunksize
+        self.compiled = self.__compile(self.regex)
+
+
+
+    def apply(self, strings):
+        """Applies the compiled patterns to all strings in the given iterable
+        (list, pandas Series, ...) and returns a list with the new strings.
+        Values that are not strings, such as NaN, are returned unchanged. The
+        strings are processed in chunks of chunksize.
+
+        Example: new_strings = pipeline.apply(a.data['body'])
+        """
+
+        strings = list(strings)
+        new_strings = list()
+        for start in range(0, len(strings), self.chunksize):
+            new_strings.extend(
+                self.__apply_chunk(strings[start:start + self.chunksize]))
+        return new_strings
+
+
+
+    def sub(self, string):
+        """Applies the compiled patterns to a single string.
+
+        Example: new_string = pipeline.sub('A string with http://a.url')
+        """
+
+        for pattern, replacement in self.compiled:
+            string = pattern.sub(replacement, string)
+        return string
+
+
+
+    def __apply_chunk(self, strings):
+        """Runs every pattern over the whole chunk before moving on to the next
+        pattern. Non strings are left as they are."""
+
+        is_string = [isinstance(s, str) for s in strings]
+        chunk = [s for s, keep in zip(strings, is_string) if keep]
+
+        for pattern, replacement in self.compiled:
+            sub = pattern.sub
+            chunk = [sub(replacement, s) for s in chunk]
+
+        new_strings = iter(chunk)
+        return [next(new_strings) if keep else s
+                for s, keep in zip(strings, is_string)]
+
+
+
+    def __compile(self, regex):
+        """Compiles the patterns, fusing the ones that are safe to fuse."""
+
+        groups = list() # List of [patterns, replacement]
+        for pattern, replacement in regex.items():
+            if (self.fuse and groups
+                    and self.__can_fuse(groups[-1], pattern, replacement)):
+                groups[-1][0].append(pattern)
+            else:
+                groups.append([[pattern], replacement])
+
+        compiled = list()
+        for patterns, replacement in groups:
+            if len(patterns) == 1:
+                compiled.append((re.compile(patterns[0]), replacement))
+            else:
+                fused = '|'.join('(?:' + p + ')' for p in patterns)
+                compiled.append((re.compile(fused), replacement))
+        return compiled
+
+
+
+    def __can_fuse(self, group, pattern, replacement):
+        """A pattern can be fused with the previous group if all of them match
+        exactly one character without looking at its neighbours, they have the
+        same plain replacement and none of them matches the replacement."""
+
+        patterns, group_replacement = group
+        if replacement != group_replacement or '\\' in replacement:
+            return False
+
+        patterns = patterns + [pattern]
+        for p in patterns:
+            if not self.__is_single_character(p):
+                return False
+            if re.search(p, replacement):
+                return False
+        return True
+
+
+
+    def __is_single_character(self, pattern):
+        """Checks if the pattern is a single literal, character set or dot."""
+
+        if pattern.startswith('(?'): # Inline flags apply to the whole pattern.
+            return False
+
+        try:
+            parsed = sre_parse.parse(pattern)
+        except re.error:
+            return False
+
+        if len(parsed) != 1:
+            return False
+
+        op, _ = parsed[0]
+        return str(op) in ('LITERAL', 'NOT_LITERAL', 'IN', 'ANY')
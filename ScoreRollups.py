@@ -0,0 +1,278 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import AtomicFile as af
+import DedupeIndex as di
+import SonarScorer as ss
+
+
+_SECONDS_PER_DAY = 86400
+_FREQUENCIES = {'day': 'D', 'week': 'W', 'month': 'M'}
+
+
+
+class ScoreRollups:
+    """Class that keeps running totals of HateSonar scores, so scores can be
+    aggregated over time without going through the scored comments again.
+    For every day (UTC, from created_utc) it keeps the number of comments, the
+    number per top_class, the sum of the confidences of every class and a
+    histogram of them with histogram_bins bins between 0 and 1. Totals per
+    author and thread are kept by EntityIndex.
+
+    Scored comments are added chunk by chunk with add, HateSpeechAnalyzer does
+    that in hate_sonar. query rolls the days up to days, weeks or months with
+    counts, shares, mean confidences and percentiles of the confidences
+    interpolated in the histograms, so the percentiles are exact to
+    1 / histogram_bins. The rollups can be saved to and loaded from a
+    directory.
+
+    Every comment id is counted once: the hashes of the ids added are kept
+    with the rollups, 8 bytes per comment, and comments whose id was added
+    before, for example when the same comments are scored again in a later
+    run, are skipped.
+
+    Example:
+        import ScoreRollups as sr
+        rollups = sr.ScoreRollups('data/rollups/')
+        rollups.add(a.data)
+        monthly_df = rollups.query('2015-01-01', '2015-12-31', freq='month')
+        rollups.save()
+    """
+
+
+
+    def __init__(self, directory_path=None, histogram_bins=100):
+
+        self.directory_path = directory_path
+        self.histogram_bins = histogram_bins
+        self.lock = threading.Lock()
+        self.__clear()
+
+        if directory_path is not None and os.path.exists(self.__path()):
+            self.read(self.__path())
+
+
+
+    def add(self, data):
+        """Adds scored comments to the rollups. data takes a DataFrame with
+        the columns top_class, hate_speech, offensive_language and neither
+        made by hate_sonar, and the id column, if any. Comments without
+        created_utc and comments whose id was added before are left out.
+
+        Example: rollups.add(a.data)
+        """
+
+        classes = pd.Categorical(data['top_class'], categories=ss.CLASSES).codes
+        scored = classes >= 0
+        confidences = data[list(ss.CLASSES)].to_numpy(dtype=np.float64)
+
+        if 'created_utc' not in data.columns:
+            return
+
+        created = pd.to_numeric(data['created_utc'], errors='coerce')
+        created = created.to_numpy(dtype=np.float64, na_value=np.nan)
+        scored &= np.isfinite(created)
+
+        with self.lock:
+            if 'id' in data.columns:
+                scored[scored] = self.seen_ids.filter_values(
+                    data['id'][scored])
+            self.__merge_days(*self.__day_rollup(created, classes, confidences,
+                                                 scored))
+
+
+
+    def query(self, start=None, end=None, freq='day', percentiles=(50, 90)):
+        """Returns a DataFrame with one row per day, week or month from start
+        up to and including end that has scored comments. Every row has the
+        number of comments and for every class the number and share of
+        comments with that top_class, the mean confidence and the given
+        percentiles of the confidence. The index holds the first day of every
+        period.
+
+        start and end take dates, anything pandas.Timestamp takes, or UTC
+        timestamps in seconds. None means no limit.
+
+        freq takes 'day', 'week' or 'month'.
+
+        Example: weekly_df = rollups.query('2015-01-01', freq='week')
+        """
+
+        if freq not in _FREQUENCIES:
+            raise Exception('freq has to be one of ' + ', '.join(_FREQUENCIES)
+                            + '.')
+
+        with self.lock:
+            days = self.days
+            selected = np.ones(len(days), dtype=bool)
+            if start is not None:
+                selected &= days >= self.__day(start)
+            if end is not None:
+                selected &= days <= self.__day(end)
+            days = days[selected]
+            counts = self.counts[selected]
+            sums = self.sums[selected]
+            histograms = self.histograms[selected]
+
+        periods = pd.to_datetime(days * _SECONDS_PER_DAY, unit='s').to_period(
+            _FREQUENCIES[freq])
+        # The days are sorted, so every period is one run of days.
+        starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]]) \
+            if len(days) > 0 else np.zeros(0, dtype=np.int64)
+        index = pd.DatetimeIndex(periods[starts].start_time, name='period')
+
+        if len(starts) > 0:
+            counts = np.add.reduceat(counts, starts, axis=0)
+            sums = np.add.reduceat(sums, starts, axis=0)
+            histograms = np.add.reduceat(histograms, starts, axis=0)
+
+        total = counts.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shares = counts / total[:, None]
+            means = sums / total[:, None]
+
+        columns = {'count': total}
+        for k, name in enumerate(ss.CLASSES):
+            columns[name + '_count'] = counts[:, k]
+            columns[name + '_share'] = shares[:, k]
+            columns[name + '_mean'] = means[:, k]
+            for q in percentiles:
+                columns[name + '_p' + str(q)] = self.__percentile(
+                    histograms[:, k], q)
+        return pd.DataFrame(columns, index=index)
+
+
+
+    def save(self, directory_path=None):
+        """Saves the rollups to rollups.npz in their directory, or in the
+        given one.
+
+        Example: rollups.save()
+        """
+
+        if directory_path is not None:
+            self.directory_path = directory_path
+        af.save(self.__path(), self.write)
+
+
+
+    def write(self, file):
+        """Writes the rollups to an open file or a path."""
+
+        with self.lock:
+            settings = {'histogram_bins': self.histogram_bins}
+            np.savez(file, settings=np.array(json.dumps(settings)),
+                     days=self.days, counts=self.counts, sums=self.sums,
+                     histograms=self.histograms,
+                     seen_ids=self.seen_ids.to_array())
+
+
+
+    def read(self, file):
+        """Replaces the rollups with ones written by write."""
+
+        with np.load(file) as arrays, self.lock:
+            settings = json.loads(str(arrays['settings']))
+            self.histogram_bins = settings['histogram_bins']
+            self.days = arrays['days']
+            self.counts = arrays['counts']
+            self.sums = arrays['sums']
+            self.histograms = arrays['histograms']
+            self.seen_ids = di.SortedHashSet(arrays['seen_ids'])
+
+
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+
+
+    def __clear(self):
+        n_classes = len(ss.CLASSES)
+        self.days = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros((0, n_classes), dtype=np.int64)
+        self.sums = np.zeros((0, n_classes), dtype=np.float64)
+        self.histograms = np.zeros((0, n_classes, self.histogram_bins),
+                                   dtype=np.int64)
+        self.seen_ids = di.SortedHashSet()
+
+
+
+    def __day_rollup(self, created, classes, confidences, selected):
+        """Returns the days of the selected comments of a chunk with their
+        counts, sums and histograms."""
+
+        days = np.floor(created[selected] / _SECONDS_PER_DAY).astype(np.int64)
+        classes = classes[selected]
+        confidences = confidences[selected]
+        n_classes = len(ss.CLASSES)
+        bins = self.histogram_bins
+        unique_days, rows = np.unique(days, return_inverse=True)
+        n = len(unique_days)
+
+        counts = np.bincount(rows * n_classes + classes,
+                             minlength=n * n_classes).reshape(n, n_classes)
+        sums = np.empty((n, n_classes), dtype=np.float64)
+        histograms = np.empty((n, n_classes, bins), dtype=np.int64)
+        for k in range(n_classes):
+            sums[:, k] = np.bincount(rows, weights=confidences[:, k],
+                                     minlength=n)
+            bin_of = np.clip((confidences[:, k] * bins).astype(np.int64),
+                             0, bins - 1)
+            histograms[:, k] = np.bincount(
+                rows * bins + bin_of, minlength=n * bins).reshape(n, bins)
+        return unique_days, counts, sums, histograms
+
+
+
+    def __merge_days(self, days, counts, sums, histograms):
+        all_days = np.union1d(self.days, days)
+        old_rows = np.searchsorted(all_days, self.days)
+        new_rows = np.searchsorted(all_days, days)
+
+        merged = list()
+        for old, new in ((self.counts, counts), (self.sums, sums),
+                         (self.histograms, histograms)):
+            values = np.zeros((len(all_days),) + old.shape[1:], dtype=old.dtype)
+            values[old_rows] = old
+            values[new_rows] += new
+            merged.append(values)
+
+        self.days = all_days
+        self.counts, self.sums, self.histograms = merged
+
+
+
+    def __percentile(self, histograms, q):
+        """Returns the q-th percentile of every histogram, interpolated
+        linearly within the bin it falls in. NaN for empty histograms."""
+
+        bins = self.histogram_bins
+        cumulative = np.cumsum(histograms, axis=1)
+        total = cumulative[:, -1]
+        target = q / 100 * total
+
+        bin_of = np.argmax(cumulative >= target[:, None], axis=1)
+        rows = np.arange(len(histograms))
+        below = np.where(bin_of > 0, cumulative[rows, bin_of - 1], 0)
+        in_bin = histograms[rows, bin_of]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(in_bin > 0, (target - below) / in_bin, 0.0)
+        return np.where(total > 0, (bin_of + fraction) / bins, np.nan)
+
+
+
+    def __day(self, time):
+        if isinstance(time, (int, float, np.integer, np.floating)):
+            return int(time // _SECONDS_PER_DAY)
+        timestamp = pd.Timestamp(time)
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+        return (timestamp - pd.Timestamp(0)) // pd.Timedelta(days=1)
+
+
+
+    def __path(self):
+        return os.path.join(self.directory_path, 'rollups.npz')
@@ -0,0 +1,156 @@
+import hashlib
+import importlib.metadata
+import sqlite3
+import threading
+import numpy as np
+
+
+class SonarCache:
+    """Class that keeps HateSonar scores in an SQLite file so texts that have
+    been scored before don't have to be scored again. Texts are keyed by a hash
+    of the normalized (lower cased) text together with the model version, so
+    scores from another version of the model are never used. The cache holds
+    at most max_entries scores, the least recently used ones are evicted first.
+    hits and misses count the lookups since the cache was opened. A cache
+    can be used from several threads, for example by the hate_sonar stage of
+    a StreamingPipeline, the lookups and stores take turns.
+
+    Example:
+        import SonarCache as sc
+        cache = sc.SonarCache('data/sonar_cache.sqlite')
+        a.hate_sonar('body', cache=cache)
+        print(cache.hits, cache.misses)
+    """
+
+    _chunksize = 500 # Keys per query, below the SQLite variable limit.
+
+
+
+    def __init__(self, path, model_version=None, max_entries=10000000):
+
+        self.path = path
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        if self.model_version is None:
+            self.model_version = self.__installed_model_version()
+
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS scores (key BLOB PRIMARY KEY, '
+            'hate_speech REAL, offensive_language REAL, neither REAL, '
+            'last_used INTEGER)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)')
+        self.clock = self.connection.execute(
+            'SELECT COALESCE(MAX(last_used), 0) FROM scores').fetchone()[0]
+        # Rows in the table, counted once here and kept up to date by put.
+        self.n_entries = self.connection.execute(
+            'SELECT COUNT(*) FROM scores').fetchone()[0]
+
+
+
+    def get(self, texts):
+        """Looks up a list of normalized texts. Returns a boolean array that is
+        True for the texts found in the cache and an array of shape
+        (len(texts), 3) with their confidences. Rows of texts that were not
+        found are left as NaN.
+
+        Example: found, confidences = cache.get(texts)
+        """
+
+        keys = [self.key(text) for text in texts]
+        found = np.zeros(len(keys), dtype=bool)
+        confidences = np.full((len(keys), 3), np.nan)
+
+        positions = dict()
+        for i, key in enumerate(keys):
+            positions.setdefault(key, []).append(i)
+
+        unique_keys = list(positions)
+        with self.lock:
+            self.clock += 1
+            for start in range(0, len(unique_keys), self._chunksize):
+                chunk = unique_keys[start:start + self._chunksize]
+                marks = ','.join('?' * len(chunk))
+                rows = self.connection.execute(
+                    'SELECT key, hate_speech, offensive_language, neither FROM '
+                    'scores WHERE key IN (' + marks + ')', chunk).fetchall()
+                for key, *scores in rows:
+                    found[positions[key]] = True
+                    confidences[positions[key]] = scores
+                self.connection.execute(
+                    'UPDATE scores SET last_used = ? WHERE key IN (' + marks
+                    + ')', [self.clock] + chunk)
+            self.connection.commit()
+
+            self.hits += int(found.sum())
+            self.misses += len(keys) - int(found.sum())
+        return found, confidences
+
+
+
+    def put(self, texts, confidences):
+        """Stores the confidences of shape (len(texts), 3) for the given
+        normalized texts, then evicts the least recently used scores if the
+        cache holds more than max_entries. Texts that are in the cache already
+        keep their scores.
+
+        Example: cache.put(texts, confidences)
+        """
+
+        with self.lock:
+            self.clock += 1
+            rows = [(self.key(text), float(h), float(o), float(n), self.clock)
+                    for text, (h, o, n) in zip(texts, confidences)]
+            cursor = self.connection.executemany(
+                'INSERT OR IGNORE INTO scores VALUES (?, ?, ?, ?, ?)', rows)
+            self.n_entries += cursor.rowcount
+            self.__evict()
+            self.connection.commit()
+
+
+
+    def key(self, text):
+        """Returns the cache key of a normalized text."""
+
+        key = (self.model_version + '\0' + text).encode('utf-8')
+        return hashlib.blake2b(key, digest_size=16).digest()
+
+
+
+    def __len__(self):
+        return self.n_entries
+
+
+
+    def close(self):
+        """Closes the connection to the cache file."""
+
+        with self.lock:
+            self.connection.close()
+
+
+
+    def __evict(self):
+        """Removes the least recently used scores above max_entries."""
+
+        excess = self.n_entries - self.max_entries
+        if excess > 0:
+            cursor = self.connection.execute(
+                'DELETE FROM scores WHERE key IN (SELECT key FROM scores '
+                'ORDER BY last_used LIMIT ?)', (excess,))
+            self.n_entries -= cursor.rowcount
+
+
+
+    def __installed_model_version(self):
+        """Uses the version of the installed hatesonar package."""
+
+        try:
+            return 'hatesonar-' + importlib.metadata.version('hatesonar')
+        except importlib.metadata.PackageNotFoundError:
+            return 'hatesonar-unknown'
@@ -0,0 +1,170 @@
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import LazyModule as lm
+
+
+# Imported, together with scikit-learn or onnxruntime, on the first score.
+hatesonar = lm.LazyModule('hatesonar')
+
+CLASSES = ('hate_speech', 'offensive_language', 'neither')
+
+_sonar = None # The Sonar model of this process, see get_sonar.
+_sonar_lock = threading.Lock()
+
+
+
+class SonarScorer:
+    """Class that scores texts with the HateSonar module
+    (https://github.com/Hironsan/HateSonar) in batches. Each batch goes through
+    the vectorizer and classifier of the model in one matrix operation instead
+    of one ping per text. The model is loaded once per process, on the first
+    score, and shared by all SonarScorers and HateSpeechAnalyzers in it. With
+    n_jobs > 1 the batches are spread over a pool of processes that each load
+    the model once.
+
+    Every score call with n_jobs > 1 starts its own pool. Use the scorer in a
+    with block to keep one pool for all calls in it, when many small lists
+    are scored one after the other.
+
+    When n_jobs > 1 on Windows the calling script has to be guarded with
+    if __name__ == '__main__':
+
+    Example:
+        import SonarScorer as ss
+        scorer = ss.SonarScorer(batch_size=1000, n_jobs=4)
+        top_class, confidences = scorer.score(texts)
+    """
+
+
+
+    def __init__(self, batch_size=1000, n_jobs=1, cache=None):
+
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.cache = cache
+        self.pool = None # Process pool kept open in a with block.
+
+
+
+    def __enter__(self):
+        if self.n_jobs > 1:
+            self.pool = ProcessPoolExecutor(self.n_jobs,
+                                            initializer=_init_worker)
+        return self
+
+
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+
+    def score(self, texts):
+        """Scores a list of texts. Returns an array with the top class of each
+        text and an array of shape (len(texts), 3) with the confidence for
+        hate_speech, offensive_language and neither, in that order. With a
+        cache only the texts that are not in it are scored, each distinct text
+        once, and their scores are added to the cache.
+
+        Example: top_class, confidences = scorer.score(['some text'])
+        """
+
+        if self.cache is None:
+            confidences = self.__predict(texts)
+        else:
+            found, confidences = self.cache.get(texts)
+            missing = np.flatnonzero(~found)
+            if len(missing) > 0:
+                new_texts = list(dict.fromkeys(texts[i] for i in missing))
+                new_confidences = self.__predict(new_texts)
+                self.cache.put(new_texts, new_confidences)
+
+                positions = {text: i for i, text in enumerate(new_texts)}
+                confidences[missing] = new_confidences[
+                    [positions[texts[i]] for i in missing]]
+
+        top_class = np.empty(len(texts), dtype=object)
+        if len(texts) > 0:
+            top_class[:] = np.array(CLASSES, dtype=object)[
+                confidences.argmax(axis=1)]
+        return top_class, confidences
+
+
+
+    def __predict(self, texts):
+        """Runs the texts through the model batch by batch, in this process or
+        in the process pool."""
+
+        confidences = np.empty((len(texts), len(CLASSES)), dtype=np.float64)
+        if len(texts) == 0:
+            return confidences
+
+        starts = range(0, len(texts), self.batch_size)
+        batches = (texts[start:start + self.batch_size] for start in starts)
+
+        if self.n_jobs == 1:
+            sonar = get_sonar()
+            results = (_predict_proba(sonar, batch) for batch in batches)
+            for start, proba in zip(starts, results):
+                confidences[start:start + len(proba)] = proba
+        elif self.pool is not None:
+            results = self.pool.map(_score_batch, batches)
+            for start, proba in zip(starts, results):
+                confidences[start:start + len(proba)] = proba
+        else:
+            with ProcessPoolExecutor(self.n_jobs,
+                                     initializer=_init_worker) as pool:
+                results = pool.map(_score_batch, batches)
+                for start, proba in zip(starts, results):
+                    confidences[start:start + len(proba)] = proba
+
+        return confidences
+
+
+
+def get_sonar():
+    """Returns the Sonar model of this process, loading it on the first call.
+    Safe to call from several threads, the model is loaded only once.
+
+    Example: sonar = ss.get_sonar()
+    """
+
+    global _sonar
+    if _sonar is None:
+        with _sonar_lock:
+            if _sonar is None:
+                _sonar = hatesonar.Sonar()
+    return _sonar
+
+
+
+def _predict_proba(sonar, texts):
+    """Runs a batch of texts through the model of the given Sonar. Supports
+    both the scikit-learn and the ONNX versions of HateSonar, falls back on one
+    ping per text otherwise."""
+
+    if hasattr(sonar, 'preprocessor') and hasattr(sonar, 'estimator'):
+        vectors = sonar.preprocessor.transform(texts)
+        return sonar.estimator.predict_proba(vectors)
+
+    if hasattr(sonar, 'sess'):
+        _, proba = sonar.sess.run(None, {'text': np.array(texts, dtype=object)})
+        return np.array([[p[k] for k in range(len(CLASSES))] for p in proba])
+
+    return np.array([[c['confidence'] for c in sonar.ping(text=t)['classes']]
+                     for t in texts])
+
+
+
+def _init_worker():
+    """Loads the Sonar model once in a worker process."""
+
+    get_sonar()
+
+
+
+def _score_batch(texts):
+    return _predict_proba(get_sonar(), texts)
@@ -0,0 +1,325 @@
+import array
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+import AtomicFile as af
+
+try:
+    import resource
+except ImportError: # Not on Windows.
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+_rss_lock = threading.Lock()
+_rss_timers = set() # Running StageTimers whose peak RSS is measured.
+_resettable = None # Whether the peak RSS can be reset, see reset_peak_rss.
+
+
+
+class StageMetrics:
+    """Class that records where the time of a run goes. For every stage, such
+    as download, load, apply_regex, clean_data, hate_sonar, tf_idf and write,
+    it adds up the calls, wall time, CPU time, rows in and out and bytes read
+    and written, and keeps the highest peak RSS of the process during a call
+    of the stage. It also keeps the latency of every HTTP request of the
+    downloader.
+    HateSpeechAnalyzer and RedditDataDL record into the StageMetrics given as
+    their metrics parameter.
+
+    CPU time is the CPU time of the whole process while the stage ran, so
+    stages that run at the same time in threads, like the downloader slices
+    and StreamingPipeline stages, also count each other's CPU time. The same
+    goes for the peak RSS.
+
+    The peak RSS of a stage is measured on Linux by resetting the high-water
+    mark of the process (VmHWM) when a stage starts and reading it when one
+    starts or ends. Elsewhere, or when /proc/self/clear_refs can't be
+    written, it is the peak RSS of the process since it started, so a stage
+    shows the peak of the stages before it as well.
+
+    Example:
+        import StageMetrics as sm
+        metrics = sm.StageMetrics()
+        d = rddl.RedditDataDL(..., metrics=metrics)
+        a = hsa.HateSpeechAnalyzer(metrics=metrics)
+        ...
+        print(metrics.summary())
+        metrics.write_json('data/metrics.json')
+        metrics.write_prometheus('data/metrics.prom')
+    """
+
+    fields = ('calls', 'wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out',
+              'bytes_read', 'bytes_written', 'peak_rss_bytes')
+
+
+
+    def __init__(self):
+
+        self.stages = dict()
+        self.latencies = array.array('d')
+        self.lock = threading.Lock()
+
+
+
+    def stage(self, name, rows_in=0):
+        """Context manager that records one call of a stage. Set rows_out,
+        bytes_read and bytes_written on the object it returns.
+
+        Example:
+            with metrics.stage('clean_data', len(a.data)) as stage:
+                ...
+                stage.rows_out = len(a.data)
+        """
+
+        return StageTimer(self, name, rows_in)
+
+
+
+    def record(self, name, wall_seconds, cpu_seconds, rows_in=0, rows_out=0,
+               bytes_read=0, bytes_written=0, peak_rss=None):
+        """Adds one call of a stage. Without peak_rss the peak RSS of the
+        process so far is recorded."""
+
+        if peak_rss is None:
+            peak_rss = peak_rss_bytes()
+        with self.lock:
+            stage = self.stages.setdefault(name, dict.fromkeys(self.fields, 0))
+            stage['calls'] += 1
+            stage['wall_seconds'] += wall_seconds
+            stage['cpu_seconds'] += cpu_seconds
+            stage['rows_in'] += rows_in
+            stage['rows_out'] += rows_out
+            stage['bytes_read'] += bytes_read
+            stage['bytes_written'] += bytes_written
+            stage['peak_rss_bytes'] = max(stage['peak_rss_bytes'], peak_rss or 0)
+
+        logger.debug('%s: %.3f s wall, %.3f s CPU, %d rows in, %d rows out',
+                     name, wall_seconds, cpu_seconds, rows_in, rows_out)
+
+
+
+    def add_latency(self, seconds):
+        """Adds the latency of one HTTP request."""
+
+        with self.lock:
+            self.latencies.append(seconds)
+
+
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        """Returns a dictionary with the given percentiles of the HTTP request
+        latencies in seconds, like {'p50': 0.41, 'p90': 0.93, 'p99': 2.1}.
+
+        Example: metrics.latency_percentiles()
+        """
+
+        with self.lock:
+            latencies = np.frombuffer(self.latencies, dtype=np.float64).copy()
+
+        if len(latencies) == 0:
+            return {'p' + str(p): None for p in percentiles}
+        values = np.percentile(latencies, percentiles)
+        return {'p' + str(p): float(v) for p, v in zip(percentiles, values)}
+
+
+
+    def summary(self):
+        """Returns a DataFrame with one row per stage.
+
+        Example: print(metrics.summary())
+        """
+
+        with self.lock:
+            rows = [dict(stage=name, **stage) for name, stage in
+                    self.stages.items()]
+        return pd.DataFrame(rows, columns=('stage',) + self.fields).set_index(
+            'stage')
+
+
+
+    def to_dict(self):
+        """Returns all metrics as a dictionary that can be written as JSON."""
+
+        with self.lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+            n_requests = len(self.latencies)
+            latency_sum = sum(self.latencies)
+
+        http = {'requests': n_requests, 'seconds': latency_sum}
+        http.update(self.latency_percentiles())
+        return {'stages': stages, 'http_latency': http}
+
+
+
+    def write_json(self, path):
+        """Writes the metrics to a JSON file.
+
+        Example: metrics.write_json('data/metrics.json')
+        """
+
+        logger.info('Writing metrics to: %s', path)
+        with open(path, 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent=4)
+
+
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text format."""
+
+        metrics = self.to_dict()
+        lines = list()
+        for field in self.fields:
+            name = 'hsa_stage_' + field
+            if field != 'peak_rss_bytes':
+                name += '_total'
+            kind = 'gauge' if field == 'peak_rss_bytes' else 'counter'
+            lines.append('# TYPE ' + name + ' ' + kind)
+            for stage, values in metrics['stages'].items():
+                lines.append(name + '{stage="' + stage + '"} ' +
+                             repr(float(values[field])))
+
+        http = metrics['http_latency']
+        lines.append('# TYPE hsa_http_request_duration_seconds summary')
+        for key, value in http.items():
+            if key.startswith('p') and value is not None:
+                quantile = str(int(key[1:]) / 100)
+                lines.append('hsa_http_request_duration_seconds{quantile="' +
+                             quantile + '"} ' + repr(value))
+        lines.append('hsa_http_request_duration_seconds_sum ' +
+                     repr(float(http['seconds'])))
+        lines.append('hsa_http_request_duration_seconds_count ' +
+                     str(http['requests']))
+        return '\n'.join(lines) + '\n'
+
+
+
+    def write_prometheus(self, path):
+        """Writes the metrics to a Prometheus text file, for example for the
+        textfile collector of the node exporter. The file is written to a
+        temporary file first and then moved in place.
+
+        Example: metrics.write_prometheus('data/metrics.prom')
+        """
+
+        logger.info('Writing metrics to: %s', path)
+        with af.atomic_open(path, 'w') as prometheus_file:
+            prometheus_file.write(self.to_prometheus())
+
+
+
+class StageTimer:
+    """Times one call of a stage for StageMetrics.stage."""
+
+
+
+    def __init__(self, metrics, name, rows_in=0):
+
+        self.metrics = metrics
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+
+
+    def __enter__(self):
+        self.peak_rss = None
+        with _rss_lock:
+            _update_peak_rss()
+            _rss_timers.add(self)
+            reset_peak_rss()
+        self.wall_started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        return self
+
+
+
+    def __exit__(self, *exc):
+        wall_seconds = time.perf_counter() - self.wall_started
+        cpu_seconds = time.process_time() - self.cpu_started
+        with _rss_lock:
+            _update_peak_rss()
+            _rss_timers.discard(self)
+
+        self.metrics.record(self.name, wall_seconds, cpu_seconds,
+                            self.rows_in, self.rows_out, self.bytes_read,
+                            self.bytes_written, self.peak_rss)
+        return False
+
+
+
+def peak_rss_bytes():
+    """Returns the peak resident set size of the process in bytes, or None if
+    neither resource nor psutil is available."""
+
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, 'peak_wset', info.rss)
+
+
+
+def reset_peak_rss():
+    """Resets the peak RSS of the process to its current RSS, on Linux by
+    writing 5 to /proc/self/clear_refs. Returns False where that is not
+    possible."""
+
+    global _resettable
+    if _resettable is False:
+        return False
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs_file:
+            clear_refs_file.write('5')
+        _resettable = high_water_mark_bytes() is not None
+    except OSError:
+        _resettable = False
+    return _resettable
+
+
+
+def high_water_mark_bytes():
+    """Returns the peak RSS of the process since it was last reset, VmHWM in
+    /proc/self/status, or None if there is no such file."""
+
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+
+def _update_peak_rss():
+    """Folds the peak RSS since the last reset into the peaks of the running
+    StageTimers, before it is reset for a stage that starts. Call with
+    _rss_lock held."""
+
+    if not _rss_timers or not _resettable:
+        return
+    peak = high_water_mark_bytes()
+    for timer in _rss_timers:
+        timer.peak_rss = max(timer.peak_rss or 0, peak or 0)
+
+
+
+def file_size(*paths):
+    """Returns the summed size in bytes of the files that exist."""
+
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
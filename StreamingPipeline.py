@@ -0,0 +1,360 @@
+import logging
+import os
+import queue
+import threading
+import time
+import pandas as pd
+import DedupeIndex as di
+import EntityIndex as ei
+import HateSpeechAnalyzer as hsa
+import ParquetStore as ps
+import ScoreRollups as sr
+import SonarScorer as ss
+import StageMetrics as sm
+
+
+logger = logging.getLogger(__name__)
+
+_DONE = object() # Put on a queue after the last chunk.
+
+
+
+class StreamingPipeline:
+    """Class that streams Reddit comments from a RedditDataDL downloader
+    through regex cleaning, cleaning, HateSonar scoring and writing to disk.
+    Every stage runs in its own thread and the stages are connected with
+    bounded queues, so pages are scored and written while later pages are
+    still downloading. A stage that is faster than the next one blocks when
+    the queue in front of that stage is full, which bounds the memory used.
+    Duplicate comments are also removed across chunks with a DedupeIndex. Pass
+    one that is saved and loaded to also remove duplicates across runs, or one
+    with near_duplicates=True to remove near duplicates.
+
+    The scored comments are appended to data.csv in output_path, or written as
+    Parquet files there with storage_format='parquet'. data.csv gets the
+    columns of the first chunk, in every chunk missing ones are left empty
+    and others dropped, so give columns to choose them. All chunks are scored
+    with one SonarScorer, so with n_jobs > 1 the pool of processes and their
+    models are made once per run. A cache, a SonarCache, is used from the
+    hate_sonar thread. stats() returns the rows, busy time and throughput of
+    every stage. The analyzers of every chunk also record into metrics, a
+    StageMetrics, and add their scores to rollups, a ScoreRollups, and to
+    entities, an EntityIndex that every downloaded comment is added to.
+
+    Example:
+        import StreamingPipeline as sp
+        p = sp.StreamingPipeline(d, 'body', output_path, regex=regex_input,
+                                 disallowed=comment_list)
+        p.run()
+        print(p.stats())
+    """
+
+    stages = ('download', 'apply_regex', 'clean_data', 'hate_sonar', 'write')
+
+
+
+    def __init__(self, downloader, column, output_path, regex=None,
+                 disallowed=None, columns=None, pages_per_chunk=10,
+                 queue_size=4, storage_format='csv', batch_size=1000,
+                 n_jobs=1, cache=None, dedupe_index=None, metrics=None,
+                 rollups=None, entities=None):
+
+        self.downloader = downloader
+        self.column = column
+        self.output_path = output_path
+        self.regex = regex
+        self.disallowed = disallowed
+        self.columns = columns
+        self.pages_per_chunk = pages_per_chunk
+        self.queue_size = queue_size
+        self.storage_format = storage_format
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.cache = cache
+
+        self.metrics = metrics if metrics is not None else sm.StageMetrics()
+        self.rollups = rollups if rollups is not None else sr.ScoreRollups()
+        self.entities = entities if entities is not None else ei.EntityIndex()
+        self.counters = {stage: StageCounter(stage) for stage in self.stages}
+        self.removed_items = {'Removed_NaN' : 0,
+                              'Removed_dups' : 0,
+                              'Removed_disallowed' : 0}
+        self.dedupe_index = dedupe_index
+        if dedupe_index is None:
+            self.dedupe_index = di.DedupeIndex()
+        self.errors = list()
+        self.stop = threading.Event()
+        self.scorer = None
+        self.csv_columns = None # The header of data.csv.
+
+
+
+    def run(self):
+        """Runs all stages until the downloader has no more pages and every
+        chunk is written. Raises the first error of any stage.
+
+        Example: p.run()
+        """
+
+        logger.info('Started streaming pipeline for %s.', self.column)
+        os.makedirs(self.output_path, exist_ok=True)
+
+        queues = [queue.Queue(maxsize=self.queue_size)
+                  for _ in range(len(self.stages) - 1)]
+        workers = [self.__download, self.__apply_regex, self.__clean_data,
+                   self.__hate_sonar, self.__write]
+
+        threads = list()
+        for i, work in enumerate(workers):
+            inbox = queues[i - 1] if i > 0 else None
+            outbox = queues[i] if i < len(queues) else None
+            threads.append(threading.Thread(
+                target=self.__run_stage, args=(work, inbox, outbox),
+                name=self.stages[i], daemon=True))
+
+        self.csv_columns = None
+        with ss.SonarScorer(batch_size=self.batch_size, n_jobs=self.n_jobs,
+                            cache=self.cache) as self.scorer:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.scorer = None
+
+        if self.errors:
+            raise self.errors[0]
+
+        logger.info('Streaming pipeline for %s finished.', self.column)
+        return self.stats()
+
+
+
+    def stats(self):
+        """Returns a DataFrame with the chunks, rows in and out, busy seconds
+        and rows per busy second of every stage.
+
+        Example: print(p.stats())
+        """
+
+        return pd.DataFrame([counter.as_dict() for counter in
+                             self.counters.values()]).set_index('Stage')
+
+
+
+    def __run_stage(self, work, inbox, outbox):
+        """Takes chunks from inbox, hands them to work and puts the results on
+        outbox. The download stage has no inbox and the write stage no
+        outbox. Stops all stages on an error."""
+
+        try:
+            if inbox is None:
+                for chunk in work():
+                    if self.stop.is_set():
+                        break
+                    self.__put(outbox, chunk)
+            else:
+                while True:
+                    chunk = self.__get(inbox)
+                    if chunk is _DONE or chunk is None:
+                        break
+                    chunk = work(chunk)
+                    if outbox is not None and len(chunk) > 0:
+                        self.__put(outbox, chunk)
+        except Exception as e:
+            self.errors.append(e)
+            self.stop.set()
+        finally:
+            if outbox is not None:
+                self.__put(outbox, _DONE, force=True)
+
+
+
+    def __put(self, outbox, chunk, force=False):
+        """Blocks while outbox is full, unless the pipeline is stopping."""
+
+        while True:
+            if self.stop.is_set() and not force:
+                return
+            try:
+                outbox.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                if self.stop.is_set():
+                    return
+
+
+
+    def __get(self, inbox):
+        while True:
+            try:
+                return inbox.get(timeout=0.1)
+            except queue.Empty:
+                if self.stop.is_set():
+                    return None
+
+
+
+    def __download(self):
+        """Yields DataFrames of pages_per_chunk pages."""
+
+        counter = self.counters['download']
+        comments = list()
+        pages = 0
+        started = time.perf_counter()
+
+        for page in self.downloader.iter_pages():
+            comments.extend(page)
+            pages += 1
+            if pages == self.pages_per_chunk:
+                chunk = self.__to_frame(comments)
+                counter.add(len(chunk), len(chunk), time.perf_counter() - started)
+                yield chunk
+                comments = list()
+                pages = 0
+                started = time.perf_counter()
+
+        if comments:
+            chunk = self.__to_frame(comments)
+            counter.add(len(chunk), len(chunk), time.perf_counter() - started)
+            yield chunk
+
+
+
+    def __apply_regex(self, chunk):
+        with self.counters['apply_regex'].time(len(chunk)) as counter:
+            if self.regex is not None:
+                a = self.__analyzer(chunk)
+                a.apply_regex(self.column, self.regex)
+                chunk = a.data
+            counter.rows_out = len(chunk)
+        return chunk
+
+
+
+    def __clean_data(self, chunk):
+        """Cleans the chunk and removes the texts kept in earlier chunks."""
+
+        with self.counters['clean_data'].time(len(chunk)) as counter:
+            a = self.__analyzer(chunk)
+            removed_items = a.clean_data(self.column, disallowed=self.disallowed,
+                                         keep_order=True,
+                                         dedupe_index=self.dedupe_index)
+            for key in self.removed_items:
+                self.removed_items[key] += int(removed_items[key][0])
+            chunk = a.data
+            counter.rows_out = len(chunk)
+        return chunk
+
+
+
+    def __hate_sonar(self, chunk):
+        with self.counters['hate_sonar'].time(len(chunk)) as counter:
+            a = self.__analyzer(chunk)
+            a.hate_sonar(self.column, scorer=self.scorer)
+            counter.rows_out = len(a.data)
+        return a.data
+
+
+
+    def __write(self, chunk):
+        """Appends the chunk to the output."""
+
+        n = self.counters['write'].chunks
+        with self.counters['write'].time(len(chunk)) as counter:
+            if self.storage_format == 'parquet':
+                ps.ParquetStore(self.output_path).write(chunk, 'data_' + str(n))
+            else:
+                if n == 0:
+                    self.csv_columns = list(chunk.columns)
+                else:
+                    dropped = chunk.columns.difference(self.csv_columns)
+                    if len(dropped) > 0:
+                        logger.warning('Columns not in data.csv left out: %s',
+                                       ', '.join(map(str, dropped)))
+                    chunk = chunk.reindex(columns=self.csv_columns)
+                path = os.path.join(self.output_path, 'data.csv')
+                chunk.to_csv(path, mode='w' if n == 0 else 'a',
+                             header=(n == 0), index=False)
+            counter.rows_out = len(chunk)
+        return chunk
+
+
+
+    def __to_frame(self, comments):
+        df = pd.json_normalize(comments)
+        if self.columns is not None:
+            df = df.reindex(columns=self.columns)
+        self.entities.add_comments(df)
+        return df
+
+
+
+    def __analyzer(self, chunk):
+        a = hsa.HateSpeechAnalyzer(metrics=self.metrics, rollups=self.rollups,
+                                   entities=self.entities)
+        a.data = chunk
+        return a
+
+
+
+class StageCounter:
+    """Counts the chunks and rows that went through a pipeline stage and the
+    time the stage was busy with them."""
+
+
+
+    def __init__(self, stage):
+
+        self.stage = stage
+        self.chunks = 0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+
+
+    def add(self, rows_in, rows_out, seconds):
+        with self.lock:
+            self.chunks += 1
+            self.rows_in += rows_in
+            self.rows_out += rows_out
+            self.seconds += seconds
+
+
+
+    def time(self, rows_in):
+        """Context manager that times one chunk. Set rows_out on the object it
+        returns."""
+
+        return _TimedChunk(self, rows_in)
+
+
+
+    def as_dict(self):
+        with self.lock:
+            return {'Stage': self.stage,
+                    'Chunks': self.chunks,
+                    'Rows_in': self.rows_in,
+                    'Rows_out': self.rows_out,
+                    'Seconds': self.seconds,
+                    'Rows_per_second': (self.rows_in / self.seconds
+                                        if self.seconds > 0 else 0.0)}
+
+
+
+class _TimedChunk:
+
+    def __init__(self, counter, rows_in):
+        self.counter = counter
+        self.rows_in = rows_in
+        self.rows_out = 0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.counter.add(self.rows_in, self.rows_out,
+                         time.perf_counter() - self.started)
+        return False
@@ -0,0 +1,141 @@
+import array
+import numpy as np
+import LazyModule as lm
+
+
+gensim = lm.LazyModule('gensim')
+sparse = lm.LazyModule('scipy.sparse')
+
+
+
+class TokenCache:
+    """Class that lowercases and tokenizes texts once and keeps the tokens as
+    integer ids, so TF-IDF, word counts, the inverted index and HateSonar can
+    all be run on the texts without lowercasing or tokenizing them again.
+    Texts are tokenized like gensim.utils.simple_preprocess.
+
+    The ids of all texts are kept one after the other in ids, and the ids of
+    text i are ids[offsets[i]:offsets[i + 1]], in the order of its tokens.
+    terms maps the ids to words. The ids are given in the same order as a
+    gensim Dictionary gives them, so count_matrix returns the same matrix and
+    the same Dictionary as doc2bow would. With keep_lowered the lowercased
+    texts are kept in lowered, for HateSonar.
+
+    Example:
+        import TokenCache as tc
+        tokens = tc.TokenCache()
+        tokens.add(a.data['body'])
+        dictionary = gensim.corpora.Dictionary()
+        count_matrix = tokens.count_matrix(dictionary)
+    """
+
+
+
+    def __init__(self, keep_lowered=True):
+
+        self.terms = list()
+        self.term_ids = dict()
+        self.ids = array.array('i')
+        self.offsets = array.array('q', [0])
+        self.lowered = list() if keep_lowered else None
+
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+
+    def add(self, texts):
+        """Lowercases and tokenizes the texts and adds them after the texts
+        added before. New words get the next ids, in the order of the first
+        text they are in and sorted within a text, like doc2bow.
+
+        Example: tokens.add(a.data['body'])
+        """
+
+        simple_tokenize = gensim.utils.simple_tokenize
+        term_ids = self.term_ids
+        for text in texts:
+            lowered = text.lower()
+            if self.lowered is not None:
+                self.lowered.append(lowered)
+
+            tokens = [token for token in simple_tokenize(lowered)
+                      if 2 <= len(token) <= 15 and not token.startswith('_')]
+            for term in sorted({token for token in tokens
+                                if token not in term_ids}):
+                term_ids[term] = len(self.terms)
+                self.terms.append(term)
+            self.ids.extend([term_ids[token] for token in tokens])
+            self.offsets.append(len(self.ids))
+
+
+
+    def tokens(self, position):
+        """Returns the tokens of the text at the given position as words."""
+
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return [self.terms[id] for id in self.ids[start:end]]
+
+
+
+    def term_counts(self):
+        """Returns a dict with the number of times every word occurs in all
+        texts.
+
+        Example: counter.add_counts(tokens.term_counts(), len(tokens))
+        """
+
+        counts = np.bincount(np.array(self.ids, dtype=np.int64),
+                             minlength=len(self.terms))
+        return dict(zip(self.terms, counts.tolist()))
+
+
+
+    def count_matrix(self, dictionary=None):
+        """Returns a CSR matrix with the word counts of every text, one row per
+        text. Without a dictionary the columns are the ids of the cache. With
+        a gensim Dictionary the columns are its ids, new words are added to it
+        and its statistics (dfs, cfs, num_docs, num_pos, num_nnz) are updated,
+        the same as doc2bow with allow_update for every text.
+
+        Example: count_matrix = tokens.count_matrix(state.dictionary)
+        """
+
+        ids = np.array(self.ids, dtype=np.int64)
+        offsets = np.array(self.offsets, dtype=np.int64)
+        if dictionary is None:
+            columns = ids
+            n_columns = len(self.terms)
+        else:
+            columns = self.__dictionary_ids(dictionary)[ids]
+            n_columns = len(dictionary.token2id)
+
+        matrix = sparse.csr_matrix((np.ones(len(ids)), columns, offsets),
+                                   shape=(len(self), n_columns))
+        matrix.sum_duplicates()
+
+        if dictionary is not None:
+            dfs = np.bincount(matrix.indices, minlength=n_columns)
+            cfs = np.bincount(columns, minlength=n_columns)
+            for id in np.flatnonzero(dfs).tolist():
+                dictionary.dfs[id] = dictionary.dfs.get(id, 0) + int(dfs[id])
+                dictionary.cfs[id] = dictionary.cfs.get(id, 0) + int(cfs[id])
+            dictionary.num_docs += len(self)
+            dictionary.num_pos += len(ids)
+            dictionary.num_nnz += matrix.nnz
+        return matrix
+
+
+
+    def __dictionary_ids(self, dictionary):
+        """Returns the id in the dictionary of every id of the cache, adding
+        the words it doesn't have. The cache ids are in the order doc2bow
+        would add the words, so the new words get the same ids as there."""
+
+        token2id = dictionary.token2id
+        dictionary_ids = np.empty(len(self.terms), dtype=np.int64)
+        for id, term in enumerate(self.terms):
+            dictionary_ids[id] = token2id.setdefault(term, len(token2id))
+        return dictionary_ids
@@ -0,0 +1,218 @@
+"""Generates synthetic Reddit corpora in the layout RedditDataDL.get_data
+writes: a data directory with data_0.json, data_1.json, ... holding pages of
+Pushshift comments and a metadata directory with the matching
+metadata_N.json files. Every comment is a pure function of its index and the
+seed, so a corpus is the same on every machine and the mock Pushshift server
+can serve the same comments without reading the files.
+
+Example:
+    python benchmarks/make_corpus.py --size 10k
+    python benchmarks/make_corpus.py --size 1m --duplicate-rate 0.2 --url-rate 0.3
+"""
+
+import argparse
+import json
+import os
+import random
+
+
+sizes = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+
+words = ('the', 'a', 'to', 'and', 'of', 'you', 'i', 'is', 'that', 'it', 'in',
+         'this', 'for', 'not', 'are', 'be', 'with', 'just', 'they', 'have',
+         'what', 'but', 'your', 'so', 'if', 'like', 'women', 'men', 'people',
+         'really', 'about', 'would', 'think', 'want', 'know', 'get', 'she',
+         'he', 'her', 'him', 'when', 'don\'t', 'can\'t', 'good', 'bad', 'time',
+         'life', 'guy', 'girl', 'thread', 'post', 'comment', 'lol', 'damn',
+         'stupid', 'idiot', 'hate', 'love', 'crazy', 'dumb', 'ugly', 'trash',
+         'nice', 'great', 'thanks', 'agree', 'wrong', 'right', 'never',
+         'always', 'everyone', 'nobody', 'work', 'gym', 'money', 'date')
+
+deleted_bodies = ('[deleted]', '[removed]')
+
+authors = ['user_' + str(i) for i in range(5000)]
+
+
+
+class Corpus:
+    """Deterministic synthetic Pushshift comments. Comment i is made at
+    start_utc + i * interval seconds.
+
+    duplicate_rate is the share of comments that repeat an earlier comment
+    within the last window comments, deleted_rate the share that are
+    [deleted] or [removed] and url_rate the share that contain a link.
+    """
+
+
+
+    def __init__(self, n_comments, seed=0, duplicate_rate=0.1,
+                 deleted_rate=0.05, url_rate=0.1, start_utc=1420066800,
+                 interval=3, subreddit='TheRedPill', window=1000):
+
+        self.n_comments = n_comments
+        self.seed = seed
+        self.duplicate_rate = duplicate_rate
+        self.deleted_rate = deleted_rate
+        self.url_rate = url_rate
+        self.start_utc = start_utc
+        self.interval = interval
+        self.subreddit = subreddit
+        self.window = window
+
+
+
+    def comment(self, i):
+        """Returns comment i as a Pushshift comment dictionary."""
+
+        rng = random.Random(self.seed * 1000003 + i)
+        created_utc = self.start_utc + i * self.interval
+        parent = max(0, i - rng.randint(1, 50))
+        return {'all_awardings': [],
+                'author': rng.choice(authors),
+                'author_flair_text': None,
+                'body': self.body(i),
+                'created_utc': created_utc,
+                'edited': rng.choice((False, False, False, created_utc + 60)),
+                'id': _base36(1000000000 + i),
+                'is_submitter': rng.random() < 0.1,
+                'link_id': 't3_' + _base36(1000000 + i // 200),
+                'locked': False,
+                'parent_id': 't1_' + _base36(1000000000 + parent),
+                'permalink': '/r/' + self.subreddit + '/comments/' + _base36(i),
+                'retrieved_on': created_utc + 3600,
+                'score': rng.randint(-20, 200),
+                'stickied': False,
+                'subreddit': self.subreddit,
+                'subreddit_id': 't5_2ve1u',
+                'total_awards_received': 0}
+
+
+
+    def body(self, i):
+        """Returns the text of comment i. A duplicate returns the text of an
+        earlier comment."""
+
+        rng = random.Random(self.seed * 1000003 + i + 7919)
+        while i > 0 and rng.random() < self.duplicate_rate:
+            i -= rng.randint(1, min(i, self.window))
+            rng = random.Random(self.seed * 1000003 + i + 7919)
+
+        if rng.random() < self.deleted_rate:
+            return rng.choice(deleted_bodies)
+
+        text = ' '.join(rng.choice(words) for _ in range(rng.randint(3, 60)))
+        if rng.random() < 0.2:
+            text = '&gt; ' + text
+        if rng.random() < 0.1:
+            text = '@' + rng.choice(authors) + ' ' + text
+        if rng.random() < self.url_rate:
+            text += ' https://www.example.com/r/' + _base36(rng.randint(0, 10**9))
+        if rng.random() < 0.05:
+            text += ' &amp;x200B; \U0001F602'
+        return text
+
+
+
+    def page(self, after=None, before=None, size=100):
+        """Returns the Pushshift response for comments made after after and
+        before before, oldest first, like the API with sort=asc."""
+
+        first = 0
+        if after is not None:
+            first = max(0, (int(after) - self.start_utc) // self.interval + 1)
+        last = self.n_comments
+        if before is not None:
+            last = min(last, -(-(int(before) - self.start_utc) // self.interval))
+
+        comments = [self.comment(i) for i in
+                    range(first, min(first + size, last))]
+        metadata = {'after': after,
+                    'before': before,
+                    'execution_time_milliseconds': 12.5,
+                    'metadata': 'true',
+                    'results_returned': len(comments),
+                    'size': size,
+                    'sort': 'asc',
+                    'sort_type': 'created_utc',
+                    'subreddit': self.subreddit,
+                    'timed_out': False,
+                    'total_results': max(0, last - first)}
+        return {'data': comments, 'metadata': metadata}
+
+
+
+    def write(self, directory_path, page_size=500):
+        """Writes the corpus as data/data_N.json and metadata/metadata_N.json
+        pages in directory_path, like RedditDataDL.get_data. Returns the data
+        and metadata directories."""
+
+        data_directory = os.path.join(directory_path, 'data', '')
+        metadata_directory = os.path.join(directory_path, 'metadata', '')
+        os.makedirs(data_directory, exist_ok=True)
+        os.makedirs(metadata_directory, exist_ok=True)
+
+        after = None
+        for n in range(-(-self.n_comments // page_size)):
+            page = self.page(after, None, page_size)
+            with open(os.path.join(data_directory, 'data_' + str(n) + '.json'),
+                      'w') as json_file:
+                json.dump(page['data'], json_file, indent=4)
+            with open(os.path.join(metadata_directory,
+                                   'metadata_' + str(n) + '.json'),
+                      'w') as json_file:
+                json.dump(page['metadata'], json_file, indent=4)
+            after = page['data'][-1]['created_utc']
+
+        return data_directory, metadata_directory
+
+
+
+def corpus_path(root, size, seed, duplicate_rate, deleted_rate, url_rate):
+    """Directory name that identifies a corpus by all of its settings."""
+
+    name = '{}_seed{}_dup{}_del{}_url{}'.format(size, seed, duplicate_rate,
+                                                deleted_rate, url_rate)
+    return os.path.join(root, name)
+
+
+
+def _base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    text = ''
+    while True:
+        number, digit = divmod(number, 36)
+        text = digits[digit] + text
+        if number == 0:
+            return text
+
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', default='10k',
+                        help='10k, 1m, 10m or a number of comments')
+    parser.add_argument('--out', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'corpora'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--deleted-rate', type=float, default=0.05)
+    parser.add_argument('--url-rate', type=float, default=0.1)
+    parser.add_argument('--page-size', type=int, default=500)
+    return parser.parse_args(args)
+
+
+
+def n_comments(size):
+    return sizes[size] if size in sizes else int(size)
+
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    path = corpus_path(args.out, args.size, args.seed, args.duplicate_rate,
+                       args.deleted_rate, args.url_rate)
+    corpus = Corpus(n_comments(args.size), args.seed, args.duplicate_rate,
+                    args.deleted_rate, args.url_rate)
+    data_directory, metadata_directory = corpus.write(path, args.page_size)
+    print('Wrote', corpus.n_comments, 'comments to', data_directory, 'and',
+          metadata_directory)
@@ -0,0 +1,138 @@
+"""Local mock of the Pushshift comment search API that serves a synthetic
+corpus from make_corpus.Corpus, so RedditDataDL can be benchmarked without
+the network. Every response can be delayed by latency seconds, and every
+fail_every-th request is answered with a 429 or 503 to exercise the retries.
+
+Example:
+    python benchmarks/mock_pushshift.py --size 1m --port 8080 --latency 0.05
+    d = rddl.RedditDataDL('comment', after='1420066800', before='1420096800',
+                          base_url='http://127.0.0.1:8080/reddit/')
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import make_corpus as mc
+
+
+
+class MockPushshift:
+    """Mock Pushshift server running in a background thread.
+
+    Example:
+        server = MockPushshift(mc.Corpus(100000)).start()
+        d = rddl.RedditDataDL(..., base_url=server.base_url)
+        server.stop()
+    """
+
+
+
+    def __init__(self, corpus, host='127.0.0.1', port=0, latency=0.0,
+                 fail_every=0):
+
+        self.corpus = corpus
+        self.latency = latency
+        self.fail_every = fail_every
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.__handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://' + host + ':' + str(port) + '/reddit/'
+
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+
+    def respond(self, path):
+        """Returns the status code, headers and body for a request path."""
+
+        with self.lock:
+            self.requests += 1
+            n = self.requests
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if self.fail_every and n % self.fail_every == 0:
+            status = 429 if n % (2 * self.fail_every) == 0 else 503
+            return status, {'Retry-After': '0'}, b''
+
+        url = urlparse(path)
+        if not url.path.rstrip('/').endswith('search/comment'):
+            return 404, {}, b''
+
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        page = self.corpus.page(query.get('after'), query.get('before'),
+                                int(query.get('size', 100)))
+        if query.get('metadata') != 'true':
+            del page['metadata']
+        body = json.dumps(page).encode('utf-8')
+        return 200, {'Content-Type': 'application/json'}, body
+
+
+
+    def __handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                status, headers, body = mock.respond(self.path)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', default='1m',
+                        help='10k, 1m, 10m or a number of comments')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--deleted-rate', type=float, default=0.05)
+    parser.add_argument('--url-rate', type=float, default=0.1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--fail-every', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = mc.Corpus(mc.n_comments(args.size), args.seed,
+                       args.duplicate_rate, args.deleted_rate, args.url_rate)
+    server = MockPushshift(corpus, args.host, args.port, args.latency,
+                           args.fail_every)
+    print('Serving', corpus.n_comments, 'comments from', corpus.start_utc,
+          'to', corpus.start_utc + corpus.n_comments * corpus.interval,
+          'at', server.base_url)
+    server.server.serve_forever()
@@ -0,0 +1,347 @@
+"""Times every HateSpeechAnalyzer stage on a synthetic corpus and the
+RedditDataDL downloader against the mock Pushshift server, and compares the
+throughput and memory with the baseline stored in baselines.json.
+
+Every stage is timed with StageMetrics: wall and CPU seconds, rows in and
+out, rows per second and the peak RSS of the process during the stage.
+A stage is reported as a regression when its wall time is more than
+tolerance slower than the baseline. Baselines are only comparable on the same
+machine, so record a new one before comparing commits on another machine.
+With --repeat the benchmark is run that many times and every stage is
+reported with its median run, which is steadier than one run on a busy or
+small machine. Record baselines that way. A stage that fails, for example
+hate_sonar when the model can't be loaded, makes the benchmark exit with
+status 1 without saving a baseline. Leave such stages out with --skip.
+
+Example:
+    python benchmarks/run_benchmarks.py --size 10k
+    python benchmarks/run_benchmarks.py --size 1m --repeat 5 --save-baseline
+    python benchmarks/run_benchmarks.py --size 1m --fail-on-regression
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+benchmarks_directory = os.path.dirname(os.path.abspath(__file__))
+repository_directory = os.path.dirname(benchmarks_directory)
+sys.path.insert(0, repository_directory)
+
+import HateSpeechAnalyzer as hsa
+import ParquetStore as ps
+import RedditDataDL as rddl
+import SonarScorer as ss
+import StageMetrics as sm
+import make_corpus as mc
+import mock_pushshift as mp
+
+
+# The same cleaning as main.py.
+comment_list = {'[removed]', '[deleted]', '_URL_'}
+
+regex_input = {r'@\w+' : '@USER ',
+               r'http\S+' : '_URL_ ',
+               r'\s+' : ' ',
+               r'[^!"%-&\'(),./:;?_`A-Za-z0-9\s]' : '',
+               r'&gt;\s' : '',
+               r'&gt;' : '',
+               r'&amp;x200B;' : '',
+               r'^\s+|\s+$' : '',
+               r'^\W+' : ''}
+
+baselines_path = os.path.join(benchmarks_directory, 'baselines.json')
+
+
+
+def load_modules(args):
+    """Imports the modules the analyzer imports lazily, so the import time
+    isn't counted in the first stage that uses them."""
+
+    for module in (hsa.gensim, hsa.sparse, ps.pa, ps.pq):
+        module.load()
+    if 'hate_sonar' not in args.skip:
+        try:
+            ss.hatesonar.load()
+        except Exception: # The hate_sonar stage reports why it fails.
+            pass
+
+
+
+def run(args):
+    """Runs all stages and returns the results as a dictionary."""
+
+    n_comments = mc.n_comments(args.size)
+    corpus = mc.Corpus(n_comments, args.seed, args.duplicate_rate,
+                       args.deleted_rate, args.url_rate)
+    path = mc.corpus_path(args.corpora, args.size, args.seed,
+                          args.duplicate_rate, args.deleted_rate, args.url_rate)
+    if not os.path.exists(os.path.join(path, 'metadata')):
+        print('Generating corpus in', path)
+        corpus.write(path)
+
+    load_modules(args)
+    bench = sm.StageMetrics()
+    failed = dict()
+    output = tempfile.mkdtemp(prefix='hsa_benchmark_')
+
+    try:
+        a = hsa.HateSpeechAnalyzer()
+        with bench.stage('load_json') as stage:
+            a.load_json(os.path.join(path, 'data', ''),
+                        os.path.join(path, 'metadata', ''),
+                        n_workers=args.n_workers)
+            stage.rows_out = len(a.data)
+            stage.bytes_read = sm.file_size(*[
+                os.path.join(directory, name)
+                for directory in (a.data_directory_path,
+                                  a.metadata_directory_path)
+                for name in os.listdir(directory)])
+
+        # Write next to the temporary directory instead of into the corpus.
+        a.data_directory_path = os.path.join(output, 'data', '')
+        a.metadata_directory_path = os.path.join(output, 'metadata', '')
+
+        with bench.stage('apply_regex', len(a.data)) as stage:
+            a.apply_regex('body', regex_input)
+            stage.rows_out = len(a.data)
+
+        with bench.stage('clean_data', len(a.data)) as stage:
+            a.clean_data('body', disallowed=comment_list)
+            stage.rows_out = len(a.data)
+
+        if 'hate_sonar' not in args.skip:
+            try:
+                with bench.stage('hate_sonar', len(a.data)) as stage:
+                    a.hate_sonar('body', batch_size=args.batch_size,
+                                 n_jobs=args.n_jobs)
+                    stage.rows_out = len(a.data)
+            except Exception as e:
+                bench.stages.pop('hate_sonar', None)
+                failed['hate_sonar'] = repr(e)
+
+        with bench.stage('tf_idf_matrix', len(a.data)) as stage:
+            matrix, _ = a.tf_idf_matrix('body')
+            stage.rows_out = matrix.shape[0]
+
+        with bench.stage('tf_idf', len(a.data)) as stage:
+            _, count_df = a.tf_idf('body')
+            stage.rows_out = len(count_df)
+
+        with bench.stage('write_csv', len(a.data)) as stage:
+            a.write_data_csv()
+            stage.rows_out = len(a.data)
+            stage.bytes_written = sm.file_size(os.path.join(output, 'data.csv'))
+
+        with bench.stage('write_parquet', len(a.data)) as stage:
+            a.write_data_parquet()
+            stage.rows_out = len(a.data)
+
+        del a
+
+        latency = dict()
+        if 'download' not in args.skip:
+            latency = download(args, corpus, bench, output)
+    finally:
+        shutil.rmtree(output, ignore_errors=True)
+
+    stages = dict()
+    for name, values in bench.to_dict()['stages'].items():
+        rows = max(values['rows_in'], values['rows_out'])
+        values['rows_per_second'] = (rows / values['wall_seconds']
+                                     if values['wall_seconds'] > 0 else 0.0)
+        stages[name] = values
+
+    return {'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'machine': {'platform': platform.platform(),
+                        'processor': platform.processor(),
+                        'cpus': os.cpu_count(),
+                        'python': platform.python_version()},
+            'corpus': {'size': args.size,
+                       'comments': n_comments,
+                       'seed': args.seed,
+                       'duplicate_rate': args.duplicate_rate,
+                       'deleted_rate': args.deleted_rate,
+                       'url_rate': args.url_rate},
+            'stages': stages,
+            'failed': failed,
+            'http_latency': latency}
+
+
+
+def median_result(results):
+    """Returns the first result with every stage replaced by the one of the
+    run with the median wall time of that stage."""
+
+    result = dict(results[0], stages=dict())
+    for name in results[0]['stages']:
+        runs = sorted((r['stages'][name] for r in results
+                       if name in r['stages']),
+                      key=lambda values: values['wall_seconds'])
+        result['stages'][name] = runs[len(runs) // 2]
+    result['failed'] = {name: reason for r in results
+                        for name, reason in r['failed'].items()}
+    result['repeat'] = len(results)
+    return result
+
+
+
+def download(args, corpus, bench, output):
+    """Downloads download_comments comments from the mock server, once page
+    by page and once in time slices. Returns the HTTP latency percentiles."""
+
+    n = min(args.download_comments, corpus.n_comments)
+    after = str(corpus.start_utc - 1)
+    before = str(corpus.start_utc + n * corpus.interval)
+    server = mp.MockPushshift(corpus, latency=args.latency,
+                              fail_every=args.fail_every).start()
+    metrics = sm.StageMetrics()
+    working_directory = os.getcwd()
+
+    try:
+        os.chdir(output)
+        os.makedirs('data', exist_ok=True)
+
+        for name, concurrent in (('download', False),
+                                 ('download_concurrent', True)):
+            subreddit = corpus.subreddit + '_' + name
+            d = rddl.RedditDataDL('comment', size=500, subreddit=subreddit,
+                                  after=after, before=before,
+                                  base_url=server.base_url, backoff=0.0,
+                                  metrics=metrics)
+            with bench.stage(name, n) as stage:
+                if concurrent:
+                    data_directory, _ = d.get_data_concurrent(
+                        n_slices=args.n_slices, requests_per_second=1000.0)
+                else:
+                    data_directory, _ = d.get_data()
+                stage.rows_out = n
+                stage.bytes_written = sm.file_size(*[
+                    os.path.join(data_directory, file_name)
+                    for file_name in os.listdir(data_directory)])
+    finally:
+        os.chdir(working_directory)
+        server.stop()
+
+    return metrics.to_dict()['http_latency']
+
+
+
+def compare(result, baseline, tolerance):
+    """Prints the stages next to the baseline and returns the names of the
+    stages whose wall time is more than tolerance slower."""
+
+    regressions = list()
+    print('\n{:<20} {:>12} {:>12} {:>8} {:>14} {:>14}'.format(
+        'Stage', 'Seconds', 'Baseline', 'Ratio', 'Rows/s', 'Peak RSS MB'))
+
+    for name, values in result['stages'].items():
+        old = baseline.get('stages', {}).get(name) if baseline else None
+        ratio = ''
+        old_seconds = ''
+        if old is not None and old['wall_seconds'] > 0:
+            old_seconds = '{:.3f}'.format(old['wall_seconds'])
+            change = values['wall_seconds'] / old['wall_seconds']
+            ratio = '{:.2f}'.format(change)
+            if change > 1 + tolerance:
+                regressions.append(name)
+                ratio += ' !'
+        print('{:<20} {:>12.3f} {:>12} {:>8} {:>14.0f} {:>14.1f}'.format(
+            name, values['wall_seconds'], old_seconds, ratio,
+            values['rows_per_second'], values['peak_rss_bytes'] / 2**20))
+
+    if result['http_latency']:
+        print('\nHTTP latency:', result['http_latency'])
+    for name, reason in result['failed'].items():
+        print('Failed', name + ':', reason)
+    return regressions
+
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=repository_directory,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def load_baselines():
+    if not os.path.exists(baselines_path):
+        return dict()
+    with open(baselines_path, 'r') as baselines_file:
+        return json.load(baselines_file)
+
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', default='10k',
+                        help='10k, 1m, 10m or a number of comments')
+    parser.add_argument('--corpora', default=os.path.join(
+        benchmarks_directory, 'corpora'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--deleted-rate', type=float, default=0.05)
+    parser.add_argument('--url-rate', type=float, default=0.1)
+    parser.add_argument('--n-workers', type=int, default=1,
+                        help='files parsed at the same time by load_json')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='processes that run HateSonar')
+    parser.add_argument('--download-comments', type=int, default=20000)
+    parser.add_argument('--n-slices', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='seconds the mock server waits per request')
+    parser.add_argument('--fail-every', type=int, default=50,
+                        help='every n-th request gets a 429 or 503')
+    parser.add_argument('--skip', nargs='*', default=[],
+                        choices=['hate_sonar', 'download'])
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs to take the median stage times of')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    return parser.parse_args(args)
+
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    result = median_result([run(args) for _ in range(args.repeat)])
+    baselines = load_baselines()
+    regressions = compare(result, baselines.get(args.size), args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(result, output_file, indent=4)
+
+    if result['failed']:
+        print('\nStages failed:', ', '.join(result['failed']))
+        if args.save_baseline:
+            print('No baseline saved, fix the stages or leave them out with '
+                  '--skip.')
+        sys.exit(1)
+
+    if args.save_baseline:
+        baselines[args.size] = result
+        with open(baselines_path, 'w') as baselines_file:
+            json.dump(baselines, baselines_file, indent=4, sort_keys=True)
+        print('\nSaved baseline for', args.size, 'in', baselines_path)
+
+    if regressions:
+        print('\nSlower than the baseline:', ', '.join(regressions))
+        if args.fail_on_regression:
+            sys.exit(1)
@@ -1,10 +1,20 @@
+import logging
 import HateSpeechAnalyzer as hsa
 import RedditDataDL as rddl
+import StageMetrics as sm
 import pandas as pd
 
+# Log the progress of every step with a time stamp.
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+# Records the time, rows, bytes and memory of every step.
+metrics = sm.StageMetrics()
+
 # Initialize RedditDataDL with parameters according to https://github.com/pushshift/api
 d = rddl.RedditDataDL(endpoint='comment', before="1612134000",
-                               after="1420066800",subreddit='TheRedPill')
+                               after="1420066800",subreddit='TheRedPill',
+                               metrics=metrics)
 
 # Download the Reddit data.
 data_dir, metadata_dir = d.get_data()
@@ -12,7 +22,7 @@ data_dir, metadata_dir = d.get_data()
 
 
 # Initialize HateSpeechAnalyzer.
-a = hsa.HateSpeechAnalyzer()
+a = hsa.HateSpeechAnalyzer(metrics=metrics)
 
 
 # Load the Reddit data that was downloaded into the HateSpeechAnalyzer.
@@ -48,6 +58,11 @@ removed_items = a.clean_data('body', disallowed=comment_list)
 removed_items.to_csv(data_dir[:-5] + 'removed_items.csv')
 
 
+# Lowercase and tokenize the comments once, hate_sonar and tf_idf use the
+# tokens instead of doing it again.
+a.tokenize('body')
+
+
 # Run the data in given column through the HateSonar module (https://github.com/Hironsan/HateSonar)
 # The new data created is saved in the correct row in the a.data DataFrame.
 a.hate_sonar('body')
@@ -61,4 +76,10 @@ count_df.to_csv(data_dir[:-5] + 'word_count.csv')
 
 
 # Write data and metadata to .csv files.
-a.write_csv()
\ No newline at end of file
+a.write_csv()
+
+
+# Write where the time of the run went, as JSON and for Prometheus.
+print(metrics.summary())
+metrics.write_json(data_dir[:-5] + 'metrics.json')
+metrics.write_prometheus(data_dir[:-5] + 'metrics.prom')
\ No newline at end of file